@@ -0,0 +1,319 @@
+#!/usr/bin/env python3
+""" Native python driver for the BQ27441 fuel gauge.
+
+    This mirrors the register map used by bq27441_lib.sh but talks to the
+    device directly through a single open /dev/i2c-N file descriptor instead
+    of forking i2cget for every register.
+
+    Usage:
+
+        gauge = BQ27441(SMBus(1), 0x55)
+        snapshot = gauge.snapshot()
+        print(snapshot.state_of_charge, snapshot.is_discharging)
+
+    A FakeBus backend is provided so that code using this driver can be run
+    without any hardware attached.
+"""
+
+import collections
+import ctypes
+import fcntl
+import os
+import struct
+
+
+# -----------------------------------------------------------------------------
+# Register map (see bq27441_lib.sh and the BQ27441-G1 technical reference)
+# -----------------------------------------------------------------------------
+CONTROL = 0x00
+TEMPERATURE = 0x02
+VOLTAGE = 0x04
+FLAGS = 0x06
+NOMINAL_AVAILABLE_CAPACITY = 0x08
+FULL_AVAILABLE_CAPACITY = 0x0A
+REMAINING_CAPACITY = 0x0C
+FULL_CHARGE_CAPACITY = 0x0E
+AVERAGE_CURRENT = 0x10
+STANDBY_CURRENT = 0x12
+MAX_LOAD_CURRENT = 0x14
+AVERAGE_POWER = 0x18
+STATE_OF_CHARGE = 0x1C
+INTERNAL_TEMPERATURE = 0x1E
+STATE_OF_HEALTH = 0x20
+OPCONFIG = 0x3A
+DATA_CLASS = 0x3E
+DATA_BLOCK = 0x3F
+BLOCK_DATA = 0x40
+BLOCK_DATA_CHECKSUM = 0x60
+BLOCK_DATA_CONTROL = 0x61
+
+# control register subcommands
+CONTROL_STATUS = 0x0000
+SET_CFGUPDATE = 0x0013
+SEALED = 0x0020
+SOFT_RESET = 0x0042
+UNSEAL_KEY = 0x8000
+
+# control status bits
+STATUS_SHUTDOWNEN = 0x8000
+STATUS_WDRESET = 0x4000
+STATUS_SS = 0x2000
+STATUS_CALMODE = 0x1000
+STATUS_CCA = 0x0800
+STATUS_BCA = 0x0400
+STATUS_QMAXUP = 0x0200
+STATUS_RESUP = 0x0100
+STATUS_INITCOMP = 0x0080
+STATUS_HIBERNATE = 0x0040
+STATUS_SLEEP = 0x0010
+STATUS_LDMD = 0x0008
+STATUS_RUPDIS = 0x0004
+STATUS_VOK = 0x0002
+
+# flags register bits
+FLAG_DSG = 0x0001
+FLAG_SOCF = 0x0002
+FLAG_SOC1 = 0x0004
+FLAG_BAT_DET = 0x0008
+FLAG_CFGUPMODE = 0x0010
+FLAG_ITPOR = 0x0020
+FLAG_OCVTAKEN = 0x0080
+FLAG_CHG = 0x0100
+FLAG_FC = 0x0200
+FLAG_UT = 0x4000
+FLAG_OT = 0x8000
+
+# The runtime registers needed by the status overlay are all laid out
+# contiguously between TEMPERATURE and STATE_OF_CHARGE, so they can be read
+# with one incremental read instead of one transaction per register.
+SNAPSHOT_START = TEMPERATURE
+SNAPSHOT_LENGTH = STATE_OF_CHARGE + 2 - TEMPERATURE
+
+
+FuelGaugeSnapshot = collections.namedtuple("FuelGaugeSnapshot", [
+    "state_of_charge",      # percent (0 - 100)
+    "flags",                # raw flags register
+    "voltage",              # millivolts
+    "average_current",      # milliamps, negative while discharging
+    "temperature",          # 0.1 Kelvin
+    "remaining_capacity",   # mAh
+    "full_charge_capacity", # mAh
+])
+FuelGaugeSnapshot.is_discharging = property(lambda self: bool(self.flags & FLAG_DSG))
+FuelGaugeSnapshot.temperature_celsius = property(lambda self: self.temperature / 10.0 - 273.15)
+
+
+# -----------------------------------------------------------------------------
+# Bus backends
+# -----------------------------------------------------------------------------
+class _I2CMsg(ctypes.Structure):
+    _fields_ = [
+        ("addr", ctypes.c_uint16),
+        ("flags", ctypes.c_uint16),
+        ("len", ctypes.c_uint16),
+        ("buf", ctypes.POINTER(ctypes.c_uint8)),
+    ]
+
+
+class _I2CRdwrIoctlData(ctypes.Structure):
+    _fields_ = [
+        ("msgs", ctypes.POINTER(_I2CMsg)),
+        ("nmsgs", ctypes.c_uint32),
+    ]
+
+
+class SMBus(object):
+    """ Minimal i2c-dev backend. Keeps one file descriptor to /dev/i2c-N open
+        for the lifetime of the object.
+    """
+    I2C_SLAVE = 0x0703
+    I2C_RDWR = 0x0707
+    I2C_M_RD = 0x0001
+
+    def __init__(self, bus_id):
+        self.bus_id = bus_id
+        self.fd = os.open("/dev/i2c-%d" % bus_id, os.O_RDWR)
+        self.address = None
+
+    def close(self):
+        if self.fd is not None:
+            os.close(self.fd)
+            self.fd = None
+
+    def _set_address(self, address):
+        if self.address != address:
+            fcntl.ioctl(self.fd, self.I2C_SLAVE, address)
+            self.address = address
+
+    def read_block(self, address, register, length):
+        """ Read `length` bytes starting at `register` in a single combined
+            write/read transaction (repeated start, no stop in between).
+        """
+        write_buf = (ctypes.c_uint8 * 1)(register)
+        read_buf = (ctypes.c_uint8 * length)()
+
+        msgs = (_I2CMsg * 2)(
+            _I2CMsg(address, 0, 1, write_buf),
+            _I2CMsg(address, self.I2C_M_RD, length, read_buf),
+        )
+        request = _I2CRdwrIoctlData(msgs, 2)
+        fcntl.ioctl(self.fd, self.I2C_RDWR, request)
+
+        return bytes(read_buf)
+
+    def read_word(self, address, register):
+        return struct.unpack("<H", self.read_block(address, register, 2))[0]
+
+    def write_word(self, address, register, value):
+        self._set_address(address)
+        os.write(self.fd, struct.pack("<BH", register, value & 0xFFFF))
+
+    def write_byte(self, address, register, value):
+        self._set_address(address)
+        os.write(self.fd, struct.pack("<BB", register, value & 0xFF))
+
+
+class FakeBus(object):
+    """ In-memory stand in for SMBus. Registers are stored as a flat byte
+        array per device address so that block reads behave like the real
+        incremental reads on the bq27441.
+
+        `transactions` counts the number of bus transactions performed.
+    """
+
+    def __init__(self, registers=None, address=0x55):
+        self.memory = {address: bytearray(256)}
+        self.transactions = 0
+        self.writes = []
+        for register, value in (registers or {}).items():
+            self.set_word(register, value, address)
+
+    def close(self):
+        pass
+
+    def set_word(self, register, value, address=0x55):
+        memory = self.memory.setdefault(address, bytearray(256))
+        memory[register:register + 2] = struct.pack("<H", value & 0xFFFF)
+
+    def read_block(self, address, register, length):
+        self.transactions += 1
+        memory = self.memory.setdefault(address, bytearray(256))
+        return bytes(memory[register:register + length])
+
+    def read_word(self, address, register):
+        return struct.unpack("<H", self.read_block(address, register, 2))[0]
+
+    def write_word(self, address, register, value):
+        self.transactions += 1
+        self.writes.append((register, value))
+        if register == CONTROL and value == CONTROL_STATUS:
+            # the real device latches the status word into CONTROL
+            return
+        self.set_word(register, value, address)
+
+    def write_byte(self, address, register, value):
+        self.transactions += 1
+        self.writes.append((register, value))
+        self.memory.setdefault(address, bytearray(256))[register] = value & 0xFF
+
+
+# -----------------------------------------------------------------------------
+# Fuel gauge driver
+# -----------------------------------------------------------------------------
+class BQ27441(object):
+    """ Register level driver for the bq27441 fuel gauge.
+    """
+
+    def __init__(self, bus, address=0x55):
+        self.bus = bus
+        self.address = address
+
+    def close(self):
+        self.bus.close()
+
+    def read_word(self, register):
+        return self.bus.read_word(self.address, register)
+
+    def read_signed_word(self, register):
+        value = self.read_word(register)
+        return value - 0x10000 if value & 0x8000 else value
+
+    def snapshot(self):
+        """ Read every runtime register the status overlay needs in one bus
+            transaction and return a FuelGaugeSnapshot.
+        """
+        data = self.bus.read_block(self.address, SNAPSHOT_START, SNAPSHOT_LENGTH)
+
+        def word(register, fmt="<H"):
+            offset = register - SNAPSHOT_START
+            return struct.unpack(fmt, data[offset:offset + 2])[0]
+
+        return FuelGaugeSnapshot(
+            state_of_charge=word(STATE_OF_CHARGE),
+            flags=word(FLAGS),
+            voltage=word(VOLTAGE),
+            average_current=word(AVERAGE_CURRENT, "<h"),
+            temperature=word(TEMPERATURE),
+            remaining_capacity=word(REMAINING_CAPACITY),
+            full_charge_capacity=word(FULL_CHARGE_CAPACITY),
+        )
+
+    def get_battery_percentage(self):
+        return self.read_word(STATE_OF_CHARGE)
+
+    def read_flags(self):
+        return self.read_word(FLAGS)
+
+    def is_discharging(self):
+        return bool(self.read_flags() & FLAG_DSG)
+
+    def get_voltage(self):
+        """ Returns battery voltage in volts
+        """
+        return self.read_word(VOLTAGE) / 1000.0
+
+    def get_average_current(self):
+        """ Returns average current in mA (negative while discharging)
+        """
+        return self.read_signed_word(AVERAGE_CURRENT)
+
+    def get_temperature(self, unit="f"):
+        """ Returns the temperature in Fahrenheit (f), Celsius (c) or Kelvin (k)
+        """
+        kelvin = self.read_word(TEMPERATURE) // 10
+        if unit == "k":
+            return kelvin
+        if unit == "c":
+            return kelvin - 273
+        return (kelvin - 273) * 9 // 5 + 32
+
+    def read_control_status(self):
+        self.bus.write_word(self.address, CONTROL, CONTROL_STATUS)
+        return self.read_word(CONTROL)
+
+    def read_opconfig(self):
+        return self.read_word(OPCONFIG)
+
+    def is_sealed(self):
+        return bool(self.read_control_status() & STATUS_SS)
+
+    def soft_reset(self):
+        self.bus.write_word(self.address, CONTROL, SOFT_RESET)
+
+
+def open_fuel_gauge(bus_id, address):
+    """ Convenience constructor for a hardware backed fuel gauge
+    """
+    return BQ27441(SMBus(bus_id), address)
+
+
+if __name__ == '__main__':
+    import sys
+
+    if len(sys.argv) != 3:
+        print("Usage: bq27441.py [I2C_BUS_ID] [DEVICE_ID]")
+        sys.exit(1)
+
+    gauge = open_fuel_gauge(int(sys.argv[1], 0), int(sys.argv[2], 0))
+    print(gauge.snapshot())
+    gauge.close()
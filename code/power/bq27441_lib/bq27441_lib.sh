@@ -67,35 +67,42 @@ read_control_status () {
   then
     echo $STATUS
   else
-    if (( $STATUS & 0x8000 )); then SHUTDOWNEN="true" ; else SHUTDOWNEN="false" ; fi
-    if (( $STATUS & 0x4000 )); then WDRESET="true"    ; else WDRESET="false"    ; fi
-    if (( $STATUS & 0x2000 )); then SS="true"         ; else SS="false"         ; fi
-    if (( $STATUS & 0x1000 )); then CALMODE="true"    ; else CALMODE="false"    ; fi
-    if (( $STATUS & 0x0800 )); then CCA="true"        ; else CCA="false"        ; fi
-    if (( $STATUS & 0x0400 )); then BCA="true"        ; else BCA="false"        ; fi
-    if (( $STATUS & 0x0200 )); then QMAXUP="true"     ; else QMAXUP="false"     ; fi
-    if (( $STATUS & 0x0100 )); then RESUP="true"      ; else RESUP="false"      ; fi
-
-    if (( $STATUS & 0x0080 )); then INITCOMP="true"   ; else INITCOMP="false"   ; fi
-    if (( $STATUS & 0x0040 )); then HIBERNATE="true"  ; else HIBERNATE="false"  ; fi
-    if (( $STATUS & 0x0010 )); then SLEEP="true"      ; else SLEEP="false"      ; fi
-    if (( $STATUS & 0x0008 )); then LDMD="true"       ; else LDMD="false"       ; fi
-    if (( $STATUS & 0x0004 )); then RUPDIS="true"     ; else RUPDIS="false"     ; fi
-    if (( $STATUS & 0x0002 )); then VOK="true"        ; else ROK="false"        ; fi
-
-    printf "Control Register Status: 0x%04x\n" $STATUS
-    echo "------------------------"
-    printf "Shutdown Enabled: %s\n" $SHUTDOWNEN
-    printf "Watchdog Reset: %s\n" $WDRESET
-    printf "Sealed: %s\n" $SS
-    printf "Columb Counter Auto Calibration: %s\n" $CCA
-    printf "Board Calibration Routine Active: %s\n" $BCA
-    printf "Qmax updated: %s\n" $QMAXUP
-    printf "Resistance Updated: %s\n" $RESUP
-    echo ""
+    print_control_status $STATUS
   fi
 }
 
+## human readable decoding of a control status word
+print_control_status () {
+  local STATUS=$1
+
+  if (( $STATUS & 0x8000 )); then SHUTDOWNEN="true" ; else SHUTDOWNEN="false" ; fi
+  if (( $STATUS & 0x4000 )); then WDRESET="true"    ; else WDRESET="false"    ; fi
+  if (( $STATUS & 0x2000 )); then SS="true"         ; else SS="false"         ; fi
+  if (( $STATUS & 0x1000 )); then CALMODE="true"    ; else CALMODE="false"    ; fi
+  if (( $STATUS & 0x0800 )); then CCA="true"        ; else CCA="false"        ; fi
+  if (( $STATUS & 0x0400 )); then BCA="true"        ; else BCA="false"        ; fi
+  if (( $STATUS & 0x0200 )); then QMAXUP="true"     ; else QMAXUP="false"     ; fi
+  if (( $STATUS & 0x0100 )); then RESUP="true"      ; else RESUP="false"      ; fi
+
+  if (( $STATUS & 0x0080 )); then INITCOMP="true"   ; else INITCOMP="false"   ; fi
+  if (( $STATUS & 0x0040 )); then HIBERNATE="true"  ; else HIBERNATE="false"  ; fi
+  if (( $STATUS & 0x0010 )); then SLEEP="true"      ; else SLEEP="false"      ; fi
+  if (( $STATUS & 0x0008 )); then LDMD="true"       ; else LDMD="false"       ; fi
+  if (( $STATUS & 0x0004 )); then RUPDIS="true"     ; else RUPDIS="false"     ; fi
+  if (( $STATUS & 0x0002 )); then VOK="true"        ; else ROK="false"        ; fi
+
+  printf "Control Register Status: 0x%04x\n" $STATUS
+  echo "------------------------"
+  printf "Shutdown Enabled: %s\n" $SHUTDOWNEN
+  printf "Watchdog Reset: %s\n" $WDRESET
+  printf "Sealed: %s\n" $SS
+  printf "Columb Counter Auto Calibration: %s\n" $CCA
+  printf "Board Calibration Routine Active: %s\n" $BCA
+  printf "Qmax updated: %s\n" $QMAXUP
+  printf "Resistance Updated: %s\n" $RESUP
+  echo ""
+}
+
 read_flags () {
   local VERBOSE="${1:-false}"
 
@@ -105,37 +112,44 @@ read_flags () {
   then
     echo $FLAGS
   else
-    if (( FLAGS & 0x0001 )); then DISCHARGING="true"  ; else DISCHARGING="false"  ; fi
-    if (( FLAGS & 0x0002 )); then SOCF="true"         ; else SOCF="false"         ; fi
-    if (( FLAGS & 0x0004 )); then SOC1="true"         ; else SOC1="false"         ; fi
-    if (( FLAGS & 0x0008 )); then BAT_DET="true"      ; else BAT_DET="false"      ; fi
-
-    if (( FLAGS & 0x0010 )); then CFGUPDATE="true"    ; else CFGUPDATE="false"    ; fi
-    if (( FLAGS & 0x0020 )); then ITPOR="true"        ; else ITPOR="false"        ; fi
-    if (( FLAGS & 0x0080 )); then OCVTAKEN="true"     ; else OCVTAKEN="false"     ; fi
-
-    if (( FLAGS & 0x0100 )); then FASTCHARGING="true" ; else FASTCHARGING="false" ; fi
-    if (( FLAGS & 0x0200 )); then FULLCHARGE="true"   ; else FULLCHARGE="false"   ; fi
-
-    if (( FLAGS & 0x4000 )); then UNDERTEMP="true" ; else UNDERTEMP="false"; fi
-    if (( FLAGS & 0x8000 )); then OVERTEMP="true" ; else OVERTEMP="false"; fi
-
-    printf "Flags Register: 0x%04x\n" $FLAGS
-    echo "------------------------"
-    printf "OVER TEMP DETECTED: %s\n" $OVERTEMP
-    printf "UNDER TEMP DETECTED: %s\n" $UNDERTEMP
-    printf "FULL CHARGE DETECTED: %s\n" $FULLCHARGE
-    printf "FAST CHARGING ENABLED: %s\n" $FASTCHARGING
-    printf "OCV MEASUREMENT TAKEN: %s\n" $OCVTAKEN
-    printf "POR OR RESET OCCURRED: %s\n" $ITPOR
-    printf "CFG UPDATE MODE: %s\n" $CFGUPDATE
-    printf "BATTERY INSERTION DETECTED: %s\n" $BAT_DET
-    printf "STATE OF CHARGE < THRESHOLD 1: %s\n" $SOC1
-    printf "STATE OF CHARGE < THRESHOLD F: %s\n" $SOCF
-    echo ""
+    print_flags $FLAGS
   fi
 }
 
+## human readable decoding of a flags register value
+print_flags () {
+  local FLAGS=$1
+
+  if (( FLAGS & 0x0001 )); then DISCHARGING="true"  ; else DISCHARGING="false"  ; fi
+  if (( FLAGS & 0x0002 )); then SOCF="true"         ; else SOCF="false"         ; fi
+  if (( FLAGS & 0x0004 )); then SOC1="true"         ; else SOC1="false"         ; fi
+  if (( FLAGS & 0x0008 )); then BAT_DET="true"      ; else BAT_DET="false"      ; fi
+
+  if (( FLAGS & 0x0010 )); then CFGUPDATE="true"    ; else CFGUPDATE="false"    ; fi
+  if (( FLAGS & 0x0020 )); then ITPOR="true"        ; else ITPOR="false"        ; fi
+  if (( FLAGS & 0x0080 )); then OCVTAKEN="true"     ; else OCVTAKEN="false"     ; fi
+
+  if (( FLAGS & 0x0100 )); then FASTCHARGING="true" ; else FASTCHARGING="false" ; fi
+  if (( FLAGS & 0x0200 )); then FULLCHARGE="true"   ; else FULLCHARGE="false"   ; fi
+
+  if (( FLAGS & 0x4000 )); then UNDERTEMP="true" ; else UNDERTEMP="false"; fi
+  if (( FLAGS & 0x8000 )); then OVERTEMP="true" ; else OVERTEMP="false"; fi
+
+  printf "Flags Register: 0x%04x\n" $FLAGS
+  echo "------------------------"
+  printf "OVER TEMP DETECTED: %s\n" $OVERTEMP
+  printf "UNDER TEMP DETECTED: %s\n" $UNDERTEMP
+  printf "FULL CHARGE DETECTED: %s\n" $FULLCHARGE
+  printf "FAST CHARGING ENABLED: %s\n" $FASTCHARGING
+  printf "OCV MEASUREMENT TAKEN: %s\n" $OCVTAKEN
+  printf "POR OR RESET OCCURRED: %s\n" $ITPOR
+  printf "CFG UPDATE MODE: %s\n" $CFGUPDATE
+  printf "BATTERY INSERTION DETECTED: %s\n" $BAT_DET
+  printf "STATE OF CHARGE < THRESHOLD 1: %s\n" $SOC1
+  printf "STATE OF CHARGE < THRESHOLD F: %s\n" $SOCF
+  echo ""
+}
+
 read_opconfig () {
   local VERBOSE="${1:-false}"
 
@@ -145,27 +159,34 @@ read_opconfig () {
   then
     echo $OPCONFIG
   else
-    if (( OPCONFIG & 0x0001 )); then TEMPS="FROM HOST"                   ; else TEMPS="INTERNAL"            ; fi
-    if (( OPCONFIG & 0x0004 )); then BATLOWEN="INTERRUPT ON BATTERY LOW" ; else BATLOWEN="INTERRUPT ON SOC" ; fi
-    if (( OPCONFIG & 0x0010 )); then RMFCC="true"                        ; else RMFCC="false"               ; fi
-    if (( OPCONFIG & 0x0020 )); then SLEEP="true"                        ; else SLEEP="false"               ; fi
-    if (( OPCONFIG & 0x0800 )); then GPIOPOL="ACTIVE HIGH"               ; else GPIOPOL="ACTIVE LOW"        ; fi
-    if (( OPCONFIG & 0x1000 )); then BI_PU_EN="Pull up enabled"          ; else BI_PU_EN="None"             ; fi
-    if (( OPCONFIG & 0x2000 )); then BIE="AUTOMATIC"                     ; else BIE="MANUAL"                ; fi
-
-    printf "OpConfig Register: 0x%04x\n" $OPCONFIG
-    echo "------------------------"
-    printf "TEMPERATURE SOURCE: %s\n" "$TEMPS"
-    printf "INTERRUPT CONFIG (BATLOWEN): %s\n" "$BATLOWEN"
-    printf "RMFCC: %s\n" "$RMFCC"
-    printf "ENTER SLEEP ENABLED: %s\n" "$SLEEP"
-    printf "GPIOPOL: %s\n" "$GPIOPOL"
-    printf "BIE PULLUP ENABLE: %s\n" "$BI_PU_EN"
-    printf "BATTERY INSERTION ENABLE: %s\n" "$BIE"
-    echo ""
+    print_opconfig $OPCONFIG
   fi
 }
 
+## human readable decoding of an OpConfig register value
+print_opconfig () {
+  local OPCONFIG=$1
+
+  if (( OPCONFIG & 0x0001 )); then TEMPS="FROM HOST"                   ; else TEMPS="INTERNAL"            ; fi
+  if (( OPCONFIG & 0x0004 )); then BATLOWEN="INTERRUPT ON BATTERY LOW" ; else BATLOWEN="INTERRUPT ON SOC" ; fi
+  if (( OPCONFIG & 0x0010 )); then RMFCC="true"                        ; else RMFCC="false"               ; fi
+  if (( OPCONFIG & 0x0020 )); then SLEEP="true"                        ; else SLEEP="false"               ; fi
+  if (( OPCONFIG & 0x0800 )); then GPIOPOL="ACTIVE HIGH"               ; else GPIOPOL="ACTIVE LOW"        ; fi
+  if (( OPCONFIG & 0x1000 )); then BI_PU_EN="Pull up enabled"          ; else BI_PU_EN="None"             ; fi
+  if (( OPCONFIG & 0x2000 )); then BIE="AUTOMATIC"                     ; else BIE="MANUAL"                ; fi
+
+  printf "OpConfig Register: 0x%04x\n" $OPCONFIG
+  echo "------------------------"
+  printf "TEMPERATURE SOURCE: %s\n" "$TEMPS"
+  printf "INTERRUPT CONFIG (BATLOWEN): %s\n" "$BATLOWEN"
+  printf "RMFCC: %s\n" "$RMFCC"
+  printf "ENTER SLEEP ENABLED: %s\n" "$SLEEP"
+  printf "GPIOPOL: %s\n" "$GPIOPOL"
+  printf "BIE PULLUP ENABLE: %s\n" "$BI_PU_EN"
+  printf "BATTERY INSERTION ENABLE: %s\n" "$BIE"
+  echo ""
+}
+
 ## unseal the fuel gauge; returns control register status afterwards
 unseal () {
   local VERBOSE="${1:-false}"
@@ -452,3 +473,85 @@ get_voltage () {
 
   printf "%0.${SCALE}f\n" $VOLTS
 }
+
+## runtime registers returned by snapshot, as name:register:unit, in output
+## order. They all lie between Temperature (0x02) and StateOfCharge (0x1C) so
+## one incremental read covers them.
+SNAPSHOT_FIELDS="state_of_charge:0x1C:% flags:0x06: voltage:0x04:mV average_current:0x10:mA temperature:0x02:0.1K remaining_capacity:0x0C:mAh full_charge_capacity:0x0E:mAh"
+SNAPSHOT_START=0x02
+SNAPSHOT_LENGTH=28
+
+## read every runtime register in one pass and print them on one line, either
+## as compact json (default) or as key=value pairs (kv). The field names match
+## bq27441.FuelGaugeSnapshot. Use "verbose" for a human readable listing.
+snapshot () {
+  local FORMAT="${1:-json}"
+  local BYTES=()
+  local OFFSET VALUE FIELD NAME UNIT FLAGS LINE SEP
+
+  case $FORMAT in
+    "json") LINE="{" ; SEP="" ;;
+    "kv")   LINE=""  ; SEP="" ;;
+    "verbose") ;;
+    *)
+      echo "Unknown snapshot format: $FORMAT (json, kv or verbose)" >&2
+      return 1
+      ;;
+  esac
+
+  if command -v i2ctransfer > /dev/null
+  then
+    # single write/read transaction for the whole register range
+    BYTES=( $(i2ctransfer -y $I2C_BUS w1@$DEVICE_ID $SNAPSHOT_START r$SNAPSHOT_LENGTH) ) || return 1
+  else
+    # i2c-tools before 4.0 has no i2ctransfer: fall back to one read per word
+    for (( OFFSET = 0; OFFSET < SNAPSHOT_LENGTH; OFFSET += 2 ))
+    do
+      VALUE=$(i2c_read $(( SNAPSHOT_START + OFFSET )) w) || return 1
+      BYTES+=( $(( VALUE & 0xFF )) $(( VALUE >> 8 )) )
+    done
+  fi
+
+  if (( ${#BYTES[@]} != SNAPSHOT_LENGTH ))
+  then
+    echo "FATAL in snapshot(): expected $SNAPSHOT_LENGTH bytes, read ${#BYTES[@]}." >&2
+    return 1
+  fi
+
+  for FIELD in $SNAPSHOT_FIELDS
+  do
+    NAME=${FIELD%%:*}
+    UNIT=${FIELD##*:}
+    OFFSET=${FIELD#*:}
+    OFFSET=$(( ${OFFSET%:*} - SNAPSHOT_START ))
+    VALUE=$(( BYTES[OFFSET] | (BYTES[OFFSET + 1] << 8) ))
+
+    # the current is signed
+    if [ $NAME = "average_current" ] && (( VALUE & 0x8000 ))
+    then
+      VALUE=$(( VALUE - 0x10000 ))
+    fi
+
+    case $FORMAT in
+      "json") LINE+="$SEP\"$NAME\": $VALUE" ; SEP=", " ;;
+      "kv")   LINE+="$SEP$NAME=$VALUE" ; SEP=" " ;;
+      *)
+        if [ $NAME = "flags" ]
+        then
+          FLAGS=$VALUE
+        else
+          printf "%s: %d %s\n" "$NAME" $VALUE "$UNIT"
+        fi
+        ;;
+    esac
+  done
+
+  case $FORMAT in
+    "json") echo "$LINE}" ;;
+    "kv")   echo "$LINE" ;;
+    *)
+      echo ""
+      print_flags $FLAGS
+      ;;
+  esac
+}
@@ -0,0 +1,48 @@
+import bq27441
+
+
+def make_gauge(**words):
+    registers = {getattr(bq27441, name.upper()): value for name, value in words.items()}
+    bus = bq27441.FakeBus(registers)
+    return bq27441.BQ27441(bus), bus
+
+
+def test_snapshot_is_one_transaction():
+    gauge, bus = make_gauge(state_of_charge=57, flags=bq27441.FLAG_DSG, voltage=3712,
+        average_current=-350 & 0xFFFF, temperature=2981, remaining_capacity=1400,
+        full_charge_capacity=2600)
+
+    snapshot = gauge.snapshot()
+
+    assert bus.transactions == 1
+    assert snapshot == bq27441.FuelGaugeSnapshot(state_of_charge=57, flags=bq27441.FLAG_DSG,
+        voltage=3712, average_current=-350, temperature=2981, remaining_capacity=1400,
+        full_charge_capacity=2600)
+    assert snapshot.is_discharging
+
+
+def test_snapshot_matches_single_register_reads():
+    gauge, _ = make_gauge(state_of_charge=100, voltage=4180, average_current=120, temperature=2931)
+    snapshot = gauge.snapshot()
+
+    assert snapshot.state_of_charge == gauge.get_battery_percentage()
+    assert snapshot.is_discharging == gauge.is_discharging() == False
+    assert snapshot.voltage / 1000.0 == gauge.get_voltage()
+    assert snapshot.average_current == gauge.get_average_current()
+
+
+def test_signed_current_and_temperature():
+    gauge, _ = make_gauge(average_current=0xFFFF, temperature=2981)
+
+    assert gauge.get_average_current() == -1
+    assert gauge.get_temperature("k") == 298
+    assert gauge.get_temperature("c") == 25
+    assert gauge.get_temperature() == 77
+
+
+def test_control_status_is_latched():
+    gauge, bus = make_gauge()
+    bus.set_word(bq27441.CONTROL, bq27441.STATUS_SS)
+
+    assert gauge.is_sealed()
+    assert bus.writes == [(bq27441.CONTROL, bq27441.CONTROL_STATUS)]
@@ -0,0 +1,143 @@
+#!/usr/bin/env python3
+""" Sprite atlas for the status overlay.
+
+    All sprites the daemon can draw are decoded once at startup and packed
+    into a single RGBA image, together with an index of where each sprite is
+    and how big it is. Nothing is read from disk after that.
+
+    Usage (validate an image directory):
+
+        python3 atlas.py [IMAGE_PATH]
+"""
+
+import collections
+import os
+import sys
+
+import pngcodec
+
+
+# (x, y) is the sprite's top left corner inside the atlas
+Sprite = collections.namedtuple("Sprite", ["name", "x", "y", "width", "height"])
+
+
+class AssetError(Exception):
+    """ Raised when sprites are missing or broken. `problems` lists every
+        (name, reason) found, not just the first one.
+    """
+
+    def __init__(self, directory, problems):
+        self.directory = directory
+        self.problems = problems
+        super().__init__(self.report())
+
+    def report(self):
+        lines = ["%d sprite(s) in %s can not be used:" % (len(self.problems), self.directory)]
+        lines += ["  %-28s %s" % (name, reason) for name, reason in self.problems]
+        return "\n".join(lines)
+
+
+class Atlas(object):
+    """ Packed sprites. `sprites` maps a sprite name (its file name) to its
+        Sprite metrics.
+    """
+
+    def __init__(self, width, height, rgba, sprites):
+        self.width = width
+        self.height = height
+        self.rgba = rgba
+        self.sprites = sprites
+        self._pixels = {}
+
+    def __contains__(self, name):
+        return name in self.sprites
+
+    def size(self, name):
+        """ Returns (width, height) of a sprite
+        """
+        sprite = self.sprites[name]
+        return sprite.width, sprite.height
+
+    def pixels(self, name):
+        """ Returns the tightly packed RGBA bytes of one sprite
+        """
+        if name not in self._pixels:
+            sprite = self.sprites[name]
+            stride = self.width * 4
+            row = sprite.width * 4
+            self._pixels[name] = b"".join(
+                self.rgba[(sprite.y + y) * stride + sprite.x * 4:(sprite.y + y) * stride + sprite.x * 4 + row]
+                for y in range(sprite.height)
+            )
+        return self._pixels[name]
+
+
+def pack(sizes, max_width=1024):
+    """ Shelf pack {name: (width, height)}, tallest first. Returns
+        (width, height, {name: (x, y)}).
+    """
+    max_width = max([max_width] + [w for w, _ in sizes.values()])
+    positions = {}
+    x = y = shelf_height = width = 0
+
+    for name, (w, h) in sorted(sizes.items(), key=lambda item: (-item[1][1], item[0])):
+        if x + w > max_width:
+            y += shelf_height
+            x = shelf_height = 0
+        positions[name] = (x, y)
+        x += w
+        width = max(width, x)
+        shelf_height = max(shelf_height, h)
+
+    return width, y + shelf_height, positions
+
+
+def build(directory, names):
+    """ Decode the sprites `names` from `directory` and pack them into an
+        Atlas. Every sprite is checked before giving up, and AssetError
+        reports all the problems at once.
+    """
+    try:
+        available = set(os.listdir(directory))
+    except OSError as e:
+        raise AssetError(directory, [(directory, e.strerror or str(e))])
+
+    problems = []
+    decoded = {}
+    for name in sorted(set(names)):
+        if name not in available:
+            problems.append((name, "missing"))
+            continue
+        try:
+            decoded[name] = pngcodec.read(os.path.join(directory, name))
+        except (pngcodec.PNGError, OSError) as e:
+            problems.append((name, str(e)))
+
+    if problems:
+        raise AssetError(directory, problems)
+
+    width, height, positions = pack({name: (w, h) for name, (w, h, _) in decoded.items()})
+    rgba = bytearray(width * height * 4)
+    sprites = {}
+    for name, (w, h, pixels) in decoded.items():
+        x, y = positions[name]
+        for row in range(h):
+            offset = ((y + row) * width + x) * 4
+            rgba[offset:offset + w * 4] = pixels[row * w * 4:(row + 1) * w * 4]
+        sprites[name] = Sprite(name, x, y, w, h)
+
+    return Atlas(width, height, bytes(rgba), sprites)
+
+
+if __name__ == '__main__':
+    directory = sys.argv[1] if len(sys.argv) > 1 else os.path.join(os.path.dirname(os.path.abspath(__file__)), "images")
+    names = [name for name in os.listdir(directory) if name.endswith(".png")]
+    try:
+        atlas = build(directory, names)
+    except AssetError as e:
+        print(e.report())
+        sys.exit(1)
+
+    print("%d sprites packed into %dx%d" % (len(atlas.sprites), atlas.width, atlas.height))
+    for sprite in sorted(atlas.sprites.values(), key=lambda s: s.name):
+        print("  %-28s %4d,%-4d %4dx%d" % (sprite.name, sprite.x, sprite.y, sprite.width, sprite.height))
@@ -0,0 +1,284 @@
+#!/usr/bin/env python3
+""" Non-blocking sound playback for the status overlay.
+
+    Sounds are decoded to raw PCM (signed 16 bit, interleaved stereo) once at
+    startup by ffmpeg or mpg123, so playing one later is just a matter of
+    handing buffered samples to the output backend. Playback happens on a
+    single worker thread that takes requests from a priority queue: play()
+    returns immediately, and a higher priority request (e.g. the shutdown
+    sound) interrupts a lower priority one that is still playing.
+
+    Backends:
+
+        AlsaBackend - writes to an ALSA PCM through libasound (ctypes). The
+                      device is only opened while a sound plays, so it is not
+                      held away from emulators the rest of the time.
+        NullBackend - discards the samples.
+"""
+
+import ctypes
+import ctypes.util
+import errno
+import heapq
+import itertools
+import os
+import shutil
+import subprocess
+import threading
+import time
+import wave
+
+
+SAMPLE_RATE = 44100
+CHANNELS = 2
+SAMPLE_WIDTH = 2
+FRAME_SIZE = CHANNELS * SAMPLE_WIDTH
+
+# frames handed to the backend at a time; pre-emption happens between chunks
+CHUNK_FRAMES = 2048
+
+PRIORITY_LOW_BATTERY = 10
+PRIORITY_SHUTDOWN = 100
+
+SND_PCM_STREAM_PLAYBACK = 0
+SND_PCM_FORMAT_S16_LE = 2
+SND_PCM_ACCESS_RW_INTERLEAVED = 3
+
+
+class AudioError(Exception):
+    pass
+
+
+# -----------------------------------------------------------------------------
+# Decoding
+# -----------------------------------------------------------------------------
+def decode(path, volume_db=0.0):
+    """ Decode a sound file to raw PCM in the module's output format, with
+        the volume adjusted by `volume_db` decibels. WAV files in that format
+        are read directly, anything else needs ffmpeg or mpg123.
+    """
+    if path.lower().endswith(".wav") and volume_db == 0:
+        with wave.open(path, "rb") as wav:
+            if (wav.getnchannels(), wav.getsampwidth(), wav.getframerate()) == (CHANNELS, SAMPLE_WIDTH, SAMPLE_RATE):
+                return wav.readframes(wav.getnframes())
+
+    if not os.path.exists(path):
+        raise AudioError("Sound file not found: %s" % path)
+
+    if shutil.which("ffmpeg"):
+        command = ["ffmpeg", "-v", "error", "-i", path, "-af", "volume=%.1fdB" % volume_db,
+            "-f", "s16le", "-acodec", "pcm_s16le", "-ac", str(CHANNELS), "-ar", str(SAMPLE_RATE), "-"]
+    elif shutil.which("mpg123"):
+        scale = int(32768 * 10 ** (volume_db / 20.0))
+        command = ["mpg123", "-q", "-s", "-e", "s16", "--stereo", "-r", str(SAMPLE_RATE), "-f", str(scale), path]
+    else:
+        raise AudioError("Need ffmpeg or mpg123 to decode %s" % path)
+
+    result = subprocess.run(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    if result.returncode != 0 or not result.stdout:
+        raise AudioError("Could not decode %s: %s" % (path, result.stderr.decode(errors="replace").strip()))
+
+    pcm = result.stdout
+    return pcm[:len(pcm) // FRAME_SIZE * FRAME_SIZE]
+
+
+# -----------------------------------------------------------------------------
+# Backends
+# -----------------------------------------------------------------------------
+class NullBackend(object):
+    """ Discards all samples.
+    """
+
+    def open(self):
+        pass
+
+    def write(self, pcm):
+        pass
+
+    def drain(self):
+        pass
+
+    def drop(self):
+        pass
+
+    def close(self):
+        pass
+
+
+class AlsaBackend(object):
+    """ Plays PCM through libasound.
+    """
+
+    def __init__(self, device="default", latency=100000):
+        self.device = device.encode()
+        self.latency = latency
+        self.pcm = None
+
+        path = ctypes.util.find_library("asound") or "libasound.so.2"
+        try:
+            self.lib = ctypes.CDLL(path)
+        except OSError as e:
+            raise AudioError("Could not load libasound: %s" % e)
+
+        lib = self.lib
+        lib.snd_pcm_open.argtypes = [ctypes.POINTER(ctypes.c_void_p), ctypes.c_char_p, ctypes.c_int, ctypes.c_int]
+        lib.snd_pcm_set_params.argtypes = [ctypes.c_void_p, ctypes.c_int, ctypes.c_int, ctypes.c_uint,
+            ctypes.c_uint, ctypes.c_int, ctypes.c_uint]
+        lib.snd_pcm_writei.argtypes = [ctypes.c_void_p, ctypes.c_char_p, ctypes.c_ulong]
+        lib.snd_pcm_writei.restype = ctypes.c_long
+        lib.snd_pcm_recover.argtypes = [ctypes.c_void_p, ctypes.c_int, ctypes.c_int]
+        lib.snd_pcm_drain.argtypes = [ctypes.c_void_p]
+        lib.snd_pcm_drop.argtypes = [ctypes.c_void_p]
+        lib.snd_pcm_close.argtypes = [ctypes.c_void_p]
+        lib.snd_strerror.argtypes = [ctypes.c_int]
+        lib.snd_strerror.restype = ctypes.c_char_p
+
+    def _check(self, result, what):
+        if result < 0:
+            raise AudioError("%s failed: %s" % (what, self.lib.snd_strerror(result).decode()))
+        return result
+
+    def open(self):
+        pcm = ctypes.c_void_p()
+        self._check(self.lib.snd_pcm_open(ctypes.byref(pcm), self.device, SND_PCM_STREAM_PLAYBACK, 0), "snd_pcm_open")
+        self.pcm = pcm
+        try:
+            self._check(self.lib.snd_pcm_set_params(pcm, SND_PCM_FORMAT_S16_LE, SND_PCM_ACCESS_RW_INTERLEAVED,
+                CHANNELS, SAMPLE_RATE, 1, self.latency), "snd_pcm_set_params")
+        except AudioError:
+            self.close()
+            raise
+
+    def write(self, pcm):
+        frames = len(pcm) // FRAME_SIZE
+        while frames > 0:
+            written = self.lib.snd_pcm_writei(self.pcm, pcm, frames)
+            if written == -errno.EAGAIN:
+                continue
+            if written < 0:
+                # underrun or suspend; recover and keep writing
+                self._check(self.lib.snd_pcm_recover(self.pcm, int(written), 1), "snd_pcm_writei")
+                continue
+            pcm = pcm[written * FRAME_SIZE:]
+            frames -= written
+
+    def drain(self):
+        if self.pcm is not None:
+            self.lib.snd_pcm_drain(self.pcm)
+
+    def drop(self):
+        if self.pcm is not None:
+            self.lib.snd_pcm_drop(self.pcm)
+
+    def close(self):
+        if self.pcm is not None:
+            self.lib.snd_pcm_close(self.pcm)
+            self.pcm = None
+
+
+# -----------------------------------------------------------------------------
+# Player
+# -----------------------------------------------------------------------------
+class AudioPlayer(object):
+    """ Plays preloaded sounds on a worker thread, highest priority first.
+    """
+
+    def __init__(self, backend):
+        self.backend = backend
+        self.sounds = {}
+        self.queue = []
+        self.order = itertools.count()
+        self.playing = None     # priority of the sound being played
+        self.closed = False
+        self.condition = threading.Condition()
+        self.worker = threading.Thread(target=self._run, name="audio", daemon=True)
+        self.worker.start()
+
+    def preload(self, sounds, volume_db=0.0):
+        """ Decode {name: path} into memory. Sounds that can not be decoded
+            are reported and left out, so they are silently skipped later.
+        """
+        for name, path in sounds.items():
+            try:
+                self.sounds[name] = decode(path, volume_db)
+            except (AudioError, OSError, wave.Error) as e:
+                print("WARNING: could not load sound %s: %s" % (name, e))
+
+    def play(self, name, priority=0):
+        """ Queue a sound and return immediately. A sound with a higher
+            priority than the one playing interrupts it.
+        """
+        if name not in self.sounds:
+            return
+        with self.condition:
+            heapq.heappush(self.queue, (-priority, next(self.order), name))
+            self.condition.notify_all()
+
+    def wait(self, timeout=None):
+        """ Block until every queued sound has played. Returns False on
+            timeout.
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self.condition:
+            while self.queue or self.playing is not None:
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    return False
+                self.condition.wait(remaining)
+        return True
+
+    def close(self):
+        with self.condition:
+            self.closed = True
+            self.queue = []
+            self.condition.notify_all()
+        self.worker.join(1)
+
+    def _preempted(self, priority):
+        with self.condition:
+            return self.closed or (self.queue and -self.queue[0][0] > priority)
+
+    def _run(self):
+        while True:
+            with self.condition:
+                while not self.queue and not self.closed:
+                    self.condition.wait()
+                if self.closed:
+                    return
+                priority, _, name = heapq.heappop(self.queue)
+                self.playing = priority = -priority
+
+            try:
+                self._play(self.sounds[name], priority)
+            except AudioError as e:
+                print("WARNING: could not play sound %s: %s" % (name, e))
+            finally:
+                with self.condition:
+                    self.playing = None
+                    self.condition.notify_all()
+
+    def _play(self, pcm, priority):
+        chunk = CHUNK_FRAMES * FRAME_SIZE
+        self.backend.open()
+        try:
+            for offset in range(0, len(pcm), chunk):
+                if self._preempted(priority):
+                    self.backend.drop()
+                    return
+                self.backend.write(pcm[offset:offset + chunk])
+            self.backend.drain()
+        finally:
+            self.backend.close()
+
+
+def open_player(backend="ALSA", device="default"):
+    """ Create an AudioPlayer for the backend named in the config. Anything
+        but "NULL" (including the old "OMXPLAYER" setting) means ALSA; falls
+        back to the null backend if ALSA is not available.
+    """
+    if backend != "NULL":
+        try:
+            return AudioPlayer(AlsaBackend(device))
+        except AudioError as e:
+            print("WARNING: %s, sound disabled" % e)
+    return AudioPlayer(NullBackend())
@@ -0,0 +1,37 @@
+#!/usr/bin/env python3
+""" Display brightness through the Linux backlight class
+    (/sys/class/backlight/*). Writing the brightness needs write access to
+    the brightness file, e.g. through a udev rule.
+"""
+
+import glob
+import os
+
+
+def find(sysfs="/sys/class/backlight"):
+    """ The first backlight device, or None if there is none
+    """
+    devices = sorted(glob.glob(os.path.join(sysfs, "*")))
+    return devices[0] if devices else None
+
+
+class Backlight(object):
+    """ One backlight device. Brightness is in percent of its maximum.
+        Raises OSError if it can not be read.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        with open(os.path.join(path, "max_brightness"), "r") as fhandle:
+            self.maximum = max(1, int(fhandle.read()))
+
+    def get(self):
+        with open(os.path.join(self.path, "brightness"), "r") as fhandle:
+            return int(round(100.0 * int(fhandle.read()) / self.maximum))
+
+    def set(self, percent):
+        """ Set the brightness, never fully off
+        """
+        level = max(1, int(round(percent * self.maximum / 100.0)))
+        with open(os.path.join(self.path, "brightness"), "w") as fhandle:
+            fhandle.write(str(min(level, self.maximum)))
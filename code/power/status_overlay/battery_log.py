@@ -0,0 +1,242 @@
+#!/usr/bin/env python3
+""" Persistent battery history log.
+
+    Every telemetry sample is stored as a fixed size little endian binary
+    record so a log can be memory mapped and scanned without parsing:
+
+        header:  magic "SOLG", u16 version, u16 record size     (8 bytes)
+        record:  f64 timestamp, u16 state of charge, u16 voltage (mV),
+                 i16 average current (mA), u16 temperature (0.1 K),
+                 u16 remaining capacity (mAh), u16 full charge capacity
+                 (mAh), u16 flags, 2 bytes padding              (24 bytes)
+
+    Records are buffered in memory and written (and fsynced) in batches to
+    keep SD card wear down. The log rotates to battery.log.1, .2, ... once it
+    reaches a maximum size.
+
+    Usage:
+
+        python3 battery_log.py summary [LOG_DIRECTORY]
+        python3 battery_log.py dump [LOG_DIRECTORY]
+"""
+
+import mmap
+import os
+import struct
+import sys
+import time
+
+import telemetry
+
+
+MAGIC = b"SOLG"
+VERSION = 1
+HEADER = struct.Struct("<4sHH")
+RECORD = struct.Struct("<dHHhHHHHxx")
+LOG_NAME = "battery.log"
+
+FLAG_DSG = 0x0001
+
+
+class BatteryLog(object):
+    """ Appends telemetry samples to LOG_NAME inside `directory`.
+    """
+
+    def __init__(self, directory, max_bytes=1024 * 1024, max_files=4, flush_interval=600, flush_records=64):
+        self.directory = os.path.expanduser(directory)
+        self.path = os.path.join(self.directory, LOG_NAME)
+        self.max_bytes = max(max_bytes, HEADER.size + RECORD.size)
+        self.max_files = max_files
+        self.flush_interval = flush_interval
+        self.flush_records = flush_records
+        self.pending = []
+        self.last_flush = time.monotonic()
+        self.fd = None
+        self.size = 0
+
+        os.makedirs(self.directory, exist_ok=True)
+        self._open()
+
+    def _open(self):
+        self.fd = os.open(self.path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        self.size = os.fstat(self.fd).st_size
+        if self.size == 0:
+            os.write(self.fd, HEADER.pack(MAGIC, VERSION, RECORD.size))
+            self.size = HEADER.size
+
+    def append(self, sample):
+        """ Queue a telemetry.Sample. It is written out on the next flush,
+            which happens every flush_records samples or flush_interval
+            seconds, whichever comes first.
+        """
+        self.pending.append(RECORD.pack(
+            sample.timestamp,
+            sample.state_of_charge,
+            sample.voltage,
+            sample.average_current,
+            sample.temperature,
+            sample.remaining_capacity,
+            sample.full_charge_capacity,
+            sample.flags
+        ))
+
+        if len(self.pending) >= self.flush_records or time.monotonic() - self.last_flush >= self.flush_interval:
+            self.flush()
+
+    def flush(self):
+        """ Write all pending records with one write and one fsync, rotating
+            the log first if they would not fit.
+        """
+        self.last_flush = time.monotonic()
+        if not self.pending or self.fd is None:
+            return
+
+        data = b"".join(self.pending)
+        self.pending = []
+
+        if self.size + len(data) > self.max_bytes:
+            self.rotate()
+
+        os.write(self.fd, data)
+        os.fsync(self.fd)
+        self.size += len(data)
+
+    def rotate(self):
+        os.close(self.fd)
+        for index in range(self.max_files - 1, 0, -1):
+            src = self.path if index == 1 else "%s.%d" % (self.path, index - 1)
+            if os.path.exists(src):
+                os.replace(src, "%s.%d" % (self.path, index))
+        if self.max_files <= 1:
+            os.remove(self.path)
+        self._open()
+
+    def close(self):
+        if self.fd is not None:
+            self.flush()
+            os.close(self.fd)
+            self.fd = None
+
+
+# -----------------------------------------------------------------------------
+# Reader
+# -----------------------------------------------------------------------------
+def log_files(directory):
+    """ Returns the log files in `directory`, oldest first.
+    """
+    directory = os.path.expanduser(directory)
+    rotated = []
+    for name in os.listdir(directory):
+        suffix = name[len(LOG_NAME) + 1:]
+        if name.startswith(LOG_NAME + ".") and suffix.isdigit():
+            rotated.append((int(suffix), os.path.join(directory, name)))
+
+    files = [path for _, path in sorted(rotated, reverse=True)]
+    current = os.path.join(directory, LOG_NAME)
+    if os.path.exists(current):
+        files.append(current)
+    return files
+
+
+def read_log(path):
+    """ Memory map one log file and yield its records as telemetry.Samples.
+    """
+    with open(path, "rb") as fhandle:
+        if os.fstat(fhandle.fileno()).st_size < HEADER.size:
+            return
+        with mmap.mmap(fhandle.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            magic, version, record_size = HEADER.unpack_from(data, 0)
+            if magic != MAGIC or version != VERSION or record_size != RECORD.size:
+                raise ValueError("%s is not a battery log (or has an unsupported version)" % path)
+
+            # unpack straight out of the mapping, without copying the file
+            end = HEADER.size + (len(data) - HEADER.size) // RECORD.size * RECORD.size
+            for offset in range(HEADER.size, end, RECORD.size):
+                yield telemetry.Sample(*RECORD.unpack_from(data, offset))
+
+
+def read_logs(directory):
+    """ Yield every sample in a log directory in chronological order
+    """
+    for path in log_files(directory):
+        for sample in read_log(path):
+            yield sample
+
+
+def discharge_sessions(samples, max_gap=600):
+    """ Split samples into discharge sessions: runs of samples taken on
+        battery power with no gap longer than max_gap seconds.
+    """
+    session = []
+    for sample in samples:
+        discharging = bool(sample.flags & FLAG_DSG)
+        if session and (not discharging or sample.timestamp - session[-1].timestamp > max_gap):
+            if len(session) > 1:
+                yield session
+            session = []
+        if discharging:
+            session.append(sample)
+    if len(session) > 1:
+        yield session
+
+
+def summarize(samples, bucket_size=5):
+    """ Build a discharge curve summary. Returns a dict with
+
+        sessions - list of (start, end, start soc, end soc) per discharge session
+        buckets  - {soc bucket: (sample count, mean voltage, mean minutes until
+                   the end of the session)} over all sessions
+        rate     - mean discharge rate in percent per hour
+    """
+    sessions = []
+    totals = {}
+    total_drop = 0.0
+    total_time = 0.0
+
+    for session in discharge_sessions(samples):
+        start, end = session[0], session[-1]
+        sessions.append((start.timestamp, end.timestamp, start.state_of_charge, end.state_of_charge))
+        total_drop += start.state_of_charge - end.state_of_charge
+        total_time += end.timestamp - start.timestamp
+
+        for sample in session:
+            bucket = min(100, sample.state_of_charge) // bucket_size * bucket_size
+            count, voltage, minutes = totals.get(bucket, (0, 0, 0.0))
+            totals[bucket] = (count + 1, voltage + sample.voltage, minutes + (end.timestamp - sample.timestamp) / 60.0)
+
+    buckets = {}
+    for bucket, (count, voltage, minutes) in totals.items():
+        buckets[bucket] = (count, voltage / float(count), minutes / count)
+
+    rate = total_drop / (total_time / 3600.0) if total_time > 0 else None
+    return dict(sessions=sessions, buckets=buckets, rate=rate)
+
+
+def print_summary(summary):
+    print("Discharge sessions: %d" % len(summary["sessions"]))
+    for start, end, start_soc, end_soc in summary["sessions"]:
+        print("  %s  %6.1f min  %3d%% -> %3d%%" % (
+            time.strftime("%Y-%m-%d %H:%M", time.localtime(start)), (end - start) / 60.0, start_soc, end_soc))
+
+    if summary["rate"] is not None:
+        print("Mean discharge rate: %.1f %%/hour" % summary["rate"])
+
+    print("")
+    print(" SOC   samples  voltage (V)  minutes left in session")
+    for bucket in sorted(summary["buckets"].keys(), reverse=True):
+        count, voltage, minutes = summary["buckets"][bucket]
+        print("%3d%%  %8d  %11.3f  %23.1f" % (bucket, count, voltage / 1000.0, minutes))
+
+
+if __name__ == '__main__':
+    if len(sys.argv) < 2 or sys.argv[1] not in ("summary", "dump"):
+        print("Usage: battery_log.py [summary|dump] [LOG_DIRECTORY]")
+        sys.exit(1)
+
+    directory = sys.argv[2] if len(sys.argv) > 2 else "~/.status_overlay_battery"
+
+    if sys.argv[1] == "dump":
+        for sample in read_logs(directory):
+            print(",".join(str(v) for v in sample))
+    else:
+        print_summary(summarize(read_logs(directory)))
@@ -0,0 +1,291 @@
+#!/usr/bin/env python3
+""" Benchmark harness for the status overlay daemon.
+
+    Runs the daemon on simulated hardware backends (see simulation.py),
+    replays a scripted event trace against it and reports redraw latency
+    percentiles, processes spawned per event and CPU time.
+
+    Usage:
+
+        python3 benchmark.py [--trace NAME_OR_FILE] [--renderer SIM|PNGVIEW|COMPOSITOR]
+                             [--hud SPRITES|FRAME] [--speed FACTOR]
+
+    A trace is a list of events, each with the time (in seconds from the
+    start of the trace) it happens at:
+
+        {"at": 0.5, "event": "soc", "value": 42}          change SOC and fire GPOUT
+        {"at": 1.0, "event": "charger", "plugged": true}  plug/unplug and fire GPOUT
+        {"at": 1.5, "event": "gpout"}                     fire GPOUT, nothing changed
+        {"at": 2.0, "event": "button", "hold": 0.1}       press the power button
+        {"at": 2.5, "event": "menu"}                      open or close the menu
+        {"at": 3.0, "event": "input", "action": "down"}   menu action on the controller
+
+    Built in traces: discharge, charger, buttons, noisy_gpout, mixed, menu. Any
+    other name is loaded as a JSON file.
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import subprocess
+import tempfile
+import threading
+import time
+
+import status_overlay
+import simulation
+
+
+def discharge_trace():
+    return [{"at": 0.2 + i * 0.25, "event": "soc", "value": 40 - i} for i in range(34)]
+
+
+def charger_trace():
+    return [{"at": 0.2 + i * 0.4, "event": "charger", "plugged": i % 2 == 0} for i in range(16)]
+
+
+def buttons_trace():
+    trace = [{"at": 0.2 + i * 0.4, "event": "button", "hold": 0.1} for i in range(12)]
+    # bouncy contacts: several presses in quick succession
+    trace += [{"at": 5.2 + i * 0.02, "event": "button", "hold": 0.005} for i in range(10)]
+    return trace
+
+
+def noisy_gpout_trace():
+    trace = []
+    for burst in range(10):
+        trace += [{"at": 0.2 + burst * 0.3 + i * 0.005, "event": "gpout"} for i in range(8)]
+        trace.append({"at": 0.3 + burst * 0.3, "event": "soc", "value": 80 - burst})
+    return trace
+
+
+def menu_trace():
+    actions = ["down", "down", "up", "right", "left"] + ["down"] * 5 + ["up"] * 5 + ["back"]
+    trace = [{"at": 0.2, "event": "menu"}]
+    trace += [{"at": 0.5 + i * 0.25, "event": "input", "action": action} for i, action in enumerate(actions)]
+    return trace
+
+
+def mixed_trace():
+    trace = discharge_trace()[:12]
+    trace += [dict(e, at=e["at"] + 3.5) for e in charger_trace()[:6]]
+    trace += [dict(e, at=e["at"] + 6.0) for e in buttons_trace()[:6]]
+    trace += [dict(e, at=e["at"] + 9.0) for e in noisy_gpout_trace()[:30]]
+    return trace
+
+
+TRACES = {
+    "discharge": discharge_trace,
+    "charger": charger_trace,
+    "buttons": buttons_trace,
+    "noisy_gpout": noisy_gpout_trace,
+    "mixed": mixed_trace,
+    "menu": menu_trace,
+}
+
+
+def load_trace(name):
+    if name in TRACES:
+        return TRACES[name]()
+    with open(name, "r") as fhandle:
+        return json.load(fhandle)
+
+
+class CountingPopen(subprocess.Popen):
+    """ subprocess.Popen that counts every process it starts
+    """
+    spawned = 0
+
+    def __init__(self, *args, **kwargs):
+        CountingPopen.spawned += 1
+        super().__init__(*args, **kwargs)
+
+
+def percentile(values, pct):
+    if not values:
+        return float("nan")
+    values = sorted(values)
+    index = min(len(values) - 1, int(round(pct / 100.0 * (len(values) - 1))))
+    return values[index]
+
+
+class Benchmark(object):
+
+    def __init__(self, trace, renderer="SIM", hud="SPRITES", speed=1.0, settle=1.0):
+        self.trace = sorted(trace, key=lambda e: e["at"])
+        self.renderer = renderer
+        self.hud = hud
+        self.speed = speed
+        self.settle = settle
+        self.latencies = []
+        self.render_times = []
+        self.batch_start = None
+        self.cpu_time = 0.0
+        self.wall_time = 0.0
+        self.spawned = 0
+        self.wakeups = 0
+        self.charging = False
+        self.charge = 100
+
+    def configure(self, workdir):
+        status_overlay.CONFIG = status_overlay.CONFIG._replace(
+            GPIO_BACKEND="SIM",
+            AUDIO_BACKEND="SIM",
+            INPUT_BACKEND="SIM",
+            FUEL_GAUGE_BACKEND="SIM",
+            RENDERER=self.renderer,
+            HUD_RENDERING=self.hud,
+            POWER_SWITCH_BEHAVIOR="INITIAL_ON",
+            IS_VISIBLE=True,
+            IMAGE_PATH=os.path.join(status_overlay.__SCRIPT_PATH__, "images/"),
+            CONFIG_FILE_PATH=os.path.join(workdir, "config"),
+            CONFIG_WATCH=False,
+            STARTUP_CACHE_PATH="",
+            HUD_CACHE_PATH=os.path.join(workdir, "hud"),
+            BATTERY_LOG_PATH="",
+            STATUS_SHM_PATH=os.path.join(workdir, "status"),
+            CONTROL_SOCKET_PATH=os.path.join(workdir, "control"),
+            METRICS_PATH=os.path.join(workdir, "metrics.prom"),
+            TELEMETRY_SAMPLE_INTERVAL=0,
+            SHUTDOWN_COMMAND=""
+        )
+
+    def instrument(self):
+        """ Wrap the redraw scheduler to measure the time from the first
+            redraw request of a batch to the end of its render.
+        """
+        request_redraw = status_overlay.request_redraw
+        flush_redraw = getattr(status_overlay, "__flush_redraw")
+
+        def timed_request_redraw(delay=None, sample=True):
+            if getattr(status_overlay, "__REDRAW_PENDING__") is None:
+                self.batch_start = time.perf_counter()
+            request_redraw(delay, sample)
+
+        def timed_flush_redraw():
+            started, self.batch_start = self.batch_start, None
+            rendered = status_overlay.__REDRAW_STATS__["rendered"]
+            flush_start = time.perf_counter()
+            flush_redraw()
+            now = time.perf_counter()
+            if status_overlay.__REDRAW_STATS__["rendered"] > rendered:
+                self.render_times.append(now - flush_start)
+                if started is not None:
+                    self.latencies.append(now - started)
+
+        status_overlay.request_redraw = timed_request_redraw
+        setattr(status_overlay, "__flush_redraw", timed_flush_redraw)
+        subprocess.Popen = CountingPopen
+
+    def apply(self, event):
+        gpio = status_overlay.GPIO
+        gauge = status_overlay.fuel_gauge()
+        gpout = status_overlay.CONFIG.BATTERY_GPOUT_PIN
+        power = status_overlay.CONFIG.BATTERY_POWER_PIN
+
+        if event["event"] == "soc":
+            self.charge = event["value"]
+            simulation.set_battery(gauge, self.charge, not self.charging)
+            gpio.pulse(gpout)
+        elif event["event"] == "charger":
+            self.charging = event["plugged"]
+            simulation.set_battery(gauge, self.charge, not self.charging)
+            gpio.pulse(gpout)
+        elif event["event"] == "gpout":
+            gpio.pulse(gpout)
+        elif event["event"] == "button":
+            gpio.pulse(power, event.get("hold", 0.1) / self.speed)
+        elif event["event"] == "menu":
+            getattr(status_overlay, "__LOOP__").call_soon_threadsafe(status_overlay.toggle_menu)
+        elif event["event"] == "input":
+            device = getattr(status_overlay, "__INPUT_DEVICE__")
+            if device is not None:
+                device.perform(event["action"], status_overlay.CONFIG.MENU_BUTTONS)
+        else:
+            raise ValueError("unknown trace event '%s'" % event["event"])
+
+    def replay(self):
+        """ Runs on its own thread, like the RPi.GPIO callback thread would.
+        """
+        while getattr(status_overlay, "__LOOP__") is None or status_overlay.GPIO is None or \
+                status_overlay.__REDRAW_STATS__["rendered"] == 0:
+            time.sleep(0.01)
+
+        start_wall = time.perf_counter()
+        start_cpu = time.process_time()
+        spawned = CountingPopen.spawned
+        wakeups = status_overlay.metrics.context_switches()[0]
+
+        for event in self.trace:
+            delay = start_wall + event["at"] / self.speed - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            self.apply(event)
+
+        time.sleep(self.settle)
+        self.wall_time = time.perf_counter() - start_wall
+        self.cpu_time = time.process_time() - start_cpu
+        self.spawned = CountingPopen.spawned - spawned
+        self.wakeups = status_overlay.metrics.context_switches()[0] - wakeups
+
+        loop = getattr(status_overlay, "__LOOP__")
+        loop.call_soon_threadsafe(status_overlay.stop, "exit")
+
+    def run(self):
+        with tempfile.TemporaryDirectory() as workdir:
+            self.configure(workdir)
+            self.instrument()
+
+            driver = threading.Thread(target=self.replay, daemon=True)
+            driver.start()
+            asyncio.run(status_overlay.main())
+            driver.join()
+
+    def report(self):
+        stats = status_overlay.__REDRAW_STATS__
+        events = max(1, len(self.trace))
+        ms = lambda v: v * 1000.0
+
+        print("events replayed:      %d" % len(self.trace))
+        print("redraws:              %d requested, %d merged, %d rendered, %d skipped" % (
+            stats["requested"], stats["merged"], stats["rendered"], stats["skipped"]))
+        print("redraw latency (ms):  p50 %.2f  p90 %.2f  p99 %.2f  max %.2f" % (
+            ms(percentile(self.latencies, 50)), ms(percentile(self.latencies, 90)),
+            ms(percentile(self.latencies, 99)), ms(max(self.latencies or [float("nan")]))))
+        print("  (includes the %.0f ms REDRAW_COALESCE_WINDOW)" % ms(status_overlay.CONFIG.REDRAW_COALESCE_WINDOW))
+        print("render time (ms):     p50 %.2f  p90 %.2f  p99 %.2f" % (
+            ms(percentile(self.render_times, 50)), ms(percentile(self.render_times, 90)),
+            ms(percentile(self.render_times, 99))))
+        changes = getattr(status_overlay, "__RENDERER__").changes
+        print("sprite changes:       %s" % ", ".join("%d %s" % (changes[op], op)
+            for op in ("add", "move", "replace", "remove")))
+        latencies = list(getattr(status_overlay, "__INPUT_LATENCIES__"))
+        if latencies:
+            print("input latency (ms):   p50 %.2f  p90 %.2f  p99 %.2f  max %.2f  (controller event to menu on screen)" % (
+                ms(percentile(latencies, 50)), ms(percentile(latencies, 90)),
+                ms(percentile(latencies, 99)), ms(max(latencies))))
+        print("processes spawned:    %d (%.2f per event)" % (self.spawned, self.spawned / float(events)))
+        print("cpu time:             %.3f s (%.2f ms per event, %.1f%% of %.1f s wall)" % (
+            self.cpu_time, ms(self.cpu_time / events), 100.0 * self.cpu_time / max(self.wall_time, 1e-9),
+            self.wall_time))
+        print("wakeups:              %d (%.0f per minute)" % (self.wakeups, self.wakeups * 60.0 / max(self.wall_time, 1e-9)))
+
+        calls = status_overlay.metrics.CALL_SECONDS
+        print("time per call (ms):")
+        for function in sorted(dict(labels)["function"] for labels in calls.values):
+            count = calls.count(function=function)
+            print("  %-26s %6d calls, mean %.3f" % (function, count, ms(calls.total(function=function) / count)))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Replay an event trace against the status overlay daemon.")
+    parser.add_argument("--trace", default="mixed", help="built in trace name or JSON trace file")
+    parser.add_argument("--renderer", default="SIM", choices=["SIM", "PNGVIEW", "COMPOSITOR"])
+    parser.add_argument("--hud", default="SPRITES", choices=["SPRITES", "FRAME"])
+    parser.add_argument("--speed", type=float, default=1.0, help="replay speed multiplier")
+    args = parser.parse_args()
+
+    benchmark = Benchmark(load_trace(args.trace), renderer=args.renderer, hud=args.hud, speed=args.speed)
+    benchmark.run()
+    benchmark.report()
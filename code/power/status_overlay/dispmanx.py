@@ -0,0 +1,226 @@
+#!/usr/bin/env python3
+""" ctypes bindings for the parts of the Raspberry Pi DispmanX API that the
+    status overlay uses (the same calls raspidmx's pngview makes).
+
+    Importing this module does not load libbcm_host; call load() first. It
+    raises OSError if the library is not available (e.g. not on a Pi).
+"""
+
+import ctypes
+import ctypes.util
+
+
+LIBBCM_HOST_PATHS = ["/opt/vc/lib/libbcm_host.so", "libbcm_host.so"]
+
+VC_IMAGE_RGBA32 = 15
+VC_IMAGE_RGB888 = 5
+
+DISPMANX_PROTECTION_NONE = 0
+DISPMANX_NO_ROTATE = 0
+DISPMANX_FLAGS_ALPHA_FROM_SOURCE = 0
+
+ELEMENT_CHANGE_LAYER = (1 << 0)
+ELEMENT_CHANGE_OPACITY = (1 << 1)
+ELEMENT_CHANGE_DEST_RECT = (1 << 2)
+ELEMENT_CHANGE_SRC_RECT = (1 << 3)
+
+__LIB__ = None
+
+
+class VC_RECT_T(ctypes.Structure):
+    _fields_ = [
+        ("x", ctypes.c_int32),
+        ("y", ctypes.c_int32),
+        ("width", ctypes.c_int32),
+        ("height", ctypes.c_int32),
+    ]
+
+
+class VC_DISPMANX_ALPHA_T(ctypes.Structure):
+    _fields_ = [
+        ("flags", ctypes.c_int),
+        ("opacity", ctypes.c_uint32),
+        ("mask", ctypes.c_uint32),
+    ]
+
+
+class DISPMANX_MODEINFO_T(ctypes.Structure):
+    _fields_ = [
+        ("width", ctypes.c_int32),
+        ("height", ctypes.c_int32),
+        ("transform", ctypes.c_int),
+        ("input_format", ctypes.c_int),
+        ("display_num", ctypes.c_uint32),
+    ]
+
+
+def load():
+    """ Load libbcm_host and initialize the VideoCore host interface.
+    """
+    global __LIB__
+    if __LIB__ is not None:
+        return __LIB__
+
+    lib = None
+    errors = []
+    for path in LIBBCM_HOST_PATHS + [ctypes.util.find_library("bcm_host")]:
+        if not path:
+            continue
+        try:
+            lib = ctypes.CDLL(path)
+            break
+        except OSError as e:
+            errors.append(str(e))
+
+    if lib is None:
+        raise OSError("Could not load libbcm_host: %s" % "; ".join(errors))
+
+    u32 = ctypes.c_uint32
+    lib.bcm_host_init.restype = None
+    lib.vc_dispmanx_display_open.argtypes = [u32]
+    lib.vc_dispmanx_display_open.restype = u32
+    lib.vc_dispmanx_display_close.argtypes = [u32]
+    lib.vc_dispmanx_display_get_info.argtypes = [u32, ctypes.POINTER(DISPMANX_MODEINFO_T)]
+    lib.vc_dispmanx_resource_create.argtypes = [ctypes.c_int, u32, u32, ctypes.POINTER(u32)]
+    lib.vc_dispmanx_resource_create.restype = u32
+    lib.vc_dispmanx_resource_write_data.argtypes = [u32, ctypes.c_int, ctypes.c_int, ctypes.c_void_p,
+        ctypes.POINTER(VC_RECT_T)]
+    lib.vc_dispmanx_resource_read_data.argtypes = [u32, ctypes.POINTER(VC_RECT_T), ctypes.c_void_p, u32]
+    lib.vc_dispmanx_resource_delete.argtypes = [u32]
+    lib.vc_dispmanx_update_start.argtypes = [ctypes.c_int32]
+    lib.vc_dispmanx_update_start.restype = u32
+    lib.vc_dispmanx_update_submit_sync.argtypes = [u32]
+    lib.vc_dispmanx_element_add.argtypes = [u32, u32, ctypes.c_int32, ctypes.POINTER(VC_RECT_T), u32,
+        ctypes.POINTER(VC_RECT_T), u32, ctypes.POINTER(VC_DISPMANX_ALPHA_T), ctypes.c_void_p, ctypes.c_int]
+    lib.vc_dispmanx_element_add.restype = u32
+    lib.vc_dispmanx_element_change_source.argtypes = [u32, u32, u32]
+    lib.vc_dispmanx_element_change_attributes.argtypes = [u32, u32, u32, ctypes.c_int32, ctypes.c_uint8,
+        ctypes.POINTER(VC_RECT_T), ctypes.POINTER(VC_RECT_T), u32, ctypes.c_int]
+    lib.vc_dispmanx_element_remove.argtypes = [u32, u32]
+    lib.vc_dispmanx_snapshot.argtypes = [u32, u32, ctypes.c_int]
+
+    lib.bcm_host_init()
+    __LIB__ = lib
+    return lib
+
+
+def align_up(value, alignment):
+    return (value + alignment - 1) & ~(alignment - 1)
+
+
+def display_open(display_id):
+    handle = load().vc_dispmanx_display_open(display_id)
+    if handle == 0:
+        raise OSError("Could not open DispmanX display %d" % display_id)
+    return handle
+
+
+def display_close(display):
+    load().vc_dispmanx_display_close(display)
+
+
+def display_size(display):
+    """ Returns (width, height) of an open display
+    """
+    info = DISPMANX_MODEINFO_T()
+    if load().vc_dispmanx_display_get_info(display, ctypes.byref(info)) != 0:
+        raise OSError("vc_dispmanx_display_get_info failed")
+    return info.width, info.height
+
+
+def resource_create(width, height, data=None, image_type=VC_IMAGE_RGBA32):
+    """ Create a VideoCore resource and optionally upload pixel data to it.
+        Data must be tightly packed RGBA.
+    """
+    lib = load()
+    native = ctypes.c_uint32()
+    resource = lib.vc_dispmanx_resource_create(image_type, width, height, ctypes.byref(native))
+    if resource == 0:
+        raise OSError("vc_dispmanx_resource_create failed")
+
+    if data is not None:
+        resource_write(resource, width, height, data)
+    return resource
+
+
+def resource_write(resource, width, height, data):
+    buf = (ctypes.c_char * len(data)).from_buffer_copy(bytes(data))
+    rect = VC_RECT_T(0, 0, width, height)
+    if load().vc_dispmanx_resource_write_data(resource, VC_IMAGE_RGBA32, width * 4, buf, ctypes.byref(rect)) != 0:
+        raise OSError("vc_dispmanx_resource_write_data failed")
+
+
+def resource_delete(resource):
+    load().vc_dispmanx_resource_delete(resource)
+
+
+def update_start():
+    update = load().vc_dispmanx_update_start(0)
+    if update == 0:
+        raise OSError("vc_dispmanx_update_start failed")
+    return update
+
+
+def update_submit_sync(update):
+    """ Submit an update and block until it has been applied on the next
+        vsync, so that every change in it becomes visible at once.
+    """
+    return load().vc_dispmanx_update_submit_sync(update)
+
+
+def _rects(x, y, width, height, src_width, src_height):
+    dst = VC_RECT_T(x, y, width, height)
+    src = VC_RECT_T(0, 0, src_width << 16, src_height << 16)
+    return dst, src
+
+
+def element_add(update, display, layer, resource, x, y, width, height, dst_width=None, dst_height=None):
+    dst, src = _rects(x, y, dst_width or width, dst_height or height, width, height)
+    alpha = VC_DISPMANX_ALPHA_T(DISPMANX_FLAGS_ALPHA_FROM_SOURCE, 255, 0)
+    element = load().vc_dispmanx_element_add(update, display, layer, ctypes.byref(dst), resource,
+        ctypes.byref(src), DISPMANX_PROTECTION_NONE, ctypes.byref(alpha), None, DISPMANX_NO_ROTATE)
+    if element == 0:
+        raise OSError("vc_dispmanx_element_add failed")
+    return element
+
+
+def element_change(update, element, layer, x, y, width, height, dst_width=None, dst_height=None):
+    """ Move an element and/or change its layer and source rectangle
+    """
+    dst, src = _rects(x, y, dst_width or width, dst_height or height, width, height)
+    flags = ELEMENT_CHANGE_LAYER | ELEMENT_CHANGE_DEST_RECT | ELEMENT_CHANGE_SRC_RECT
+    return load().vc_dispmanx_element_change_attributes(update, element, flags, layer, 255,
+        ctypes.byref(dst), ctypes.byref(src), 0, DISPMANX_NO_ROTATE)
+
+
+def element_change_source(update, element, resource):
+    return load().vc_dispmanx_element_change_source(update, element, resource)
+
+
+def element_remove(update, element):
+    return load().vc_dispmanx_element_remove(update, element)
+
+
+def snapshot(display, width, height):
+    """ Capture everything shown on an open display (all layers) and return
+        it as tightly packed RGB bytes.
+    """
+    lib = load()
+    resource = resource_create(width, height, image_type=VC_IMAGE_RGB888)
+    try:
+        if lib.vc_dispmanx_snapshot(display, resource, DISPMANX_NO_ROTATE) != 0:
+            raise OSError("vc_dispmanx_snapshot failed")
+
+        pitch = align_up(width * 3, 32)
+        buf = ctypes.create_string_buffer(pitch * height)
+        rect = VC_RECT_T(0, 0, width, height)
+        if lib.vc_dispmanx_resource_read_data(resource, ctypes.byref(rect), buf, pitch) != 0:
+            raise OSError("vc_dispmanx_resource_read_data failed")
+    finally:
+        resource_delete(resource)
+
+    data = buf.raw
+    if pitch == width * 3:
+        return data
+    row = width * 3
+    return b"".join(data[y * pitch:y * pitch + row] for y in range(height))
@@ -0,0 +1,257 @@
+#!/usr/bin/env python3
+""" Minimal evdev reader for the controller.
+
+    The controller (controller/controller.ino) is a USB HID gamepad: the 4x4
+    button matrix is buttons 1-16, the thumbstick buttons are 17 and 18 and
+    the sticks are the X/Y and RX/RY axes. Linux exposes it as
+    /dev/input/eventN.
+
+    Device is opened non-blocking: Device.fileno() can be handed to an event
+    loop (loop.add_reader, which is epoll on Linux) and read() then returns
+    the pending events without blocking. Event timestamps are switched to
+    CLOCK_MONOTONIC, the clock of time.monotonic(), so the time from a button
+    press to anything done about it can be measured.
+
+    Usage (list the gamepads, or print the button numbers, menu actions and
+    kernel to userspace latency of the events read from one):
+
+        python3 gamepad.py [DEVICE]
+"""
+
+import fcntl
+import glob
+import os
+import select
+import struct
+import sys
+import time
+
+
+EV_SYN = 0x00
+EV_KEY = 0x01
+EV_ABS = 0x03
+
+SYN_REPORT = 0
+SYN_DROPPED = 3
+
+ABS_X = 0x00
+ABS_Y = 0x01
+ABS_RX = 0x03
+ABS_RY = 0x04
+
+BTN_GAMEPAD = 0x130
+BTN_TRIGGER_HAPPY = 0x2c0
+
+BUTTONS = 18 # buttons of the controller, see controller.ino
+
+# struct input_event: struct timeval, __u16 type, __u16 code, __s32 value
+EVENT = struct.Struct("llHHi")
+# struct input_absinfo: value, minimum, maximum, fuzz, flat, resolution
+ABSINFO = struct.Struct("6i")
+
+
+def _ioc(direction, number, size):
+    return (direction << 30) | (size << 16) | (ord("E") << 8) | number
+
+
+EVIOCGRAB = _ioc(1, 0x90, 4)
+EVIOCSCLOCKID = _ioc(1, 0xa0, 4)
+
+
+def EVIOCGABS(axis):
+    return _ioc(2, 0x40 + axis, ABSINFO.size)
+
+
+# menu actions and the stick direction that triggers them
+ACTIONS = ("up", "down", "left", "right", "select", "back")
+DIRECTIONS = {ABS_X: ("left", "right"), ABS_Y: ("up", "down")}
+
+
+def button_code(number):
+    """ evdev key code of controller button `number` (as passed to
+        Gamepad.press in controller.ino). The kernel maps the first 16
+        buttons of a HID gamepad to BTN_GAMEPAD and up and the rest to
+        BTN_TRIGGER_HAPPY and up.
+    """
+    if number <= 16:
+        return BTN_GAMEPAD + number - 1
+    return BTN_TRIGGER_HAPPY + number - 17
+
+
+def button_number(code):
+    """ Controller button number of an evdev key code, or None
+    """
+    for number in range(1, BUTTONS + 1):
+        if button_code(number) == code:
+            return number
+    return None
+
+
+def parse_buttons(buttons):
+    """ Validate a {action: button number} dict (0 for no button). Raises
+        ValueError.
+    """
+    if not isinstance(buttons, dict):
+        raise ValueError("expected buttons like {\"select\": 1, \"back\": 2}, got %s" % buttons)
+    for action, number in buttons.items():
+        if action not in ACTIONS:
+            raise ValueError("unknown action '%s', must be one of %s" % (action, ", ".join(ACTIONS)))
+        if not isinstance(number, int) or isinstance(number, bool) or not 0 <= number <= BUTTONS:
+            raise ValueError("%s must be a button from 1 to %d (or 0 for none), got %s" % (action, BUTTONS, number))
+    return buttons
+
+
+def _kernel_long_bits(machine=None):
+    """ Size in bits of a long in the kernel. A 32 bit userland can run on a
+        64 bit kernel (e.g. a 32 bit Raspberry Pi OS on a Pi 4), so this
+        can not come from struct.calcsize("l").
+    """
+    machine = machine or os.uname().machine
+    # armv8l is a 32 bit process on an arm64 kernel
+    return 64 if "64" in machine or machine in ("s390x", "armv8l") else 32
+
+
+def _bitmap(text):
+    """ Integer from a sysfs capability bitmap (hex words of a kernel long,
+        most significant first)
+    """
+    width = _kernel_long_bits()
+    bits = 0
+    for word in text.split():
+        bits = (bits << width) | int(word, 16)
+    return bits
+
+
+def find_gamepads(sysfs="/sys/class/input"):
+    """ (device path, name) of every input device with gamepad buttons
+    """
+    gamepads = []
+    events = glob.glob(os.path.join(sysfs, "event*"))
+    for event in sorted(events, key=lambda path: int(os.path.basename(path)[len("event"):])):
+        try:
+            with open(os.path.join(event, "device", "capabilities", "key"), "r") as fhandle:
+                keys = _bitmap(fhandle.read())
+            with open(os.path.join(event, "device", "name"), "r") as fhandle:
+                name = fhandle.read().strip()
+        except (OSError, ValueError):
+            continue
+        if keys >> BTN_GAMEPAD & 1:
+            gamepads.append((os.path.join("/dev/input", os.path.basename(event)), name))
+    return gamepads
+
+
+class Device(object):
+    """ One evdev device. Raises OSError if it can not be opened.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.fd = os.open(path, os.O_RDONLY | os.O_NONBLOCK | os.O_CLOEXEC)
+        try:
+            fcntl.ioctl(self.fd, EVIOCSCLOCKID, struct.pack("i", time.CLOCK_MONOTONIC))
+        except OSError:
+            os.close(self.fd)
+            raise
+
+    def fileno(self):
+        return self.fd
+
+    def grab(self, grab=True):
+        """ While grabbed only this process gets the events of the device
+        """
+        fcntl.ioctl(self.fd, EVIOCGRAB, int(grab))
+
+    def absinfo(self, axis):
+        """ (value, minimum, maximum, fuzz, flat, resolution) of an axis
+        """
+        return ABSINFO.unpack(fcntl.ioctl(self.fd, EVIOCGABS(axis), bytes(ABSINFO.size)))
+
+    def read(self):
+        """ Returns a list of (timestamp, type, code, value) for the pending
+            events
+        """
+        try:
+            data = os.read(self.fd, EVENT.size * 64)
+        except BlockingIOError:
+            return []
+
+        events = []
+        for offset in range(0, len(data) - EVENT.size + 1, EVENT.size):
+            sec, usec, kind, code, value = EVENT.unpack_from(data, offset)
+            events.append((sec + usec / 1000000.0, kind, code, value))
+        return events
+
+    def close(self):
+        if self.fd >= 0:
+            os.close(self.fd)
+            self.fd = -1
+
+
+class Controls(object):
+    """ Turns gamepad events into menu actions. A button acts when it is
+        pressed and a stick when it is pushed more than half way; neither
+        repeats while held.
+
+        buttons - {action: controller button number}, see parse_buttons
+        axes - {axis: (minimum, maximum)} of the sticks that navigate
+    """
+
+    def __init__(self, buttons, axes=None):
+        self.buttons = {button_code(number): action for action, number in buttons.items() if number}
+        self.axes = dict(axes or {axis: (-32767, 32767) for axis in DIRECTIONS})
+        self.held = {} # axis -> direction the stick is pushed in
+
+    def feed(self, event):
+        """ The action for one event, or None
+        """
+        _, kind, code, value = event
+        if kind == EV_KEY:
+            return self.buttons.get(code) if value == 1 else None
+
+        if kind == EV_ABS and code in self.axes:
+            low, high = self.axes[code]
+            offset = (2.0 * value - low - high) / max(1, high - low)
+            previous = self.held.get(code)
+            if abs(offset) >= 0.5:
+                direction = DIRECTIONS[code][offset > 0]
+            elif abs(offset) < 0.25:
+                direction = None
+            else:
+                direction = previous
+            self.held[code] = direction
+            return direction if direction != previous else None
+
+        if kind == EV_SYN and code == SYN_DROPPED:
+            # events were lost, wait for the stick to be moved again
+            self.held.clear()
+        return None
+
+
+if __name__ == '__main__':
+    if len(sys.argv) < 2:
+        gamepads = find_gamepads()
+        for path, name in gamepads:
+            print("%s  %s" % (path, name))
+        if not gamepads:
+            print("no gamepads found")
+        sys.exit(0)
+
+    device = Device(sys.argv[1])
+    controls = Controls({"select": 1, "back": 2})
+    print("Reading %s, press Ctrl-C to stop" % device.path)
+    try:
+        while True:
+            select.select([device], [], [])
+            now = time.monotonic()
+            for event in device.read():
+                timestamp, kind, code, value = event
+                action = controls.feed(event)
+                if kind == EV_KEY and value == 1:
+                    print("button %s pressed  %.2f ms  %s" % (
+                        button_number(code), (now - timestamp) * 1000, action or ""))
+                elif action is not None:
+                    print("stick %s  %.2f ms" % (action, (now - timestamp) * 1000))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        device.close()
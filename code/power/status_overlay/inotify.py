@@ -0,0 +1,82 @@
+#!/usr/bin/env python3
+""" Minimal ctypes binding for Linux inotify.
+
+    Watch.fileno() can be handed to an event loop (loop.add_reader) and
+    read() then returns the pending events without blocking.
+"""
+
+import ctypes
+import ctypes.util
+import os
+import struct
+
+
+IN_MODIFY = 0x00000002
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+
+EVENT = struct.Struct("iIII")   # wd, mask, cookie, length of name
+
+__LIBC__ = None
+
+
+def _libc():
+    global __LIBC__
+    if __LIBC__ is None:
+        libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+        if not hasattr(libc, "inotify_init1"):
+            raise OSError("inotify is not available on this system")
+        libc.inotify_init1.argtypes = [ctypes.c_int]
+        libc.inotify_add_watch.argtypes = [ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32]
+        __LIBC__ = libc
+    return __LIBC__
+
+
+class Watch(object):
+    """ One inotify instance. Raises OSError if inotify is unavailable.
+    """
+
+    def __init__(self):
+        self.fd = _libc().inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            errno = ctypes.get_errno()
+            raise OSError(errno, os.strerror(errno))
+
+    def add(self, path, mask):
+        """ Watch a file or directory. Returns the watch descriptor.
+        """
+        wd = _libc().inotify_add_watch(self.fd, os.fsencode(path), mask)
+        if wd < 0:
+            errno = ctypes.get_errno()
+            raise OSError(errno, os.strerror(errno), path)
+        return wd
+
+    def fileno(self):
+        return self.fd
+
+    def read(self):
+        """ Returns a list of (wd, mask, cookie, name) for all pending events
+        """
+        try:
+            data = os.read(self.fd, 64 * 1024)
+        except BlockingIOError:
+            return []
+
+        events = []
+        offset = 0
+        while offset + EVENT.size <= len(data):
+            wd, mask, cookie, length = EVENT.unpack_from(data, offset)
+            name = data[offset + EVENT.size:offset + EVENT.size + length].rstrip(b"\0")
+            events.append((wd, mask, cookie, os.fsdecode(name)))
+            offset += EVENT.size + length
+        return events
+
+    def close(self):
+        if self.fd >= 0:
+            os.close(self.fd)
+            self.fd = -1
@@ -0,0 +1,126 @@
+#!/usr/bin/env python3
+""" Declarative placement of the hud on one or more displays.
+
+    Every display the hud is shown on is described by a placement (the
+    HUD_DISPLAYS setting), e.g.
+
+        {"display": 2, "anchor": "bottom-left", "padding": [4, 4], "scale": 2}
+
+    display - DispmanX display id (0 is the internal screen, 2 is HDMI)
+    anchor  - corner, edge or center of the screen the hud sticks to:
+              top-left, top, top-right, left, center, right, bottom-left,
+              bottom or bottom-right
+    padding - [x, y] distance in pixels from the anchored screen edges
+    scale   - size factor of the hud on that display
+
+    The hud itself is laid out once in its own coordinates (see
+    status_overlay.hud_layout) and place() maps it onto a screen. Results
+    are kept in a LayoutCache, so a redraw on any number of displays is a
+    dictionary lookup per display once a state has been seen.
+"""
+
+import collections
+
+
+ANCHORS = {
+    "top-left": (0, 0),
+    "top": (0.5, 0),
+    "top-right": (1, 0),
+    "left": (0, 0.5),
+    "center": (0.5, 0.5),
+    "right": (1, 0.5),
+    "bottom-left": (0, 1),
+    "bottom": (0.5, 1),
+    "bottom-right": (1, 1),
+}
+
+Placement = collections.namedtuple("Placement", ["display", "anchor", "padding", "scale"])
+
+
+def parse_placements(settings, default_display=0):
+    """ Validate a list of placement dicts and return a tuple of Placements.
+        An empty list is the hud in the top right corner of default_display.
+        Raises ValueError.
+    """
+    if not isinstance(settings, list):
+        raise ValueError("expected a list of displays")
+    if not settings:
+        settings = [{"display": default_display}]
+
+    placements = []
+    for setting in settings:
+        if not isinstance(setting, dict):
+            raise ValueError("expected a display like {\"display\": 0, \"anchor\": \"top-right\"}, got %s" % setting)
+        unknown = set(setting) - set(Placement._fields)
+        if unknown:
+            raise ValueError("unknown display settings: %s" % ", ".join(sorted(unknown)))
+
+        display = setting.get("display", default_display)
+        anchor = setting.get("anchor", "top-right")
+        padding = setting.get("padding", [0, 0])
+        scale = setting.get("scale", 1)
+
+        if not isinstance(display, int) or isinstance(display, bool) or display < 0:
+            raise ValueError("display must be a display id, got %s" % display)
+        if anchor not in ANCHORS:
+            raise ValueError("anchor must be one of %s" % ", ".join(ANCHORS))
+        if not isinstance(padding, list) or len(padding) != 2 or \
+                not all(isinstance(p, int) and not isinstance(p, bool) for p in padding):
+            raise ValueError("padding must be [x, y] in pixels, got %s" % padding)
+        if not isinstance(scale, (int, float)) or isinstance(scale, bool) or scale <= 0:
+            raise ValueError("scale must be a positive number, got %s" % scale)
+        if display in [p.display for p in placements]:
+            raise ValueError("display %d is listed twice" % display)
+
+        placements.append(Placement(display, anchor, tuple(padding), scale))
+    return tuple(placements)
+
+
+def place(placement, resolution, width, height):
+    """ Top left corner of a width x height box placed on a screen of the
+        given resolution
+    """
+    fx, fy = ANCHORS[placement.anchor]
+    x = fx * (resolution[0] - width) + placement.padding[0] * (1 - 2 * fx)
+    y = fy * (resolution[1] - height) + placement.padding[1] * (1 - 2 * fy)
+    return int(round(x)), int(round(y))
+
+
+def bounds(boxes):
+    """ (left, top, width, height) of the boxes, given as (x, y, width,
+        height) in any coordinate system
+    """
+    left = min(x for x, _, _, _ in boxes)
+    top = min(y for _, y, _, _ in boxes)
+    right = max(x + w for x, _, w, _ in boxes)
+    bottom = max(y + h for _, y, _, h in boxes)
+    return left, top, right - left, bottom - top
+
+
+class LayoutCache(object):
+    """ LRU cache of computed layouts
+    """
+
+    def __init__(self, size=32):
+        self.size = size
+        self.entries = collections.OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, compute):
+        """ The cached value for key, calling compute() to fill it in
+        """
+        value = self.entries.get(key)
+        if value is not None:
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+        self.misses += 1
+        value = self.entries[key] = compute()
+        while len(self.entries) > max(1, self.size):
+            self.entries.popitem(last=False)
+        return value
+
+    def clear(self):
+        self.entries.clear()
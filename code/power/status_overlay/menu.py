@@ -0,0 +1,113 @@
+#!/usr/bin/env python3
+""" The status overlay menu.
+
+    A menu is a title and a list of items: settings, which have a fixed list
+    of values, and actions. up/down move the selection, left/right change
+    the selected setting, select steps a setting forward (wrapping around)
+    or runs an action, and back closes the menu. The menu only keeps state;
+    status_overlay.py applies the settings and draws it (see draw_menu).
+"""
+
+
+# what Menu.handle did
+MOVED = "moved"
+CHANGED = "changed"
+ACTIVATED = "activated"
+CLOSED = "closed"
+
+
+class Setting(object):
+    """ key - what the setting changes
+        values - the values to choose from, in order; a current value that is
+            not one of them is added in its place
+        format - turns a value into the text shown for it
+    """
+
+    def __init__(self, key, label, values, value, format=str):
+        self.key = key
+        self.label = label
+        self.values = list(values)
+        self.format = format
+        if value not in self.values:
+            self.values = sorted(self.values + [value])
+        self.index = self.values.index(value)
+
+    @property
+    def value(self):
+        return self.values[self.index]
+
+    def step(self, delta, wrap=False):
+        """ Move to another value. Returns True if the value changed.
+        """
+        index = self.index + delta
+        if wrap:
+            index %= len(self.values)
+        index = max(0, min(len(self.values) - 1, index))
+        changed = index != self.index
+        self.index = index
+        return changed
+
+    def text(self, selected=False, value=None):
+        """ (label, value) as shown in the menu
+        """
+        value = self.format(self.value if value is None else value)
+        return self.label, "< %s >" % value if selected else "%s  " % value
+
+    def width(self):
+        """ Characters needed for the label and the longest value
+        """
+        return max(len(self.label) + 2 + len(self.format(value)) + 4 for value in self.values)
+
+
+class Action(object):
+
+    def __init__(self, key, label):
+        self.key = key
+        self.label = label
+
+    def text(self, selected=False):
+        return self.label, ""
+
+    def width(self):
+        return len(self.label)
+
+
+class Menu(object):
+
+    def __init__(self, title, items):
+        self.title = title
+        self.items = list(items)
+        self.selected = 0
+
+    def handle(self, action):
+        """ Apply a navigation action (see gamepad.ACTIONS). Returns
+            (MOVED, None), (CHANGED, setting), (ACTIVATED, action),
+            (CLOSED, None) or None if nothing happened.
+        """
+        item = self.items[self.selected]
+        if action in ("up", "down"):
+            selected = max(0, min(len(self.items) - 1, self.selected + (1 if action == "down" else -1)))
+            if selected == self.selected:
+                return None
+            self.selected = selected
+            return (MOVED, None)
+        if action in ("left", "right") and isinstance(item, Setting):
+            return (CHANGED, item) if item.step(1 if action == "right" else -1) else None
+        if action == "select":
+            if isinstance(item, Setting):
+                return (CHANGED, item) if item.step(1, wrap=True) else None
+            return (ACTIVATED, item)
+        if action == "back":
+            return (CLOSED, None)
+        return None
+
+    def rows(self):
+        """ (label, value, selected) of every item
+        """
+        return [item.text(index == self.selected) + (index == self.selected,)
+            for index, item in enumerate(self.items)]
+
+    def columns(self):
+        """ Characters needed for the title or the widest item
+        """
+        return max([len(self.title)] + [item.width() for item in self.items])
@@ -0,0 +1,362 @@
+#!/usr/bin/env python3
+""" Lightweight metrics for the status overlay daemon.
+
+    Counters, gauges and latency histograms are kept in a Registry and
+    rendered in the Prometheus text exposition format, so a dump can be read
+    by a person or picked up by node_exporter's textfile collector.
+
+    Recording is cheap (a lock, a bisect and a few additions) so hot paths
+    can be instrumented permanently with the timed() decorator.
+"""
+
+import bisect
+import collections
+import cProfile
+import functools
+import io
+import os
+import pstats
+import sys
+import threading
+import time
+
+
+# seconds; covers everything from an i2c read to a pngview start
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+
+def _labels(labels):
+    """ Canonical, hashable form of a label dict
+    """
+    return tuple(sorted(labels.items()))
+
+
+def _format_labels(labels, extra=()):
+    pairs = list(labels) + list(extra)
+    if not pairs:
+        return ""
+    escape = lambda v: str(v).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+    return "{" + ",".join('%s="%s"' % (k, escape(v)) for k, v in pairs) + "}"
+
+
+def _format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    if isinstance(value, float) and value.is_integer() and abs(value) < 1e15:
+        return str(int(value))
+    return repr(value)
+
+
+class Metric(object):
+    """ Base class. A callback, if given, is called at render time and
+        returns either a value or a {labels dict as tuple: value} mapping.
+    """
+    kind = "untyped"
+
+    def __init__(self, name, help, callback=None):
+        self.name = name
+        self.help = help
+        self.callback = callback
+        self.values = {}
+        self.lock = threading.Lock()
+
+    def samples(self):
+        """ Returns [(suffix, labels, value)]
+        """
+        if self.callback is not None:
+            value = self.callback()
+            if isinstance(value, dict):
+                return [("", labels, v) for labels, v in sorted(value.items())]
+            return [("", (), value)]
+        with self.lock:
+            return [("", labels, v) for labels, v in sorted(self.values.items())]
+
+    def render(self):
+        lines = ["# HELP %s %s" % (self.name, self.help), "# TYPE %s %s" % (self.name, self.kind)]
+        for suffix, labels, value in self.samples():
+            lines.append("%s%s%s %s" % (self.name, suffix, _format_labels(labels), _format_value(value)))
+        return "\n".join(lines)
+
+
+class Counter(Metric):
+    kind = "counter"
+
+    def inc(self, amount=1, **labels):
+        key = _labels(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def get(self, **labels):
+        return self.values.get(_labels(labels), 0)
+
+
+class Gauge(Metric):
+    kind = "gauge"
+
+    def set(self, value, **labels):
+        with self.lock:
+            self.values[_labels(labels)] = value
+
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, name, help, buckets=DEFAULT_BUCKETS):
+        super().__init__(name, help)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, **labels):
+        key = _labels(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self.lock:
+            state = self.values.get(key)
+            if state is None:
+                state = self.values[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            state[0][index] += 1
+            state[1] += value
+            state[2] += 1
+
+    def count(self, **labels):
+        state = self.values.get(_labels(labels))
+        return state[2] if state else 0
+
+    def total(self, **labels):
+        state = self.values.get(_labels(labels))
+        return state[1] if state else 0.0
+
+    def samples(self):
+        samples = []
+        with self.lock:
+            items = sorted((labels, (list(s[0]), s[1], s[2])) for labels, s in self.values.items())
+        for labels, (counts, total, count) in items:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += bucket_count
+                samples.append(("_bucket", labels + (("le", _format_value(float(bound))),), cumulative))
+            samples.append(("_sum", labels, total))
+            samples.append(("_count", labels, count))
+        return samples
+
+
+class Registry(object):
+
+    def __init__(self):
+        self.metrics = collections.OrderedDict()
+
+    def _add(self, metric):
+        if metric.name in self.metrics:
+            raise ValueError("metric %s is already registered" % metric.name)
+        self.metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name, help, callback=None):
+        return self._add(Counter(name, help, callback))
+
+    def gauge(self, name, help, callback=None):
+        return self._add(Gauge(name, help, callback))
+
+    def histogram(self, name, help, buckets=DEFAULT_BUCKETS):
+        return self._add(Histogram(name, help, buckets))
+
+    def render(self):
+        """ All metrics in the Prometheus text format
+        """
+        return "\n".join(metric.render() for metric in self.metrics.values()) + "\n"
+
+    def dump(self, path):
+        """ Write render() to path atomically
+        """
+        tmp_path = "%s.tmp.%d" % (path, os.getpid())
+        with open(tmp_path, "w") as fhandle:
+            fhandle.write(self.render())
+        os.replace(tmp_path, path)
+
+
+REGISTRY = Registry()
+
+CALL_SECONDS = REGISTRY.histogram("status_overlay_call_seconds", "Latency of instrumented functions")
+CALL_ERRORS = REGISTRY.counter("status_overlay_call_errors_total", "Instrumented calls that raised an exception")
+INPUT_LATENCY = REGISTRY.histogram("status_overlay_input_latency_seconds",
+    "Time from a controller event to the daemon reading it (stage=read) and to its effect on screen (stage=display)")
+
+
+def timed(name):
+    """ Decorator recording the latency of every call into CALL_SECONDS,
+        labelled function=name
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            except BaseException:
+                CALL_ERRORS.inc(function=name)
+                raise
+            finally:
+                CALL_SECONDS.observe(time.perf_counter() - start, function=name)
+        return wrapper
+    return decorator
+
+
+# -----------------------------------------------------------------------------
+# Process statistics
+# -----------------------------------------------------------------------------
+def count_spawns(counter):
+    """ Count every child process this interpreter starts (subprocess,
+        os.system, posix_spawn, ...) in `counter`, labelled by program name.
+        Uses an audit hook, so no call site needs to be changed.
+    """
+    def hook(event, args):
+        if event == "subprocess.Popen":
+            argv = args[1]
+            program = argv if isinstance(argv, (str, bytes)) else (argv[0] if argv else args[0])
+            counter.inc(program=os.path.basename(os.fsdecode(program).split()[0]) if program else "?")
+        elif event in ("os.system", "os.posix_spawn", "os.spawn", "os.exec"):
+            counter.inc(program=event)
+
+    sys.addaudithook(hook)
+
+
+def child_processes():
+    """ Number of live (or not yet reaped) child processes
+    """
+    pid = str(os.getpid())
+    count = 0
+    for entry in os.listdir("/proc"):
+        if not entry.isdigit():
+            continue
+        try:
+            with open("/proc/%s/stat" % entry, "r") as fhandle:
+                fields = fhandle.read().rsplit(")", 1)[1].split()
+        except (OSError, IndexError):
+            continue
+        if fields[1] == pid:
+            count += 1
+    return count
+
+
+def native_threads():
+    """ Number of OS threads in this process, including ones not started by
+        python (e.g. the RPi.GPIO event thread)
+    """
+    try:
+        with open("/proc/self/status", "r") as fhandle:
+            for line in fhandle:
+                if line.startswith("Threads:"):
+                    return int(line.split()[1])
+    except (OSError, ValueError):
+        pass
+    return threading.active_count()
+
+
+def resident_memory():
+    try:
+        with open("/proc/self/statm", "r") as fhandle:
+            return int(fhandle.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        return 0
+
+
+def context_switches():
+    """ (voluntary, involuntary) context switches of all threads of this
+        process. A thread switches voluntarily every time it blocks, so the
+        voluntary ones count how often the process sleeps and wakes up.
+    """
+    totals = [0, 0]
+    try:
+        tasks = os.listdir("/proc/self/task")
+    except OSError:
+        return tuple(totals)
+    for task in tasks:
+        try:
+            with open("/proc/self/task/%s/status" % task, "r") as fhandle:
+                for line in fhandle:
+                    if line.startswith("voluntary_ctxt_switches:"):
+                        totals[0] += int(line.split()[1])
+                    elif line.startswith("nonvoluntary_ctxt_switches:"):
+                        totals[1] += int(line.split()[1])
+        except (OSError, ValueError):
+            continue    # the thread exited
+    return tuple(totals)
+
+
+class RateMeter(object):
+    """ Per minute rate of an increasing count, over roughly the last `window`
+        seconds. Every call to rate() is a reading, so call it regularly
+        (e.g. whenever the metrics are written).
+    """
+
+    def __init__(self, count, window=60):
+        self.count = count
+        self.window = window
+        self.readings = collections.deque()
+
+    def rate(self):
+        now = time.monotonic()
+        self.readings.append((now, self.count()))
+        # keep the newest reading that is at least a window old
+        while len(self.readings) > 2 and now - self.readings[1][0] >= self.window:
+            self.readings.popleft()
+        (start, first), (end, last) = self.readings[0], self.readings[-1]
+        if end - start <= 0:
+            return 0.0
+        return (last - first) * 60.0 / (end - start)
+
+
+WAKEUPS = RateMeter(lambda: context_switches()[0])
+
+
+def register_process_metrics(registry=REGISTRY, children=child_processes):
+    """ children - returns the number of live child processes; the default
+        scans all of /proc, so a caller that knows its children should pass
+        its own count
+    """
+    registry.counter("process_cpu_seconds_total", "User and system CPU time",
+        lambda: sum(os.times()[:2]))
+    registry.gauge("process_resident_memory_bytes", "Resident memory size", resident_memory)
+    registry.gauge("status_overlay_threads", "Threads, by kind", lambda: {
+        (("kind", "python"),): threading.active_count(),
+        (("kind", "native"),): native_threads(),
+    })
+    registry.gauge("status_overlay_child_processes", "Child processes currently alive", children)
+    registry.counter("process_context_switches_total", "Context switches of all threads, by kind", lambda: dict(
+        zip([(("kind", "voluntary"),), (("kind", "involuntary"),)], context_switches())))
+    registry.gauge("status_overlay_wakeups_per_minute", "Voluntary context switches per minute (wakeups)",
+        WAKEUPS.rate)
+
+
+# -----------------------------------------------------------------------------
+# Profiling
+# -----------------------------------------------------------------------------
+class Profiler(object):
+    """ Collects a cProfile snapshot of the thread that calls start() until
+        stop() is called
+    """
+
+    def __init__(self, directory):
+        self.directory = os.path.expanduser(directory)
+        self.profile = None
+
+    @property
+    def running(self):
+        return self.profile is not None
+
+    def start(self):
+        self.profile = cProfile.Profile()
+        self.profile.enable()
+
+    def stop(self, top=25):
+        """ Write the snapshot to a .prof file (for pstats/snakeviz). Returns
+            (path, summary of the top functions by cumulative time).
+        """
+        profile, self.profile = self.profile, None
+        profile.disable()
+
+        os.makedirs(self.directory, exist_ok=True)
+        path = os.path.join(self.directory, "status_overlay-%s.prof" % time.strftime("%Y%m%d-%H%M%S"))
+        profile.dump_stats(path)
+
+        summary = io.StringIO()
+        pstats.Stats(profile, stream=summary).sort_stats("cumulative").print_stats(top)
+        return path, summary.getvalue()
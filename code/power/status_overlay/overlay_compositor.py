@@ -0,0 +1,251 @@
+#!/usr/bin/env python3
+""" Long lived overlay compositor.
+
+    Owns a set of DispmanX elements (one per sprite) and applies sprite
+    updates that are streamed to it over stdin. Every change between two
+    commits is applied in a single DispmanX update, so all sprites flip on
+    the same vsync and nothing flickers.
+
+    Protocol: one JSON object per line on stdin.
+
+        {"op": "load", "key": K, "path": P}
+            decode the PNG at P and keep it as image K
+        {"op": "load", "key": K, "width": W, "height": H, "size": N}
+            followed by N bytes of raw RGBA pixel data for image K
+        {"op": "unload", "key": K}
+            forget image K. Sprites still showing it are removed, and its
+            memory released, by the next commit.
+        {"op": "set", "id": ID, "key": K, "display": D, "layer": L, "x": X, "y": Y}
+            show image K as sprite ID. Omit x and y to center the sprite.
+        {"op": "remove", "id": ID}
+        {"op": "commit", "ack": true}
+            flip all pending changes. If ack is set, "ok <seq>" is written to
+            stdout once the update has been applied, or "err <seq> <message>"
+            if some of the changes could not be applied (the others are).
+        {"op": "quit"}
+
+    "ready" is written to stdout once DispmanX has been initialized.
+"""
+
+import json
+import sys
+
+import dispmanx
+import pngcodec
+
+
+class Compositor(object):
+
+    def __init__(self):
+        self.displays = {}  # display id -> (handle, width, height)
+        self.images = {}    # key -> (resource, width, height)
+        self.sprites = {}   # id -> dict(element, key, resource, display, layer, x, y)
+        self.pending = []
+        self.released = []  # resources of unloaded images, deleted by the next commit
+        self.commits = 0
+
+    def display(self, display_id):
+        if display_id not in self.displays:
+            handle = dispmanx.display_open(display_id)
+            width, height = dispmanx.display_size(handle)
+            self.displays[display_id] = (handle, width, height)
+        return self.displays[display_id]
+
+    def load(self, key, width, height, rgba):
+        if key in self.images:
+            self.unload(key)
+        resource = dispmanx.resource_create(width, height, rgba)
+        self.images[key] = (resource, width, height)
+
+    def unload(self, key):
+        resource, _, _ = self.images.pop(key)
+        if any(sprite["resource"] == resource for sprite in self.sprites.values()):
+            # on screen, release it with the rest of the pending changes
+            self.released.append(resource)
+        else:
+            dispmanx.resource_delete(resource)
+
+    def set(self, sprite_id, key, display=0, layer=0, x=None, y=None):
+        self.pending.append(("set", sprite_id, key, display, layer, x, y))
+
+    def remove(self, sprite_id):
+        self.pending.append(("remove", sprite_id))
+
+    def commit(self):
+        """ Apply all pending changes in one update. Sprites that did not
+            change are left alone, a new position only moves the element and
+            a new image only swaps the element source. A change that fails
+            (e.g. an image that was never loaded) is skipped and the others
+            are still applied. Returns the errors.
+        """
+        errors = []
+        if not self.pending and not self.released:
+            self.commits += 1
+            return errors
+
+        update = []
+
+        def begin():
+            # only start a DispmanX update once something actually changes
+            if not update:
+                update.append(dispmanx.update_start())
+            return update[0]
+
+        for change in self.pending:
+            try:
+                self._apply(change, begin)
+            except (KeyError, ValueError, TypeError, OSError) as e:
+                errors.append("%s %s: %s" % (change[0], change[1], e))
+
+        # sprites that still show an unloaded image go away in the same update
+        for sprite_id, sprite in list(self.sprites.items()):
+            if sprite["resource"] in self.released:
+                del self.sprites[sprite_id]
+                try:
+                    dispmanx.element_remove(begin(), sprite["element"])
+                except OSError as e:
+                    errors.append("remove %s: %s" % (sprite_id, e))
+
+        if update:
+            try:
+                dispmanx.update_submit_sync(update[0])
+            except OSError as e:
+                errors.append("update: %s" % e)
+        for resource in self.released:
+            try:
+                dispmanx.resource_delete(resource)
+            except OSError as e:
+                errors.append("unload: %s" % e)
+        self.pending = []
+        self.released = []
+        self.commits += 1
+        return errors
+
+    def _apply(self, change, begin):
+        """ Add one pending change to the update returned by begin()
+        """
+        if change[0] == "remove":
+            sprite = self.sprites.pop(change[1], None)
+            if sprite is not None:
+                dispmanx.element_remove(begin(), sprite["element"])
+            return
+
+        _, sprite_id, key, display_id, layer, x, y = change
+        if key not in self.images:
+            raise KeyError("image %s is not loaded" % key)
+        resource, width, height = self.images[key]
+        handle, screen_width, screen_height = self.display(display_id)
+        if x is None:
+            x = (screen_width - width) // 2
+        if y is None:
+            y = (screen_height - height) // 2
+
+        sprite = self.sprites.get(sprite_id)
+        if sprite is not None and sprite["display"] != display_id:
+            dispmanx.element_remove(begin(), sprite["element"])
+            del self.sprites[sprite_id]
+            sprite = None
+
+        if sprite is None:
+            element = dispmanx.element_add(begin(), handle, layer, resource, x, y, width, height)
+            self.sprites[sprite_id] = dict(element=element, key=key, resource=resource, display=display_id,
+                layer=layer, x=x, y=y)
+            return
+
+        # compare resources, an image can be loaded again under the same key
+        if sprite["resource"] != resource:
+            dispmanx.element_change_source(begin(), sprite["element"], resource)
+        if sprite["resource"] != resource or (sprite["layer"], sprite["x"], sprite["y"]) != (layer, x, y):
+            dispmanx.element_change(begin(), sprite["element"], layer, x, y, width, height)
+        sprite.update(key=key, resource=resource, layer=layer, x=x, y=y)
+
+    def close(self):
+        for sprite_id in list(self.sprites.keys()):
+            self.remove(sprite_id)
+        for error in self.commit():
+            sys.stderr.write("overlay_compositor: %s\n" % error)
+        for resource, _, _ in self.images.values():
+            dispmanx.resource_delete(resource)
+        self.images = {}
+        for handle, _, _ in self.displays.values():
+            dispmanx.display_close(handle)
+        self.displays = {}
+
+
+def serve(stdin, stdout):
+    """ Read commands from stdin until it is closed or a quit command is
+        received.
+    """
+    compositor = Compositor()
+    stdout.write(b"ready\n")
+    stdout.flush()
+
+    try:
+        for line in iter(stdin.readline, b""):
+            if not line.strip():
+                continue
+            command = {}
+            try:
+                command = json.loads(line.decode("utf-8"))
+                op = command["op"]
+
+                # read the pixels of a raw load before anything can fail, so
+                # a bad header never leaves them to be parsed as commands
+                rgba = None
+                if op == "load" and "size" in command:
+                    rgba = stdin.read(int(command["size"]))
+
+                if op == "load":
+                    if rgba is None:
+                        width, height, rgba = pngcodec.read(command["path"])
+                    else:
+                        width, height = int(command["width"]), int(command["height"])
+                        if len(rgba) != width * height * 4:
+                            raise ValueError("image %s: got %d bytes for %dx%d" % (
+                                command["key"], len(rgba), width, height))
+                    compositor.load(command["key"], width, height, rgba)
+                elif op == "unload":
+                    compositor.unload(command["key"])
+                elif op == "set":
+                    compositor.set(command["id"], command["key"], command.get("display", 0),
+                        command.get("layer", 0), command.get("x"), command.get("y"))
+                elif op == "remove":
+                    compositor.remove(command["id"])
+                elif op == "commit":
+                    errors = compositor.commit()
+                    for error in errors:
+                        sys.stderr.write("overlay_compositor: %s\n" % error)
+                    if command.get("ack"):
+                        reply(stdout, compositor.commits, errors)
+                elif op == "quit":
+                    break
+                else:
+                    raise ValueError("unknown op '%s'" % op)
+            except (KeyError, ValueError, TypeError, OSError) as e:
+                sys.stderr.write("overlay_compositor: %s\n" % e)
+                if isinstance(command, dict) and command.get("op") == "commit" and command.get("ack"):
+                    # the daemon is waiting for this
+                    reply(stdout, compositor.commits, [str(e)])
+    finally:
+        compositor.close()
+
+
+def reply(stdout, seq, errors):
+    """ Acknowledge a commit
+    """
+    if errors:
+        message = "; ".join(errors).replace("\n", " ")
+        stdout.write(b"err %d %s\n" % (seq, message.encode("utf-8", "replace")))
+    else:
+        stdout.write(b"ok %d\n" % seq)
+    stdout.flush()
+
+
+if __name__ == '__main__':
+    try:
+        dispmanx.load()
+    except OSError as e:
+        sys.stderr.write("overlay_compositor: %s\n" % e)
+        sys.exit(1)
+
+    serve(sys.stdin.buffer, sys.stdout.buffer)
@@ -0,0 +1,140 @@
+#!/usr/bin/env python3
+""" Control the status overlay daemon over its unix socket.
+
+    Protocol: newline separated JSON over CONTROL_SOCKET_PATH
+    ("/tmp/status_overlay.sock" by default). Each request line is either one
+    command object or a list of them; a list is run as one batch and gets one
+    reply line with a list of results. Every result has "ok" and, on failure,
+    "error".
+
+        {"cmd": "set_visibility", "visible": true}
+        {"cmd": "flash", "duration": 3}
+        {"cmd": "notify", "image": "low_battery_warning.png", "duration": 3, "id": "x"}
+        {"cmd": "notify", "path": "/home/pi/my_notification.png", "duration": 3}
+        {"cmd": "query"}
+        {"cmd": "reload_config"}
+        {"cmd": "screenshot"}
+        {"cmd": "metrics"}
+        {"cmd": "menu", "action": "toggle"}    open, close, toggle or up, down,
+                                              left, right, select, back
+
+    Usage (several commands can be joined with "+" to send them as a batch):
+
+        python3 overlayctl.py show|hide|query|reload|screenshot|metrics
+        python3 overlayctl.py flash [SECONDS]
+        python3 overlayctl.py notify SPRITE_OR_PNG_PATH [SECONDS]
+        python3 overlayctl.py menu [ACTION]
+        python3 overlayctl.py hide + notify ~/saving.png 2
+        python3 overlayctl.py --json '[{"cmd": "query"}]'
+"""
+
+import json
+import os
+import socket
+import sys
+
+
+DEFAULT_SOCKET_PATH = "/tmp/status_overlay.sock"
+
+
+class Client(object):
+    """ Keeps one connection to the daemon open for any number of requests
+    """
+
+    def __init__(self, path=DEFAULT_SOCKET_PATH, timeout=5):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.settimeout(timeout)
+        self.sock.connect(path)
+        self.reader = self.sock.makefile("rb")
+
+    def send(self, commands):
+        """ Send one command (a dict) or a batch (a list of dicts) and return
+            the result(s).
+        """
+        self.sock.sendall(json.dumps(commands).encode("utf-8") + b"\n")
+        line = self.reader.readline()
+        if not line:
+            raise ConnectionError("status overlay closed the connection")
+        return json.loads(line)
+
+    def close(self):
+        self.reader.close()
+        self.sock.close()
+
+
+def parse_command(args):
+    """ Turn one command line command (e.g. ["notify", "x.png", "2"]) into
+        a protocol command
+    """
+    name, args = args[0], args[1:]
+    if name in ("show", "hide"):
+        return {"cmd": "set_visibility", "visible": name == "show"}
+    if name == "flash":
+        command = {"cmd": "flash"}
+        if args:
+            command["duration"] = float(args[0])
+        return command
+    if name == "notify" and args:
+        command = {"cmd": "notify"}
+        if args[0].endswith(".png") and os.path.sep in args[0]:
+            command["path"] = os.path.abspath(os.path.expanduser(args[0]))
+        else:
+            command["image"] = args[0]
+        if len(args) > 1:
+            command["duration"] = float(args[1])
+        return command
+    if name == "query":
+        return {"cmd": "query"}
+    if name == "reload":
+        return {"cmd": "reload_config"}
+    if name == "screenshot":
+        return {"cmd": "screenshot"}
+    if name == "metrics":
+        return {"cmd": "metrics"}
+    if name == "menu":
+        return {"cmd": "menu", "action": args[0] if args else "toggle"}
+    raise ValueError("unknown command: %s" % " ".join([name] + args))
+
+
+def parse_commands(argv):
+    commands = []
+    current = []
+    for arg in argv + ["+"]:
+        if arg == "+":
+            if current:
+                commands.append(parse_command(current))
+            current = []
+        else:
+            current.append(arg)
+    return commands
+
+
+if __name__ == '__main__':
+    argv = sys.argv[1:]
+    path = os.environ.get("STATUS_OVERLAY_SOCKET", DEFAULT_SOCKET_PATH)
+
+    try:
+        if argv[:1] == ["--json"] and len(argv) == 2:
+            request = json.loads(argv[1])
+        else:
+            request = parse_commands(argv)
+            if not request:
+                raise ValueError("no command given")
+            if len(request) == 1:
+                request = request[0]
+    except ValueError as e:
+        print(e)
+        print(__doc__)
+        sys.exit(2)
+
+    client = Client(path)
+    response = client.send(request)
+    client.close()
+
+    if request == {"cmd": "metrics"} and response.get("ok"):
+        # already in the Prometheus text format
+        sys.stdout.write(response["text"])
+    else:
+        print(json.dumps(response, indent=2, sort_keys=True))
+    results = response if isinstance(response, list) else [response]
+    sys.exit(0 if all(result.get("ok") for result in results) else 1)
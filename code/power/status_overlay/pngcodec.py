@@ -0,0 +1,248 @@
+#!/usr/bin/env python3
+""" Small pure python PNG decoder/encoder.
+
+    This only needs to handle the sprites shipped with the status overlay
+    (8 bit, non-interlaced greyscale/RGB/palette images with or without
+    alpha), so it has no dependencies outside of the standard library.
+    Decoded images are always returned as tightly packed RGBA bytes.
+"""
+
+import struct
+import zlib
+
+
+PNG_SIGNATURE = b'\x89PNG\r\n\x1a\n'
+
+COLOR_GREY = 0
+COLOR_RGB = 2
+COLOR_PALETTE = 3
+COLOR_GREY_ALPHA = 4
+COLOR_RGBA = 6
+
+CHANNELS = {
+    COLOR_GREY: 1,
+    COLOR_RGB: 3,
+    COLOR_PALETTE: 1,
+    COLOR_GREY_ALPHA: 2,
+    COLOR_RGBA: 4,
+}
+
+
+class PNGError(TypeError):
+    """ Raised for any file that is not a PNG image this module can decode.
+    """
+    pass
+
+
+def read_header(data, fname="<memory>"):
+    """ Parse the signature and IHDR chunk. Returns (width, height,
+        bit_depth, color_type, interlace).
+    """
+    if len(data) < 33 or data[:8] != PNG_SIGNATURE or data[12:16] != b'IHDR':
+        raise PNGError("Invalid PNG file provided: %s" % fname)
+
+    width, height, bit_depth, color_type, _, _, interlace = struct.unpack('>IIBBBBB', data[16:29])
+    if width == 0 or height == 0:
+        raise PNGError("Invalid PNG file provided: %s" % fname)
+
+    return width, height, bit_depth, color_type, interlace
+
+
+def _unfilter(raw, width, height, bpp):
+    """ Undo the per scanline PNG filters. Returns the unfiltered pixel data
+        without the filter type bytes.
+    """
+    stride = width * bpp
+    out = bytearray(stride * height)
+    prev = bytearray(stride)
+    pos = 0
+
+    for y in range(height):
+        ftype = raw[pos]
+        line = bytearray(raw[pos + 1:pos + 1 + stride])
+        pos += stride + 1
+
+        if ftype == 1:
+            for i in range(bpp, stride):
+                line[i] = (line[i] + line[i - bpp]) & 0xFF
+        elif ftype == 2:
+            for i in range(stride):
+                line[i] = (line[i] + prev[i]) & 0xFF
+        elif ftype == 3:
+            for i in range(stride):
+                left = line[i - bpp] if i >= bpp else 0
+                line[i] = (line[i] + ((left + prev[i]) >> 1)) & 0xFF
+        elif ftype == 4:
+            for i in range(stride):
+                a = line[i - bpp] if i >= bpp else 0
+                b = prev[i]
+                c = prev[i - bpp] if i >= bpp else 0
+                p = a + b - c
+                pa = abs(p - a)
+                pb = abs(p - b)
+                pc = abs(p - c)
+                if pa <= pb and pa <= pc:
+                    pred = a
+                elif pb <= pc:
+                    pred = b
+                else:
+                    pred = c
+                line[i] = (line[i] + pred) & 0xFF
+        elif ftype != 0:
+            raise PNGError("Unknown PNG filter type %d" % ftype)
+
+        out[y * stride:(y + 1) * stride] = line
+        prev = line
+
+    return out
+
+
+def decode(data, fname="<memory>"):
+    """ Decode PNG file contents. Returns (width, height, rgba) where rgba is
+        a bytearray of width * height * 4 bytes.
+    """
+    width, height, bit_depth, color_type, interlace = read_header(data, fname)
+    if bit_depth != 8 or interlace != 0 or color_type not in CHANNELS:
+        raise PNGError("Unsupported PNG format (depth %d, color type %d, interlace %d): %s" % (
+            bit_depth, color_type, interlace, fname))
+
+    idat = []
+    palette = None
+    transparency = None
+    pos = 8
+    try:
+        while pos < len(data):
+            length, ctype = struct.unpack('>I4s', data[pos:pos + 8])
+            chunk = data[pos + 8:pos + 8 + length]
+            if len(chunk) != length:
+                raise PNGError("Truncated PNG file: %s" % fname)
+            if ctype == b'IDAT':
+                idat.append(chunk)
+            elif ctype == b'PLTE':
+                palette = chunk
+            elif ctype == b'tRNS':
+                transparency = chunk
+            elif ctype == b'IEND':
+                break
+            pos += 12 + length
+        raw = zlib.decompress(b''.join(idat))
+    except (struct.error, zlib.error) as e:
+        raise PNGError("Corrupt PNG file %s: %s" % (fname, e))
+
+    channels = CHANNELS[color_type]
+    if len(raw) != height * (width * channels + 1):
+        raise PNGError("Corrupt PNG image data: %s" % fname)
+
+    pixels = _unfilter(raw, width, height, channels)
+    count = width * height
+
+    if color_type == COLOR_RGBA:
+        return width, height, pixels
+
+    rgba = bytearray(count * 4)
+    if color_type == COLOR_RGB:
+        rgba[0::4] = pixels[0::3]
+        rgba[1::4] = pixels[1::3]
+        rgba[2::4] = pixels[2::3]
+        rgba[3::4] = b'\xff' * count
+    elif color_type == COLOR_GREY_ALPHA:
+        rgba[0::4] = pixels[0::2]
+        rgba[1::4] = pixels[0::2]
+        rgba[2::4] = pixels[0::2]
+        rgba[3::4] = pixels[1::2]
+    elif color_type == COLOR_GREY:
+        rgba[0::4] = pixels
+        rgba[1::4] = pixels
+        rgba[2::4] = pixels
+        rgba[3::4] = b'\xff' * count
+    else:
+        if palette is None:
+            raise PNGError("Palette PNG without PLTE chunk: %s" % fname)
+        alpha = bytearray(transparency or b'') + b'\xff' * 256
+        lut = [bytes(palette[i * 3:i * 3 + 3]) + bytes((alpha[i],)) for i in range(len(palette) // 3)]
+        try:
+            rgba = bytearray(b''.join(lut[i] for i in pixels))
+        except IndexError:
+            raise PNGError("Palette index out of range: %s" % fname)
+
+    return width, height, rgba
+
+
+def read(fname):
+    """ Decode a PNG file from disk. Returns (width, height, rgba)
+    """
+    with open(fname, 'rb') as fhandle:
+        return decode(fhandle.read(), fname)
+
+
+def _chunk(ctype, data):
+    return struct.pack('>I', len(data)) + ctype + data + struct.pack('>I', zlib.crc32(ctype + data) & 0xFFFFFFFF)
+
+
+def encode(width, height, rgba, level=6, channels=4):
+    """ Encode RGBA (or RGB if channels is 3) pixel data as a PNG. No
+        filtering is applied, which keeps encoding cheap.
+    """
+    stride = width * channels
+    raw = bytearray()
+    for y in range(height):
+        raw.append(0)
+        raw += rgba[y * stride:(y + 1) * stride]
+
+    color_type = COLOR_RGBA if channels == 4 else COLOR_RGB
+    header = struct.pack('>IIBBBBB', width, height, 8, color_type, 0, 0, 0)
+    return PNG_SIGNATURE + _chunk(b'IHDR', header) + \
+        _chunk(b'IDAT', zlib.compress(bytes(raw), level)) + _chunk(b'IEND', b'')
+
+
+def write(fname, width, height, rgba, level=6):
+    """ Encode RGBA pixel data and write it to fname
+    """
+    with open(fname, 'wb') as fhandle:
+        fhandle.write(encode(width, height, rgba, level))
+
+
+def blit(dst, dst_width, dst_height, src, src_width, src_height, x, y):
+    """ Alpha blend the RGBA image src onto the RGBA image dst (in place)
+        with its top left corner at (x, y). Pixels falling outside of dst
+        are clipped.
+    """
+    for row in range(src_height):
+        dy = y + row
+        if dy < 0 or dy >= dst_height:
+            continue
+        for col in range(src_width):
+            dx = x + col
+            if dx < 0 or dx >= dst_width:
+                continue
+
+            s = (row * src_width + col) * 4
+            alpha = src[s + 3]
+            if alpha == 0:
+                continue
+
+            d = (dy * dst_width + dx) * 4
+            if alpha == 255 or dst[d + 3] == 0:
+                dst[d:d + 4] = src[s:s + 4]
+                continue
+
+            dst_alpha = dst[d + 3] * (255 - alpha) // 255
+            out_alpha = alpha + dst_alpha
+            for c in range(3):
+                dst[d + c] = (src[s + c] * alpha + dst[d + c] * dst_alpha) // out_alpha
+            dst[d + 3] = out_alpha
+
+
+def scale(src, src_width, src_height, factor):
+    """ Nearest neighbour scale of the RGBA image src by factor. Returns
+        (width, height, rgba).
+    """
+    width = max(1, int(round(src_width * factor)))
+    height = max(1, int(round(src_height * factor)))
+    columns = [min(src_width - 1, int(col / factor)) * 4 for col in range(width)]
+
+    rows = []
+    for row in range(height):
+        offset = min(src_height - 1, int(row / factor)) * src_width * 4
+        rows.append(b"".join(src[offset + col:offset + col + 4] for col in columns))
+    return width, height, b"".join(rows)
@@ -0,0 +1,200 @@
+#!/usr/bin/env python3
+""" Low battery and shutdown policy.
+
+    Decides when to warn about the battery and when to shut down from the
+    telemetry history instead of raw state of charge thresholds: the time
+    left is estimated from the measured current (or the recent discharge
+    slope, see telemetry.estimate) and smoothed, warnings are given in
+    minutes remaining, and once the battery is critical a graceful shutdown
+    is scheduled to finish a safety margin before the battery is estimated
+    to be empty. If the state of charge itself is down to the critical
+    percent the estimate is not trusted and the shutdown starts at most a
+    safety margin later. Hysteresis keeps noisy readings from re-triggering
+    warnings.
+
+    The policy only looks at samples and their timestamps, never at the
+    clock, so a recorded battery log can be replayed against it offline:
+
+        python3 policy.py [LOG_DIRECTORY] [--low-minutes N] [--critical-minutes N]
+                          [--margin SECONDS] [--window SECONDS]
+"""
+
+import argparse
+import collections
+import math
+import time
+
+import telemetry
+
+
+FLAG_DSG = 0x0001
+
+NORMAL = "normal"
+LOW = "low"
+CRITICAL = "critical"
+
+# kind is "low" or "critical" (warn, value is the estimated seconds left or
+# None), "shutdown" (start the shutdown at timestamp `value`; a later action
+# replaces an earlier one) or "cancel" (charger connected, do not shut down)
+Action = collections.namedtuple("Action", ["kind", "value"])
+
+
+class BatteryPolicy(object):
+    """ State machine fed with a TelemetryBuffer after every new sample.
+
+        low_minutes, critical_minutes - warn at this many minutes left
+        low_percent, critical_percent - and never later than at this state of
+            charge, also used when there is no time estimate yet
+        safety_margin - seconds before the estimated empty time at which the
+            shutdown starts; at or below critical_percent the shutdown starts
+            no later than this many seconds from now, whatever the estimate
+        hysteresis_minutes, hysteresis_percent - how far the estimate has to
+            recover before a low battery warning is armed again
+        window - seconds of history used for slope based estimates
+        smoothing - time constant in seconds of the moving average applied
+            to the measured discharge current
+    """
+
+    def __init__(self, **settings):
+        self.low_minutes = 20
+        self.critical_minutes = 5
+        self.low_percent = 10
+        self.critical_percent = 5
+        self.safety_margin = 120
+        self.hysteresis_minutes = 3
+        self.hysteresis_percent = 2
+        self.window = 600
+        self.smoothing = 300
+        self.configure(**settings)
+        self.reset()
+
+    def reset(self):
+        """ Forget the battery state, as if the daemon had just started
+        """
+        self.state = NORMAL
+        self.current = None         # smoothed discharge current, mA
+        self.time_left = None       # estimated seconds until empty
+        self.shutdown_at = None
+        self.last_timestamp = None
+
+    def configure(self, **settings):
+        for key, value in settings.items():
+            if not hasattr(self, key):
+                raise TypeError("unknown policy setting: %s" % key)
+            setattr(self, key, value)
+
+    def update(self, buffer):
+        """ Evaluate the newest sample in `buffer`. Returns a list of Actions.
+        """
+        sample = buffer.latest()
+        if sample is None:
+            return []
+        now = sample.timestamp
+
+        if not sample.flags & FLAG_DSG:
+            self.current = self.time_left = self.last_timestamp = None
+            actions = [Action("cancel", None)] if self.shutdown_at is not None else []
+            self.state = NORMAL
+            self.shutdown_at = None
+            return actions
+
+        self.time_left = self._time_left(buffer, sample)
+        minutes = None if self.time_left is None else self.time_left / 60.0
+        soc = sample.state_of_charge
+        below = lambda limit_minutes, limit_percent: soc <= limit_percent or \
+            (minutes is not None and minutes <= limit_minutes)
+
+        actions = []
+        if self.state != CRITICAL and below(self.critical_minutes, self.critical_percent):
+            self.state = CRITICAL
+            actions.append(Action("critical", self.time_left))
+        elif self.state == NORMAL and below(self.low_minutes, self.low_percent):
+            self.state = LOW
+            actions.append(Action("low", self.time_left))
+        elif self.state == LOW and not below(self.low_minutes + self.hysteresis_minutes,
+                self.low_percent + self.hysteresis_percent):
+            self.state = NORMAL
+
+        if self.state == CRITICAL:
+            # shut down so that we are done safety_margin seconds before the
+            # battery is empty; only ever move the shutdown earlier
+            deferral = 0 if self.time_left is None else max(0, self.time_left - self.safety_margin)
+            if soc <= self.critical_percent:
+                # the percent backstop does not wait for the time estimate
+                deferral = min(deferral, self.safety_margin)
+            shutdown_at = now + deferral
+            if self.shutdown_at is None or shutdown_at < self.shutdown_at - 1:
+                self.shutdown_at = shutdown_at
+                actions.append(Action("shutdown", shutdown_at))
+
+        return actions
+
+    def _time_left(self, buffer, sample):
+        """ Seconds until empty from the remaining capacity and the smoothed
+            current, or from the discharge slope if the gauge does not
+            measure current
+        """
+        if sample.average_current >= 0 or sample.full_charge_capacity == 0:
+            return telemetry.estimate(buffer, self.window)[0]
+
+        # exponential moving average weighted by the time between samples
+        current = -sample.average_current
+        if self.current is None or self.smoothing <= 0:
+            self.current = float(current)
+        else:
+            alpha = 1 - math.exp(-max(0, sample.timestamp - self.last_timestamp) / float(self.smoothing))
+            self.current += alpha * (current - self.current)
+        self.last_timestamp = sample.timestamp
+        return sample.remaining_capacity * 3600.0 / self.current
+
+
+def replay(samples, policy, capacity=2880):
+    """ Feed recorded samples through a policy. Yields (sample, actions) for
+        every sample that produced actions.
+    """
+    buffer = telemetry.TelemetryBuffer(capacity)
+    for sample in samples:
+        buffer.append_sample(sample)
+        actions = policy.update(buffer)
+        if actions:
+            yield sample, actions
+
+
+if __name__ == '__main__':
+    import battery_log
+
+    parser = argparse.ArgumentParser(description="Replay a battery log against the low battery policy.")
+    parser.add_argument("log", nargs="?", default="~/.status_overlay_battery", help="battery log directory")
+    parser.add_argument("--low-minutes", type=float, default=20)
+    parser.add_argument("--critical-minutes", type=float, default=5)
+    parser.add_argument("--low-percent", type=int, default=10)
+    parser.add_argument("--critical-percent", type=int, default=5)
+    parser.add_argument("--margin", type=float, default=120, help="shutdown safety margin in seconds")
+    parser.add_argument("--window", type=float, default=600, help="slope estimate window in seconds")
+    args = parser.parse_args()
+
+    policy = BatteryPolicy(low_minutes=args.low_minutes, critical_minutes=args.critical_minutes,
+        low_percent=args.low_percent, critical_percent=args.critical_percent, safety_margin=args.margin,
+        window=args.window)
+
+    for session in battery_log.discharge_sessions(battery_log.read_logs(args.log)):
+        end = session[-1]
+        print("Discharge session %s, %d%% -> %d%% over %.1f min" % (
+            time.strftime("%Y-%m-%d %H:%M", time.localtime(session[0].timestamp)),
+            session[0].state_of_charge, end.state_of_charge, (end.timestamp - session[0].timestamp) / 60.0))
+
+        policy.reset()
+        for sample, actions in replay(session, policy):
+            for action in actions:
+                left = (end.timestamp - sample.timestamp) / 60.0
+                if action.kind == "shutdown":
+                    detail = "at +%.1f min%s" % ((action.value - sample.timestamp) / 60.0,
+                        " (<= %d%%)" % policy.critical_percent
+                        if sample.state_of_charge <= policy.critical_percent else "")
+                elif action.value is not None:
+                    detail = "estimated %.1f min left" % (action.value / 60.0)
+                else:
+                    detail = ""
+                print("  %s  %3d%%  %-8s %-26s (log ends %.1f min later)" % (
+                    time.strftime("%H:%M:%S", time.localtime(sample.timestamp)), sample.state_of_charge,
+                    action.kind, detail, left))
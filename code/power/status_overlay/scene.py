@@ -0,0 +1,98 @@
+#!/usr/bin/env python3
+""" Retained scene graph for the overlay renderers.
+
+    The scene keeps the sprites that are on screen and the sprites that
+    should be on screen after the next commit. Callers declare the whole
+    desired state (a single sprite, or a group of sprites such as the hud)
+    and flush() works out the smallest set of changes to get there:
+
+        add      - a sprite that was not on screen
+        move     - same image, only the display, layer or position changed
+        replace  - a different image (possibly at a different position)
+        remove   - a sprite that is no longer wanted
+
+    Nothing is returned for sprites that did not change, so redrawing an
+    unchanged frame costs nothing.
+"""
+
+import collections
+
+
+ADD = "add"
+MOVE = "move"
+REPLACE = "replace"
+REMOVE = "remove"
+
+# image is a png path or any object with a `key` that identifies its content
+Node = collections.namedtuple("Node", ["image", "display", "layer", "x", "y"])
+
+
+def image_key(image):
+    return getattr(image, "key", image)
+
+
+def diff(old, new):
+    """ Changes that turn the sprites in `old` into the sprites in `new`
+        (both {node_id: Node}). Returns a list of (op, node_id, node) with
+        the removals first.
+    """
+    changes = [(REMOVE, node_id, node) for node_id, node in old.items() if node_id not in new]
+
+    for node_id, node in new.items():
+        previous = old.get(node_id)
+        if previous is None:
+            changes.append((ADD, node_id, node))
+        elif image_key(previous.image) != image_key(node.image):
+            changes.append((REPLACE, node_id, node))
+        elif previous[1:] != node[1:]:
+            changes.append((MOVE, node_id, node))
+
+    return changes
+
+
+class Scene(object):
+    """ Sprites on screen (`nodes`) and the staged state for the next flush.
+        Sprites are staged one at a time with set() and remove(), or as a
+        group with set_group(), which also drops the group's sprites that
+        are not in the new set.
+    """
+
+    def __init__(self):
+        self.nodes = {}
+        self.staged = {}
+        self.groups = {}  # group -> set of node ids
+
+    def set(self, node_id, node):
+        self.staged[node_id] = node
+
+    def remove(self, node_id):
+        self.staged.pop(node_id, None)
+
+    def set_group(self, group, nodes):
+        """ Make `nodes` ({node_id: Node}) the only sprites of `group`
+        """
+        for node_id in self.groups.get(group, set()).difference(nodes):
+            self.staged.pop(node_id, None)
+        self.staged.update(nodes)
+        self.groups[group] = set(nodes)
+
+    def changes(self):
+        return diff(self.nodes, self.staged)
+
+    def flush(self):
+        """ Return the pending changes and consider them applied
+        """
+        changes = self.changes()
+        if changes:
+            self.nodes = dict(self.staged)
+        return changes
+
+    def undo(self, node_id, nodes):
+        """ A change returned by flush() could not be applied: node_id is
+            still what it was in `nodes` (the nodes before the flush), so the
+            next flush tries again
+        """
+        if node_id in nodes:
+            self.nodes[node_id] = nodes[node_id]
+        else:
+            self.nodes.pop(node_id, None)
@@ -0,0 +1,123 @@
+#!/usr/bin/env python3
+""" Screenshots for the status overlay.
+
+    capture() grabs the screen in process through DispmanX, which only
+    takes a few milliseconds. Encoding and writing the file is the slow part
+    and happens on one low priority worker thread (ScreenshotWriter) with a
+    bounded backlog, so screenshots never pile up competing for the CPU.
+
+    Usage (take a screenshot from the command line):
+
+        python3 screenshot.py [PATH] [--format PNG|PPM] [--level N] [--display N]
+"""
+
+import argparse
+import os
+import queue
+import threading
+
+import pngcodec
+
+
+FORMATS = {"PNG": ".png", "PPM": ".ppm"}
+
+
+def capture(display_id=0):
+    """ Returns (width, height, rgb) of what is on the screen. Raises OSError
+        if DispmanX is not available.
+    """
+    import dispmanx
+    display = dispmanx.display_open(display_id)
+    try:
+        width, height = dispmanx.display_size(display)
+        return width, height, dispmanx.snapshot(display, width, height)
+    finally:
+        dispmanx.display_close(display)
+
+
+def encode(width, height, rgb, fmt="PNG", level=1):
+    """ Encode tightly packed RGB pixels as fmt (see FORMATS)
+    """
+    if fmt == "PNG":
+        return pngcodec.encode(width, height, rgb, level, channels=3)
+    if fmt == "PPM":
+        return b"P6\n%d %d\n255\n" % (width, height) + bytes(rgb)
+    raise ValueError("unknown screenshot format: %s" % fmt)
+
+
+def write(path, width, height, rgb, fmt="PNG", level=1):
+    """ Encode and write a screenshot. The file only appears once it is
+        complete.
+    """
+    data = encode(width, height, rgb, fmt, level)
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "wb") as fhandle:
+        fhandle.write(data)
+    os.replace(tmp_path, path)
+
+
+class ScreenshotWriter(object):
+    """ Encodes and writes queued screenshots one at a time on a background
+        thread running at the lowest CPU priority.
+    """
+
+    def __init__(self, backlog=4, nice=19):
+        self.queue = queue.Queue(backlog)
+        self.nice = nice
+        self.written = 0
+        self.dropped = 0
+        self.thread = threading.Thread(target=self._run, name="screenshot-writer", daemon=True)
+        self.thread.start()
+
+    def submit(self, path, width, height, rgb, fmt="PNG", level=1):
+        """ Queue a screenshot. Returns False (and drops it) if the backlog is
+            full.
+        """
+        try:
+            self.queue.put_nowait((path, width, height, rgb, fmt, level))
+        except queue.Full:
+            self.dropped += 1
+            return False
+        return True
+
+    def pending(self):
+        return self.queue.qsize()
+
+    def close(self, timeout=None):
+        """ Finish the queued screenshots and stop the worker
+        """
+        self.queue.put(None)
+        self.thread.join(timeout)
+
+    def _run(self):
+        try:
+            # on Linux the nice value of a thread only applies to that thread
+            os.setpriority(os.PRIO_PROCESS, threading.get_native_id(), self.nice)
+        except (AttributeError, OSError):
+            pass
+
+        while True:
+            item = self.queue.get()
+            if item is None:
+                return
+            path = item[0]
+            try:
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                write(*item)
+                self.written += 1
+            except (OSError, ValueError) as e:
+                print("WARNING: could not write screenshot %s: %s" % (path, e))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Take a screenshot through DispmanX.")
+    parser.add_argument("path", nargs="?", help="output file (screenshot.png by default)")
+    parser.add_argument("--format", default="PNG", choices=sorted(FORMATS.keys()))
+    parser.add_argument("--level", type=int, default=6, help="PNG compression level (0-9)")
+    parser.add_argument("--display", type=int, default=0)
+    args = parser.parse_args()
+
+    path = args.path or "screenshot" + FORMATS[args.format]
+    width, height, rgb = capture(args.display)
+    write(path, width, height, rgb, args.format, args.level)
+    print("%dx%d written to %s" % (width, height, path))
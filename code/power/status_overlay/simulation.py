@@ -0,0 +1,174 @@
+#!/usr/bin/env python3
+""" Simulated hardware backends for running the status overlay off device.
+
+    SimulatedGPIO implements the subset of the RPi.GPIO API the daemon uses,
+    SimulatedAudio stands in for sound playback, SimulatedGamepad for the
+    controller and simulated_fuel_gauge() returns a bq27441 driver on top of
+    an in-memory FakeBus. The simulated renderer lives in status_overlay.py
+    next to the real ones.
+"""
+
+import os
+import threading
+import time
+
+import bq27441
+import gamepad
+
+
+class SimulatedGPIO(object):
+    """ Drop in replacement for the RPi.GPIO module. Pin levels are changed
+        with set_level(), which fires the registered edge callbacks on the
+        calling thread (like RPi.GPIO does on its own thread).
+    """
+    BOARD = 10
+    BCM = 11
+    IN = 1
+    OUT = 0
+    RISING = 31
+    FALLING = 32
+    BOTH = 33
+
+    def __init__(self, levels=None):
+        self.levels = dict(levels or {})
+        self.callbacks = {}
+        self.lock = threading.Lock()
+
+    def setmode(self, mode):
+        pass
+
+    def setup(self, channel, direction, **kwargs):
+        with self.lock:
+            self.levels.setdefault(channel, 1)
+
+    def add_event_detect(self, channel, edge, callback=None, bouncetime=None):
+        with self.lock:
+            self.callbacks[channel] = (edge, callback)
+
+    def input(self, channel):
+        with self.lock:
+            return self.levels.get(channel, 1)
+
+    def cleanup(self):
+        with self.lock:
+            self.callbacks = {}
+
+    def set_level(self, channel, level):
+        """ Drive a pin to `level`, firing its callback if the edge matches
+        """
+        with self.lock:
+            previous = self.levels.get(channel, 1)
+            self.levels[channel] = level
+            edge, callback = self.callbacks.get(channel, (None, None))
+
+        if callback is None or previous == level:
+            return
+        if edge == self.BOTH or (edge == self.FALLING and not level) or (edge == self.RISING and level):
+            callback(channel)
+
+    def pulse(self, channel, duration=0.001):
+        """ Pull a pin low for `duration` seconds and release it again
+        """
+        self.set_level(channel, 0)
+        time.sleep(duration)
+        self.set_level(channel, 1)
+
+
+class SimulatedAudio(object):
+    """ Stands in for audio.AudioPlayer and records the sounds that would
+        have been played, as (name, priority).
+    """
+
+    def __init__(self):
+        self.sounds = {}
+        self.played = []
+
+    def preload(self, sounds, volume_db=0.0):
+        self.sounds.update(sounds)
+
+    def play(self, name, priority=0):
+        self.played.append((name, priority))
+
+    def wait(self, timeout=None):
+        return True
+
+    def close(self):
+        pass
+
+
+class SimulatedGamepad(gamepad.Device):
+    """ gamepad.Device reading from a pipe instead of /dev/input. press()
+        and push() write evdev events into it from any thread, timestamped
+        like the kernel would.
+    """
+
+    def __init__(self, path="sim"):
+        self.path = path
+        self.fd, self.writer = os.pipe()
+        os.set_blocking(self.fd, False)
+        self.grabbed = False
+
+    def grab(self, grab=True):
+        self.grabbed = grab
+
+    def absinfo(self, axis):
+        return (0, -32767, 32767, 0, 0, 0)
+
+    def send(self, events):
+        """ Write (type, code, value) events followed by a SYN_REPORT
+        """
+        now = time.monotonic()
+        sec, usec = int(now), int((now - int(now)) * 1000000)
+        events = list(events) + [(gamepad.EV_SYN, gamepad.SYN_REPORT, 0)]
+        os.write(self.writer, b"".join(gamepad.EVENT.pack(sec, usec, *event) for event in events))
+
+    def press(self, number):
+        """ Press and release controller button `number`
+        """
+        self.send([(gamepad.EV_KEY, gamepad.button_code(number), 1)])
+        self.send([(gamepad.EV_KEY, gamepad.button_code(number), 0)])
+
+    def push(self, axis, value):
+        self.send([(gamepad.EV_ABS, axis, value)])
+
+    def perform(self, action, buttons):
+        """ Flick the left stick or press the button (from buttons, see
+            gamepad.Controls) for a menu action
+        """
+        for axis, directions in gamepad.DIRECTIONS.items():
+            if action in directions:
+                self.push(axis, 32767 if action == directions[1] else -32767)
+                self.push(axis, 0)
+                return
+        self.press(buttons[action])
+
+    def close(self):
+        super().close()
+        if self.writer >= 0:
+            os.close(self.writer)
+            self.writer = -1
+
+
+def simulated_fuel_gauge(state_of_charge=100, discharging=True, address=0x55):
+    """ Returns a bq27441.BQ27441 backed by a FakeBus with plausible register
+        contents. Use set_battery() to change them.
+    """
+    gauge = bq27441.BQ27441(bq27441.FakeBus(address=address), address)
+    set_battery(gauge, state_of_charge, discharging)
+    return gauge
+
+
+def set_battery(gauge, state_of_charge, discharging=True, full_charge_capacity=2000):
+    """ Update the registers of a simulated fuel gauge
+    """
+    bus = gauge.bus
+    remaining = full_charge_capacity * state_of_charge // 100
+    current = -450 if discharging else 900
+
+    bus.set_word(bq27441.STATE_OF_CHARGE, state_of_charge, gauge.address)
+    bus.set_word(bq27441.FLAGS, bq27441.FLAG_DSG if discharging else bq27441.FLAG_CHG, gauge.address)
+    bus.set_word(bq27441.VOLTAGE, 3300 + 9 * state_of_charge, gauge.address)
+    bus.set_word(bq27441.AVERAGE_CURRENT, current, gauge.address)
+    bus.set_word(bq27441.TEMPERATURE, 2982, gauge.address)
+    bus.set_word(bq27441.REMAINING_CAPACITY, remaining, gauge.address)
+    bus.set_word(bq27441.FULL_CHARGE_CAPACITY, full_charge_capacity, gauge.address)
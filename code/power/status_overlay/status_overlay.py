@@ -1,139 +1,582 @@
 #!/usr/bin/env python3
 
+import asyncio
+import collections
 import datetime
-import imghdr
 import json
+import math
 import os
 import re
+import select
 import signal
-import struct
 import subprocess
 import sys
-import threading
 import time
+import traceback
 
-import RPi.GPIO as GPIO
-
-
-CONFIG = {}
-
-CONFIG["CONFIG_FILE_PATH"] = "~/.status_overlay_config"
-
-CONFIG["IMAGE_PATH"] = "images/"
-CONFIG["SOUND_PATH"] = "sounds/"
-CONFIG["LIB_PATH"] = "lib/"
-CONFIG["PNGVIEW_PATH"] = "pngview"
-CONFIG["SCREENSHOT_PATH"] = "~/screenshots"
-
-CONFIG["LAYER_DEFAULT"] = 15000
-CONFIG["LAYER_BATTERY"] = CONFIG["LAYER_DEFAULT"] + 5
-CONFIG["LAYER_NUMBER"] = CONFIG["LAYER_DEFAULT"] + 10
-CONFIG["LAYER_BACKDROP"] = CONFIG["LAYER_DEFAULT"] - 10
-CONFIG["LAYER_NOTIFICATION"] = CONFIG["LAYER_DEFAULT"] + 15
-
-CONFIG["DISPLAY_ID"] = 0
-CONFIG["IS_VISIBLE"] = True
+__SCRIPT_PATH__ = os.path.dirname(os.path.realpath(__file__))
+sys.path.append(os.path.join(__SCRIPT_PATH__, "lib", "bq27441_lib"))
+
+import audio
+import backlight
+import bq27441
+import font
+import gamepad
+import layout
+import menu
+import metrics
+import pngcodec
+import policy
+import scene
+import supervisor
+import telemetry
+
+# atlas, battery_log, inotify and status_shm are imported where they are set
+# up, after the first hud has been drawn (see main)
+
+
+DEFAULTS = {}
+
+DEFAULTS["CONFIG_FILE_PATH"] = "~/.status_overlay_config"
+
+DEFAULTS["IMAGE_PATH"] = "images/"
+DEFAULTS["SOUND_PATH"] = "sounds/"
+DEFAULTS["LIB_PATH"] = "lib/"
+DEFAULTS["PNGVIEW_PATH"] = "pngview"
+
+# COMPOSITOR -> one long lived overlay_compositor.py process owns all sprites
+# PNGVIEW -> one pngview process per sprite (fallback)
+# SIM -> nothing is drawn, sprite updates are only recorded
+DEFAULTS["RENDERER"] = "COMPOSITOR"
+DEFAULTS["SCREENSHOT_PATH"] = "~/screenshots"
+DEFAULTS["SCREENSHOT_FORMAT"] = "PNG" # "PNG" or "PPM" (uncompressed, cheapest to write)
+DEFAULTS["SCREENSHOT_COMPRESSION"] = 1 # PNG compression level, 0 (none) to 9 (smallest, slowest)
+DEFAULTS["SCREENSHOT_BURST"] = 1 # number of frames captured per long press
+DEFAULTS["SCREENSHOT_BURST_INTERVAL"] = 0.25 # in seconds, time between the frames of a burst
+DEFAULTS["SCREENSHOT_BACKLOG"] = 4 # screenshots waiting to be encoded, further ones are dropped
+DEFAULTS["SCREENSHOT_TIMEOUT"] = 30 # in seconds, raspi2png is killed after this long
+DEFAULTS["CHILD_PROCESS_LIMIT"] = 32 # max helper processes (pngview, raspi2png) alive at once, the pngview renderer needs one per sprite (menu 10, hud 6 per display)
+
+DEFAULTS["LAYER_DEFAULT"] = 15000
+DEFAULTS["LAYER_BATTERY"] = DEFAULTS["LAYER_DEFAULT"] + 5
+DEFAULTS["LAYER_NUMBER"] = DEFAULTS["LAYER_DEFAULT"] + 10
+DEFAULTS["LAYER_BACKDROP"] = DEFAULTS["LAYER_DEFAULT"] - 10
+DEFAULTS["LAYER_MENU"] = DEFAULTS["LAYER_DEFAULT"] + 12
+DEFAULTS["LAYER_NOTIFICATION"] = DEFAULTS["LAYER_DEFAULT"] + 15
+
+# SPRITES -> one sprite per hud element (backdrop, battery, digits); a redraw
+#            only touches the sprites that changed
+# FRAME -> the hud is composited into a single image per state
+DEFAULTS["HUD_RENDERING"] = "SPRITES"
+DEFAULTS["HUD_CACHE_PATH"] = "/dev/shm/status_overlay"
+DEFAULTS["HUD_CACHE_SIZE"] = 32 # max number of composited hud frames (and layouts per display) kept around
+
+DEFAULTS["DISPLAY_ID"] = 0 # display for notifications, screenshots and the hud if HUD_DISPLAYS is empty
+# Displays the hud is drawn on, each like
+#   {"display": 2, "anchor": "top-right", "padding": [0, 0], "scale": 1}
+# see layout.py. Empty for the top right corner of DISPLAY_ID.
+DEFAULTS["HUD_DISPLAYS"] = []
+DEFAULTS["REDRAW_COALESCE_WINDOW"] = 0.05 # in seconds, redraw requests this close together are merged
+DEFAULTS["RESOLUTION_POLL_INTERVAL"] = 60 # in seconds, only used if tvservice -M is unavailable. 0 to disable
+DEFAULTS["IS_VISIBLE"] = True
 
 # INITIAL_ON -> toggle mode, start with hud visible
 # INITIAL_OFF -> toggle mode, start with hud hidden
 # SAVED -> toggle mode, start with state read from config file
 # FLASH (show hud on button press for a short time then hide)
 # FLASH_INITIAL_ON -> Flash mode with hud shown for 3 seconds on start
-CONFIG["POWER_SWITCH_BEHAVIOR"] = "SAVED"
-
-CONFIG["POWER_SWITCH_FLASH_DURATION"] = 3 # in seconds
+DEFAULTS["POWER_SWITCH_BEHAVIOR"] = "SAVED"
+
+DEFAULTS["POWER_SWITCH_FLASH_DURATION"] = 3 # in seconds
+
+# Holding the power button for MENU_HOLD_DURATION seconds opens the status
+# menu. The controller is only read while the menu is open, and grabbed so
+# the game underneath does not see the menu navigation.
+DEFAULTS["MENU_HOLD_DURATION"] = 2 # in seconds
+DEFAULTS["MENU_TIMEOUT"] = 30 # in seconds, the menu closes after this long without input
+DEFAULTS["MENU_SCALE"] = 2 # size of the menu text, screen pixels per font pixel
+# controller buttons (numbered as in controller.ino, 0 for none) of the menu
+# actions; the left stick also moves up, down, left and right
+DEFAULTS["MENU_BUTTONS"] = {"select": 1, "back": 2}
+DEFAULTS["MENU_GRAB_INPUT"] = True
+DEFAULTS["INPUT_BACKEND"] = "EVDEV" # "EVDEV" or "SIM"
+DEFAULTS["INPUT_DEVICE"] = "" # evdev device of the controller, empty for the first gamepad found
+DEFAULTS["BACKLIGHT_PATH"] = "" # sysfs backlight for the brightness setting, empty for the first one
+
+# save the hud visibility this many seconds after it last changed (SAVED mode only)
+DEFAULTS["VISIBILITY_SAVE_DELAY"] = 5
+DEFAULTS["CONFIG_WATCH"] = True # apply changes to the config file without a restart
+
+# the last hud shown is saved here on exit and shown again right away on the
+# next start, before the fuel gauge has been read ("" to disable)
+DEFAULTS["STARTUP_CACHE_PATH"] = "~/.status_overlay_hud"
+DEFAULTS["STARTUP_TIMING"] = False # print how long each startup phase took
+
+# unix socket for controlling the daemon, see overlayctl.py ("" to disable)
+DEFAULTS["CONTROL_SOCKET_PATH"] = "/tmp/status_overlay.sock"
+
+# counters and latency histograms in the Prometheus text format, rewritten
+# every METRICS_INTERVAL seconds unless the daemon was idle ("" to disable,
+# e.g. "/dev/shm/status_overlay.prom", see metrics.py)
+DEFAULTS["METRICS_PATH"] = ""
+DEFAULTS["METRICS_INTERVAL"] = 15
+# SIGUSR1 profiles the event loop for PROFILE_DURATION seconds and writes a
+# cProfile snapshot to PROFILE_PATH
+DEFAULTS["PROFILE_PATH"] = "~/status_overlay_profiles"
+DEFAULTS["PROFILE_DURATION"] = 30
+
+DEFAULTS["FUEL_GAUGE_SCRIPT_PATH"] = DEFAULTS["LIB_PATH"] + "bq27441_lib/"
+DEFAULTS["FUEL_GAUGE_I2C_BUS_ID"] = 1
+DEFAULTS["FUEL_GAUGE_I2C_DEVICE_ID"] = 0x55
+
+# SMBUS -> read the fuel gauge in process through /dev/i2c-N
+# SCRIPT -> call into bq27441_lib.sh (slow, forks bash and i2c-tools once per read)
+# SIM -> simulated fuel gauge
+DEFAULTS["FUEL_GAUGE_BACKEND"] = "SMBUS"
+
+# Hardware backends. Set any of these to "SIM" to run without the hardware
+# (see simulation.py and benchmark.py).
+DEFAULTS["GPIO_BACKEND"] = "RPI"
+DEFAULTS["AUDIO_BACKEND"] = "ALSA" # "ALSA", "NULL" (no sound) or "SIM"
+DEFAULTS["AUDIO_DEVICE"] = "default" # ALSA PCM name
+DEFAULTS["AUDIO_VOLUME_DB"] = -10.0
+DEFAULTS["SHUTDOWN_SOUND_TIMEOUT"] = 15 # max seconds to wait for the shutdown sound
+DEFAULTS["SIM_RESOLUTION"] = (800, 480) # screen resolution reported by the SIM renderer
+
+DEFAULTS["BATTERY_GPOUT_PIN"] = 29 # board pin 29 is GPIO5
+DEFAULTS["BATTERY_POWER_PIN"] = 36 # board pin 36 is GPIO16 (tied to GPIO6 in hardware)
+
+# Background sampling adapts to the battery: every TELEMETRY_SAMPLE_INTERVAL
+# seconds while discharging, TELEMETRY_FAST_INTERVAL when the battery is within
+# TELEMETRY_FAST_MARGIN minutes (or percent) of the low battery warning and
+# TELEMETRY_IDLE_INTERVAL on wall power or when the charge has not changed for
+# TELEMETRY_STABLE_WINDOW seconds.
+DEFAULTS["TELEMETRY_SAMPLE_INTERVAL"] = 30 # in seconds, 0 to disable background sampling
+DEFAULTS["TELEMETRY_FAST_INTERVAL"] = 10 # in seconds
+DEFAULTS["TELEMETRY_IDLE_INTERVAL"] = 300 # in seconds
+DEFAULTS["TELEMETRY_FAST_MARGIN"] = 10
+DEFAULTS["TELEMETRY_STABLE_WINDOW"] = 600 # in seconds
+DEFAULTS["TELEMETRY_HISTORY_SIZE"] = 2880 # number of samples kept in memory (24 hours at 30 seconds)
+DEFAULTS["TELEMETRY_TREND_WINDOW"] = 600 # in seconds, history used for time remaining estimates
+
+DEFAULTS["BATTERY_LOG_PATH"] = "~/.status_overlay_battery" # empty to disable the on-disk battery history
+DEFAULTS["BATTERY_LOG_MAX_BYTES"] = 1024 * 1024 # rotate the log once it reaches this size
+DEFAULTS["BATTERY_LOG_FILES"] = 8 # number of log files kept, including the current one
+DEFAULTS["BATTERY_LOG_FLUSH_INTERVAL"] = 600 # in seconds, samples are written to disk in batches
+
+# latest battery status for other programs, see status_shm.py ("" to disable)
+DEFAULTS["STATUS_SHM_PATH"] = "/dev/shm/status_overlay_status"
+
+DEFAULTS["SHUTDOWN_COMMAND"] = "sudo shutdown -h now" # empty to only exit the daemon
+
+DEFAULTS["LOW_BATTERY_NOTIFICATION_DURATION"] = 5 # in seconds
+DEFAULTS["CRITICAL_BATTERY_NOTIFICATION_DURATION"] = 10 # in seconds
+
+# The low battery warning and the shutdown are based on the estimated time
+# left (from the measured current, see policy.py), with the thresholds in
+# percent as a backstop.
+DEFAULTS["LOW_BATTERY_MINUTES"] = 20
+DEFAULTS["CRITICAL_BATTERY_MINUTES"] = 5
+DEFAULTS["LOW_BATTERY_THRESHOLD"] = 10
+DEFAULTS["CRITICAL_BATTERY_THRESHOLD"] = 5
+DEFAULTS["BATTERY_WARNING_HYSTERESIS"] = 3 # minutes the estimate must recover by to warn again
+DEFAULTS["CURRENT_SMOOTHING_WINDOW"] = 300 # in seconds, time constant of the current average
+DEFAULTS["SHUTDOWN_SAFETY_MARGIN"] = 120 # in seconds, shut down this long before the battery runs out
+
+
+# allowed values of the settings that are not free form
+CONFIG_CHOICES = {
+    "RENDERER": ["COMPOSITOR", "PNGVIEW", "SIM"],
+    "POWER_SWITCH_BEHAVIOR": ["INITIAL_ON", "INITIAL_OFF", "SAVED", "FLASH", "FLASH_INITIAL_ON"],
+    "FUEL_GAUGE_BACKEND": ["SMBUS", "SCRIPT", "SIM"],
+    "GPIO_BACKEND": ["RPI", "SIM"],
+    "AUDIO_BACKEND": ["ALSA", "NULL", "SIM", "OMXPLAYER"],
+    "SCREENSHOT_FORMAT": ["PNG", "PPM"],
+    "HUD_RENDERING": ["SPRITES", "FRAME"],
+    "INPUT_BACKEND": ["EVDEV", "SIM"],
+}
+
+# (minimum, maximum) of numeric settings, None for no limit
+CONFIG_RANGES = {
+    "HUD_CACHE_SIZE": (1, None),
+    "CHILD_PROCESS_LIMIT": (1, None),
+    "SCREENSHOT_COMPRESSION": (0, 9),
+    "SCREENSHOT_BURST": (1, None),
+    "SCREENSHOT_BURST_INTERVAL": (0, None),
+    "SCREENSHOT_BACKLOG": (1, None),
+    "REDRAW_COALESCE_WINDOW": (0, 1),
+    "RESOLUTION_POLL_INTERVAL": (0, None),
+    "POWER_SWITCH_FLASH_DURATION": (0, None),
+    "MENU_HOLD_DURATION": (0.5, None),
+    "MENU_TIMEOUT": (1, None),
+    "MENU_SCALE": (1, 8),
+    "VISIBILITY_SAVE_DELAY": (0, None),
+    "METRICS_INTERVAL": (1, None),
+    "PROFILE_DURATION": (1, None),
+    "TELEMETRY_SAMPLE_INTERVAL": (0, None),
+    "TELEMETRY_FAST_INTERVAL": (1, None),
+    "TELEMETRY_IDLE_INTERVAL": (1, None),
+    "TELEMETRY_FAST_MARGIN": (0, None),
+    "TELEMETRY_STABLE_WINDOW": (1, None),
+    "TELEMETRY_HISTORY_SIZE": (2, None),
+    "TELEMETRY_TREND_WINDOW": (1, None),
+    "BATTERY_LOG_FILES": (1, None),
+    "LOW_BATTERY_THRESHOLD": (0, 100),
+    "CRITICAL_BATTERY_THRESHOLD": (0, 100),
+    "LOW_BATTERY_MINUTES": (0, None),
+    "CRITICAL_BATTERY_MINUTES": (0, None),
+    "BATTERY_WARNING_HYSTERESIS": (0, None),
+    "CURRENT_SMOOTHING_WINDOW": (0, None),
+    "SHUTDOWN_SAFETY_MARGIN": (0, None),
+}
+
+# settings with their own validation, called with the value and raising
+# ValueError if it is invalid
+CONFIG_VALIDATORS = {
+    "HUD_DISPLAYS": layout.parse_placements,
+    "MENU_BUTTONS": gamepad.parse_buttons,
+}
+
+# settings named like this are times in seconds
+TIME_SUFFIXES = ("_DURATION", "_INTERVAL", "_DELAY", "_WINDOW", "_TIMEOUT", "_MARGIN")
+
+# settings that are only read at startup
+RESTART_REQUIRED = [
+    "RENDERER", "GPIO_BACKEND", "AUDIO_BACKEND", "AUDIO_DEVICE", "AUDIO_VOLUME_DB", "FUEL_GAUGE_BACKEND",
+    "BATTERY_GPOUT_PIN", "BATTERY_POWER_PIN", "BATTERY_LOG_PATH", "STATUS_SHM_PATH", "CONTROL_SOCKET_PATH",
+    "TELEMETRY_HISTORY_SIZE", "HUD_CACHE_PATH", "CONFIG_FILE_PATH", "CONFIG_WATCH", "CHILD_PROCESS_LIMIT",
+    "SCREENSHOT_BACKLOG",
+]
+
+# The active configuration. It is immutable and validated; a config file
+# change replaces it as a whole (see reload_config).
+Config = collections.namedtuple("Config", DEFAULTS.keys())
+CONFIG = Config(**DEFAULTS)
 
-CONFIG["FUEL_GAUGE_SCRIPT_PATH"] = CONFIG["LIB_PATH"] + "bq27441_lib/"
-CONFIG["FUEL_GAUGE_I2C_BUS_ID"] = 1
-CONFIG["FUEL_GAUGE_I2C_DEVICE_ID"] = 0x55
-
-CONFIG["BATTERY_GPOUT_PIN"] = 29 # board pin 29 is GPIO5
-CONFIG["BATTERY_POWER_PIN"] = 36 # board pin 36 is GPIO16 (tied to GPIO6 in hardware)
-
-CONFIG["LOW_BATTERY_NOTIFICATION_DURATION"] = 5 # in seconds
-CONFIG["CRITICAL_BATTERY_NOTIFICATION_DURATION"] = 10 # in seconds
-CONFIG["LOW_BATTERY_THRESHOLD"] = 10
-CONFIG["CRITICAL_BATTERY_THRESHOLD"] = 5
-
-
-__ORIGINAL_SIGINT__ = None
 __LAST_POWER_BUTTON_PRESSED_TIME__ = None
 __PNGVIEW_PROCESSES__ = {}
-__NOTIFICATION_PROCESSES__ = {}
-__DIMENSION_CACHE__ = {}
-__PREVIOUS_STATE_OF_CHARGE__ = 100
-__SHUTDOWN_LOCK__ = threading.Lock()
-__SCRIPT_PATH__ = os.path.dirname(os.path.realpath(__file__))
+__SUPERVISOR__ = None
+__SCREENSHOT_WRITER__ = None
+__SCREENSHOT_BURST__ = None # timer for the next frame of a burst
+__RENDERER__ = None
+__ATLAS__ = None
+__HUD_FRAME_CACHE__ = collections.OrderedDict()
+__HUD_PLACEMENTS__ = None
+__HUD_LAYOUTS__ = layout.LayoutCache(DEFAULTS["HUD_CACHE_SIZE"])
+__SCALED_IMAGES__ = {}
+__POLICY__ = None
+__SHUTDOWN_TIMER__ = None
+GPIO = None # RPi.GPIO or simulation.SimulatedGPIO, see backend_setup()
+__AUDIO__ = None
+__LOOP__ = None
+__EVENTS__ = None
+__STOP__ = None
+__POWER_BUTTON_DEBOUNCE__ = None
+__NOTIFICATION_TIMERS__ = {}
+__REDRAW_PENDING__ = None
+__REDRAW_SAMPLE__ = False # whether the pending redraw has to read the fuel gauge
+__LAST_HUD_STATE__ = None
+__REDRAW_STATS__ = {"requested": 0, "merged": 0, "rendered": 0, "skipped": 0}
+__FUEL_GAUGE__ = None
+__TELEMETRY__ = None
+__TELEMETRY_TIMER__ = None
+__BATTERY_LOG__ = None
+__STATUS_SHM__ = None
+__CONTROL_SERVER__ = None
+__CONTROL_IMAGES__ = 0  # counter for unique keys of notification images loaded from files
+__RESOLUTION_CACHE__ = {}
+__IS_VISIBLE__ = True
+__SAVED_VISIBILITY__ = None # visibility last written to the config file
+__VISIBILITY_SAVE__ = None
+__FLASH_TIMER__ = None # hides the hud again after a flash
+__CONFIG_SIGNATURE__ = None # config file as last written or read by the daemon
+__CONFIG_WATCH__ = None
+__CONFIG_RELOAD__ = None
+__STARTUP_TIMES__ = [] # (phase, time.monotonic() at its end)
+__PROFILER__ = None
+__PROFILE_TIMER__ = None
+__METRICS_WRITER__ = None
+__MENU__ = None # the open menu.Menu
+__MENU_TIMER__ = None
+__MENU_CHANGES__ = {} # settings changed in the open menu, saved when it closes
+__MENU_IMAGES__ = {} # rendered rows of the open menu
+__INPUT_DEVICE__ = None # the controller, only open while the menu is
+__INPUT_CONTROLS__ = None
+__INPUT_LATENCIES__ = collections.deque(maxlen=100) # seconds from controller event to menu on screen
+__BACKLIGHT__ = None
 
 
 # -----------------------------------------------------------------------------
 # Configuration utilities
 # -----------------------------------------------------------------------------
-def read_config_file(config_file_path):
-    """ Read the config file, if it exists and update the necessary
-        configuration parameters and return a dictionary with the
-        configuration parameters.
+class ConfigError(ValueError):
+    pass
+
 
-        NOTE: this does not overwrite the configuration, the caller
-        must do this themselves.
+def read_config_file(config_file_path):
+    """ Read the settings stored in the config file as a dict, writing a
+        config file with the defaults if there is none.
     """
     config_file_path = os.path.expanduser(config_file_path)
-    config = CONFIG
-
     try:
         with open(config_file_path, 'r') as fhandle:
-            serialized = ' '.join(fhandle.readlines())
-            config = json.loads(serialized)
+            return json.load(fhandle)
     except FileNotFoundError as e:
         print("WARNING: Could not find config file at '%s'. Using default config." % config_file_path)
-        write_config_file(config_file_path)
+        write_config_file(config_file_path, DEFAULTS)
+        return {}
+    except ValueError as e:
+        raise ConfigError("Config file %s is not valid JSON: %s" % (config_file_path, e))
+
+
+def convert_setting(key, value):
+    """ Check a single setting against the type of its default, CONFIG_CHOICES
+        and CONFIG_RANGES. Returns the value as stored in Config.
+    """
+    default = DEFAULTS[key]
+    if isinstance(default, bool):
+        valid = isinstance(value, bool)
+    elif isinstance(default, (int, float)):
+        valid = isinstance(value, (int, float)) and not isinstance(value, bool) and math.isfinite(value)
+        if valid and value == int(value):
+            value = type(default)(value)
+        elif valid and isinstance(default, int) and not key.endswith(TIME_SUFFIXES):
+            valid = False   # only times in seconds may be fractional
+    elif isinstance(default, tuple):
+        valid = isinstance(value, (list, tuple)) and len(value) == len(default) and \
+            all(isinstance(v, type(d)) for v, d in zip(value, default))
+        if valid:
+            value = tuple(value)
+    else:
+        valid = isinstance(value, type(default))
 
-    if config["POWER_SWITCH_BEHAVIOR"] == "INITIAL_OFF":
-        config["IS_VISIBLE"] = False
-    elif config["POWER_SWITCH_BEHAVIOR"] == "INITIAL_ON":
-        config["IS_VISIBLE"] = True
-    elif config["POWER_SWITCH_BEHAVIOR"] == "FLASH" or config["POWER_SWITCH_BEHAVIOR"] == "FLASH_INITIAL_ON":
-        config["IS_VISIBLE"] = False
+    if not valid:
+        raise ValueError("expected a value like %s, got %s" % (json.dumps(default), json.dumps(value)))
 
-    return config
+    if key in CONFIG_CHOICES and value not in CONFIG_CHOICES[key]:
+        raise ValueError("must be one of %s" % ", ".join(CONFIG_CHOICES[key]))
 
+    low, high = CONFIG_RANGES.get(key, (None, None))
+    if low is not None and value < low:
+        raise ValueError("must be at least %s" % low)
+    if high is not None and value > high:
+        raise ValueError("must be at most %s" % high)
 
-def write_config_file(config_file_path, write_args=CONFIG.keys()):
-    """ Write the config file, writing it if it does not exist
+    if key in CONFIG_VALIDATORS:
+        CONFIG_VALIDATORS[key](value)
 
-        Caller can provide an optional list of CONFIG keys. If this
-        list is not empty, only the values in the keys will be
-        updated. The other values will be read from the current
-        state of the config file.
+    return value
+
+
+def parse_config(settings):
+    """ Validate a dict of settings on top of the defaults and return a
+        Config. Raises ConfigError listing every invalid setting.
+    """
+    values = dict(DEFAULTS)
+    problems = []
+    for key, value in settings.items():
+        if key not in DEFAULTS:
+            print("WARNING: ignoring unknown config setting '%s'" % key)
+            continue
+        try:
+            values[key] = convert_setting(key, value)
+        except ValueError as e:
+            problems.append("%s: %s" % (key, e))
+
+    if problems:
+        raise ConfigError("Invalid config:\n  " + "\n  ".join(problems))
+    return Config(**values)
+
+
+def load_config(config_file_path):
+    """ Read and validate the config file. Relative paths are made absolute
+        and IS_VISIBLE is set to the initial visibility of the hud.
+    """
+    config = parse_config(read_config_file(config_file_path))
+
+    if config.POWER_SWITCH_BEHAVIOR == "INITIAL_OFF":
+        config = config._replace(IS_VISIBLE=False)
+    elif config.POWER_SWITCH_BEHAVIOR == "INITIAL_ON":
+        config = config._replace(IS_VISIBLE=True)
+    elif config.POWER_SWITCH_BEHAVIOR == "FLASH" or config.POWER_SWITCH_BEHAVIOR == "FLASH_INITIAL_ON":
+        config = config._replace(IS_VISIBLE=False)
+
+    return config._replace(
+        IMAGE_PATH=os.path.join(__SCRIPT_PATH__, config.IMAGE_PATH),
+        SOUND_PATH=os.path.join(__SCRIPT_PATH__, config.SOUND_PATH),
+        LIB_PATH=os.path.join(__SCRIPT_PATH__, config.LIB_PATH),
+        FUEL_GAUGE_SCRIPT_PATH=os.path.join(__SCRIPT_PATH__, config.FUEL_GAUGE_SCRIPT_PATH)
+    )
+
+
+def write_config_file(config_file_path, settings):
+    """ Update the given settings in the config file, keeping everything
+        else in it as is. The file is replaced atomically (write to a
+        temporary file, then rename) so it is never left half written.
+        Returns True on success.
     """
+    global __CONFIG_SIGNATURE__
     config_file_path = os.path.expanduser(config_file_path)
     config = {}
     try:
         with open(config_file_path, 'r') as fhandle:
-            serialized = ' '.join(fhandle.readlines())
-            config = json.loads(serialized)
-
-            for k in write_args:
-                config[k] = CONFIG[k]
-    except FileNotFoundError as e:
-        config = CONFIG
+            config = json.load(fhandle)
+    except (FileNotFoundError, ValueError):
+        pass
+    config.update(settings)
 
+    tmp_path = "%s.tmp.%d" % (config_file_path, os.getpid())
     try:
-        with open(config_file_path, 'w+') as fhandle:
-            serialized = json.dumps(config, indent=2, sort_keys=True)
-            fhandle.write(serialized)
-    except Exception as e:
-        print("Error opening config file: %s" % config_file_path)
+        with open(tmp_path, 'w') as fhandle:
+            fhandle.write(json.dumps(config, indent=2, sort_keys=True))
+            fhandle.flush()
+            os.fsync(fhandle.fileno())
+        os.replace(tmp_path, config_file_path)
+        __CONFIG_SIGNATURE__ = config_file_signature(config_file_path)
+        return True
+    except OSError as e:
+        print("Error writing config file: %s" % config_file_path)
         print(e)
-        sys.exit(1)
+        try:
+            os.unlink(tmp_path)
+        except OSError:
+            pass
+        return False
+
+
+def config_file_signature(config_file_path):
+    """ Identifies a version of the config file, to tell our own writes apart
+        from edits
+    """
+    try:
+        st = os.stat(os.path.expanduser(config_file_path))
+    except OSError:
+        return None
+    return (st.st_ino, st.st_mtime_ns, st.st_size)
+
+
+def reload_config():
+    """ Re-read the config file and make it the active config. Hud
+        visibility is runtime state and is kept, as are the RESTART_REQUIRED
+        settings. Returns the keys that changed and those that need a restart
+        to apply. Raises ConfigError (and keeps the current config) if the
+        file is invalid.
+    """
+    global CONFIG, __ATLAS__, __LAST_HUD_STATE__, __HUD_PLACEMENTS__, __CONFIG_SIGNATURE__, __BACKLIGHT__
+    config = load_config(CONFIG.CONFIG_FILE_PATH)
+    __CONFIG_SIGNATURE__ = config_file_signature(CONFIG.CONFIG_FILE_PATH)
+
+    changed = [k for k in Config._fields if k != "IS_VISIBLE" and getattr(config, k) != getattr(CONFIG, k)]
+    restart_required = [k for k in changed if k in RESTART_REQUIRED]
+    config = config._replace(IS_VISIBLE=CONFIG.IS_VISIBLE, **{k: getattr(CONFIG, k) for k in restart_required})
+
+    if config.IMAGE_PATH != CONFIG.IMAGE_PATH:
+        import atlas
+        try:
+            __ATLAS__ = atlas.build(config.IMAGE_PATH, required_sprites())
+        except atlas.AssetError as e:
+            raise ConfigError(e.report())
+
+    CONFIG = config
+    if __POLICY__ is not None:
+        __POLICY__.configure(**policy_settings())
+    schedule_telemetry_sample()
+
+    # layers, sprites or the display may have changed; start from scratch
+    renderer().draw_group("hud", {})
+    renderer().commit()
+    while __HUD_FRAME_CACHE__:
+        _, frame = __HUD_FRAME_CACHE__.popitem()
+        renderer().unload(frame)
+    for name in required_sprites():
+        renderer().unload(sprite_image(name))
+    for image in __SCALED_IMAGES__.values():
+        renderer().unload(image)
+    __SCALED_IMAGES__.clear()
+    __HUD_LAYOUTS__.clear()
+    __HUD_LAYOUTS__.size = config.HUD_CACHE_SIZE
+    __HUD_PLACEMENTS__ = None
+    __LAST_HUD_STATE__ = None
+    __BACKLIGHT__ = None
+    invalidate_screen_resolution()
+    metrics_writer_setup()
+
+    return {"changed": changed, "restart_required": restart_required}
+
+
+def config_watch_setup():
+    """ Reload the config whenever the config file is written or replaced.
+        The directory is watched since editors (and write_config_file) save
+        by renaming a new file over the old one.
+    """
+    global __CONFIG_WATCH__
+    if not CONFIG.CONFIG_WATCH:
+        return
+
+    import inotify
+    directory, name = os.path.split(os.path.expanduser(CONFIG.CONFIG_FILE_PATH))
+    try:
+        watch = inotify.Watch()
+        watch.add(directory, inotify.IN_CLOSE_WRITE | inotify.IN_MOVED_TO)
+    except OSError as e:
+        print("WARNING: not watching the config file for changes: %s" % e)
+        return
+
+    __CONFIG_WATCH__ = watch
+    __LOOP__.add_reader(watch.fileno(), __config_file_event, name)
+
+
+def __config_file_event(name):
+    """ helper for config_watch_setup. Wait for writes to settle, then reload.
+    """
+    global __CONFIG_RELOAD__
+    if not any(event_name == name for _, _, _, event_name in __CONFIG_WATCH__.read()):
+        return
+    if __CONFIG_RELOAD__ is not None:
+        __CONFIG_RELOAD__.cancel()
+    __CONFIG_RELOAD__ = __LOOP__.call_later(0.2, __reload_changed_config)
+
+
+def __reload_changed_config():
+    global __CONFIG_RELOAD__
+    __CONFIG_RELOAD__ = None
+    if config_file_signature(CONFIG.CONFIG_FILE_PATH) in (None, __CONFIG_SIGNATURE__):
+        return # our own write, or the file is gone
+
+    try:
+        result = reload_config()
+    except ConfigError as e:
+        print("WARNING: config file change ignored. %s" % e)
+        return
+    if result["changed"]:
+        print("Config reloaded, changed: %s" % ", ".join(result["changed"]))
+    if result["restart_required"]:
+        print("WARNING: restart to apply %s" % ", ".join(result["restart_required"]))
+
+
+def save_visibility():
+    """ Write the hud visibility to the config file if it changed since it
+        was last written
+    """
+    global __VISIBILITY_SAVE__, __SAVED_VISIBILITY__
+    if __VISIBILITY_SAVE__ is not None:
+        __VISIBILITY_SAVE__.cancel()
+        __VISIBILITY_SAVE__ = None
+
+    if CONFIG.POWER_SWITCH_BEHAVIOR != "SAVED" or __IS_VISIBLE__ == __SAVED_VISIBILITY__:
+        return
+    if write_config_file(CONFIG.CONFIG_FILE_PATH, {"IS_VISIBLE": __IS_VISIBLE__}):
+        __SAVED_VISIBILITY__ = __IS_VISIBLE__
 
 
 # -----------------------------------------------------------------------------
 # Graphical utilites
 # -----------------------------------------------------------------------------
+@metrics.timed("pngview")
 def pngview(draw_id, pngfile, dont_save_pid=False, **kwargs):
     """ Call pngview to display an image on the screen. Returns a process id
-        that the pngview call is running in.
+        that the pngview call is running in. Raises supervisor.ChildLimitError
+        if too many helper processes are running.
 
         NOTE: it is important to properly set draw_id. This is a unique (string)
         identifier that should specify which sprite we are drawing. This is
@@ -165,15 +608,18 @@ def pngview(draw_id, pngfile, dont_save_pid=False, **kwargs):
         [None if not str(v) else str(v) for v in kwargs.values()]
     ) for val in pair]
 
-    pngview_call.insert(0, CONFIG["PNGVIEW_PATH"])
+    pngview_call.insert(0, CONFIG.PNGVIEW_PATH)
     pngview_call.append(pngfile)
 
-    pngview_call = filter((None).__ne__, pngview_call)
+    pngview_call = [arg for arg in pngview_call if arg is not None]
 
-    pid = subprocess.Popen(pngview_call)
+    # with -t pngview exits by itself, anything else lives until replaced
+    timeout = int(kwargs['t']) / 1000.0 + 1 if str(kwargs.get('t', "")) else None
+    previous = __PNGVIEW_PROCESSES__.get(draw_id)
+    pid = child_supervisor().spawn("pngview", pngview_call, timeout=timeout, replaces=previous)
     time.sleep(0.025) # this is a hack to prevent flickering
-    if draw_id in __PNGVIEW_PROCESSES__:
-        __PNGVIEW_PROCESSES__[draw_id].kill()
+    if previous is not None:
+        child_supervisor().kill(__PNGVIEW_PROCESSES__.pop(draw_id))
 
     if not dont_save_pid:
         __PNGVIEW_PROCESSES__[draw_id] = pid
@@ -181,11 +627,346 @@ def pngview(draw_id, pngfile, dont_save_pid=False, **kwargs):
     return pid
 
 
+Image = collections.namedtuple("Image", ["key", "width", "height", "rgba"])
+
+
+class Renderer(object):
+    """ Interface shared by the overlay renderers. Sprites are identified by
+        draw_id and kept in a retained scene (see scene.py): draw() and
+        remove() only describe what should be on screen, and commit()
+        applies the difference to what is on screen, touching only the
+        sprites that were added, moved, replaced or removed.
+
+        A sprite is either a path to a png file or an in memory Image.
+    """
+
+    def __init__(self):
+        self.scene = scene.Scene()
+        self.changes = collections.Counter()
+
+    @property
+    def sprites(self):
+        """ The sprites on screen, {draw_id: scene.Node}
+        """
+        return self.scene.nodes
+
+    def draw(self, draw_id, pngfile, display=0, layer=0, x=None, y=None):
+        """ Show pngfile (a path or an Image) as sprite draw_id. If x and y
+            are omitted the sprite is centered on the screen.
+        """
+        self.scene.set(draw_id, scene.Node(pngfile, display, layer, x, y))
+
+    def draw_group(self, group, sprites):
+        """ Make sprites ({draw_id: scene.Node}) the only sprites of group,
+            removing the ones that were drawn for it before and are not in
+            sprites.
+        """
+        self.scene.set_group(group, sprites)
+
+    def remove(self, draw_id):
+        self.scene.remove(draw_id)
+
+    def commit(self, wait=False):
+        """ Apply the changes since the last commit and make them visible.
+            Does nothing at all if nothing changed. With wait=True, return
+            only once the changes are on screen (if the renderer can tell).
+            Returns the number of sprites that changed.
+        """
+        shown = self.scene.nodes
+        changes = self.scene.flush()
+        for op, draw_id, node in changes:
+            self.changes[op] += 1
+            if op == scene.REMOVE:
+                self._remove(draw_id)
+                continue
+            drawn = self._move(draw_id, *node) if op == scene.MOVE else self._draw(draw_id, *node)
+            if drawn is False:
+                # still showing what it did before, the next commit tries again
+                self.scene.undo(draw_id, shown)
+        if changes:
+            self._commit(wait)
+        return len(changes)
+
+    def unload(self, image):
+        """ Release any resources held for an Image that will not be drawn
+            again.
+        """
+        pass
+
+    def close(self):
+        for draw_id in list(self.scene.staged.keys()):
+            self.remove(draw_id)
+        self.commit()
+
+    def _draw(self, draw_id, pngfile, display, layer, x, y):
+        """ Returns False if the sprite could not be drawn
+        """
+        raise NotImplementedError
+
+    def _move(self, draw_id, pngfile, display, layer, x, y):
+        """ Same image as before, only the placement changed
+        """
+        return self._draw(draw_id, pngfile, display, layer, x, y)
+
+    def _remove(self, draw_id):
+        raise NotImplementedError
+
+    def _commit(self, wait=False):
+        pass
+
+
+class PngviewRenderer(Renderer):
+    """ Fallback renderer that starts one pngview process per sprite. pngview
+        can not move a sprite, so a move restarts it like a new image.
+    """
+
+    def _draw(self, draw_id, pngfile, display, layer, x, y):
+        if isinstance(pngfile, Image):
+            pngfile = self.image_path(pngfile)
+
+        kwargs = dict(d=display, l=layer)
+        if x is not None:
+            kwargs['x'] = x
+        if y is not None:
+            kwargs['y'] = y
+        try:
+            pngview(draw_id, pngfile, **kwargs)
+        except supervisor.ChildLimitError as e:
+            print("WARNING: %s" % e)
+            return False
+        return True
+
+    def _remove(self, draw_id):
+        if draw_id in __PNGVIEW_PROCESSES__:
+            child_supervisor().kill(__PNGVIEW_PROCESSES__.pop(draw_id))
+
+    def image_path(self, image):
+        """ pngview can only draw files, so in memory images are written out
+            to HUD_CACHE_PATH (a tmpfs by default) the first time they are
+            drawn.
+        """
+        path = os.path.join(CONFIG.HUD_CACHE_PATH, image.key + ".png")
+        if not os.path.exists(path):
+            os.makedirs(CONFIG.HUD_CACHE_PATH, exist_ok=True)
+            pngcodec.write(path, image.width, image.height, image.rgba, level=1)
+        return path
+
+    def unload(self, image):
+        try:
+            os.remove(os.path.join(CONFIG.HUD_CACHE_PATH, image.key + ".png"))
+        except FileNotFoundError:
+            pass
+
+
+class CompositorRenderer(Renderer):
+    """ Streams sprite updates to a single overlay_compositor.py process that
+        owns the DispmanX layers. Each commit() is applied atomically on the
+        next vsync. If the compositor dies it is restarted and the current
+        sprites are replayed.
+    """
+
+    REPLY_TIMEOUT = 1.0 # seconds to wait for the compositor to start or to apply an update
+
+    def __init__(self):
+        super().__init__()
+        self.loaded = set()
+        self.process = None
+        self.replies = b""
+        self.commits = 0
+        self.start()
+
+    def start(self):
+        self.loaded = set()
+        self.replies = b""
+        self.commits = 0
+        self.process = subprocess.Popen(
+            [sys.executable, os.path.join(__SCRIPT_PATH__, "overlay_compositor.py")],
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE
+        )
+        if self.reply() != "ready":
+            self.process.kill()
+            self.process.wait()
+            raise ChildProcessError("overlay compositor failed to start")
+
+    def reply(self):
+        """ The next line the compositor wrote, "" if it exited or None if it
+            did not answer within REPLY_TIMEOUT. Reads the pipe directly so a
+            stalled compositor cannot block the event loop for longer.
+        """
+        fd = self.process.stdout.fileno()
+        deadline = time.monotonic() + self.REPLY_TIMEOUT
+        while b"\n" not in self.replies:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0 or not select.select([fd], [], [], remaining)[0]:
+                return None
+            data = os.read(fd, 4096)
+            if not data:
+                return ""
+            self.replies += data
+        line, self.replies = self.replies.split(b"\n", 1)
+        return line.decode("utf-8", "replace").strip()
+
+    def send(self, command, payload=None):
+        message = json.dumps(command).encode('utf-8') + b"\n"
+        if payload is not None:
+            message += payload
+        try:
+            self.process.stdin.write(message)
+        except (BrokenPipeError, ValueError):
+            print("WARNING: overlay compositor exited, restarting it.")
+            self.start()
+            for draw_id, sprite in self.sprites.items():
+                self._draw(draw_id, *sprite)
+            self.process.stdin.write(message)
+
+    def _draw(self, draw_id, pngfile, display, layer, x, y):
+        key = scene.image_key(pngfile)
+        if key not in self.loaded:
+            if isinstance(pngfile, Image):
+                self.send({"op": "load", "key": key, "width": pngfile.width, "height": pngfile.height,
+                    "size": len(pngfile.rgba)}, pngfile.rgba)
+            else:
+                self.send({"op": "load", "key": key, "path": pngfile})
+            self.loaded.add(key)
+
+        # the compositor only swaps the source of an element if the key changed
+        self._move(draw_id, pngfile, display, layer, x, y)
+
+    def _move(self, draw_id, pngfile, display, layer, x, y):
+        command = {"op": "set", "id": draw_id, "key": scene.image_key(pngfile), "display": display, "layer": layer}
+        if x is not None:
+            command["x"] = x
+        if y is not None:
+            command["y"] = y
+        self.send(command)
+
+    def _remove(self, draw_id):
+        self.send({"op": "remove", "id": draw_id})
+
+    def unload(self, image):
+        if image.key in self.loaded:
+            self.send({"op": "unload", "key": image.key})
+            self.loaded.discard(image.key)
+
+    def _commit(self, wait=False):
+        """ Flip all pending sprite changes. With wait=True, block until the
+            compositor has applied them (and report the changes it could not
+            apply).
+        """
+        self.send({"op": "commit", "ack": wait})
+        try:
+            self.process.stdin.flush()
+        except BrokenPipeError:
+            self.process.wait()
+            self.start()
+            for draw_id, sprite in self.sprites.items():
+                self._draw(draw_id, *sprite)
+            self.send({"op": "commit", "ack": wait})
+            self.process.stdin.flush()
+        self.commits += 1
+        while wait:
+            reply = self.reply()
+            if reply is None:
+                print("WARNING: overlay compositor did not apply the update within %g s." % self.REPLY_TIMEOUT)
+                return
+            if not reply:
+                print("WARNING: overlay compositor exited before applying the update.")
+                return
+            # skip the late acks of updates that timed out earlier
+            parts = reply.split(" ", 2)
+            try:
+                seq = int(parts[1])
+            except (IndexError, ValueError):
+                seq = self.commits
+            if seq < self.commits:
+                continue
+            if parts[0] != "ok":
+                print("WARNING: overlay compositor: %s" % reply)
+            return
+
+    def close(self):
+        super().close()
+        try:
+            self.send({"op": "quit"})
+            self.process.stdin.close()
+            self.process.wait(timeout=2)
+        except (BrokenPipeError, subprocess.TimeoutExpired):
+            self.process.kill()
+            self.process.wait()
+
+
+class SimulatedRenderer(Renderer):
+    """ Renderer that draws nothing. It records every sprite operation and
+        the time of every commit so the daemon can be run and benchmarked off
+        device.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.operations = []
+        self.commits = []
+
+    def _draw(self, draw_id, pngfile, display, layer, x, y):
+        self.operations.append(("draw", draw_id))
+
+    def _move(self, draw_id, pngfile, display, layer, x, y):
+        self.operations.append(("move", draw_id))
+
+    def _remove(self, draw_id):
+        self.operations.append(("remove", draw_id))
+
+    def _commit(self, wait=False):
+        self.commits.append(time.perf_counter())
+
+
+def child_supervisor():
+    """ Return the supervisor that starts and reaps all helper processes
+    """
+    global __SUPERVISOR__
+    if __SUPERVISOR__ is None:
+        __SUPERVISOR__ = supervisor.Supervisor(__LOOP__, CONFIG.CHILD_PROCESS_LIMIT)
+    return __SUPERVISOR__
+
+
+def renderer():
+    """ Return the overlay renderer selected in the config, falling back to
+        pngview if the compositor can not be started.
+    """
+    global __RENDERER__
+    if __RENDERER__ is None:
+        if CONFIG.RENDERER == "SIM":
+            __RENDERER__ = SimulatedRenderer()
+        elif CONFIG.RENDERER == "COMPOSITOR":
+            try:
+                __RENDERER__ = CompositorRenderer()
+            except (ChildProcessError, OSError) as e:
+                print("WARNING: %s. Falling back to pngview." % e)
+        if __RENDERER__ is None:
+            __RENDERER__ = PngviewRenderer()
+    return __RENDERER__
+
+
 def screen_resolution(display_id=0):
     """ Returns a pair of integers with the screen resolution of the specified
         display. The first coordinate is 'x' (screen width) and the second is
         'y' (screen height).
+
+        The resolution is only queried from tvservice the first time it is
+        needed for a display. After that it is cached until the display
+        monitor (see display_monitor_setup) sees a display change.
+    """
+    if display_id not in __RESOLUTION_CACHE__:
+        __RESOLUTION_CACHE__[display_id] = query_screen_resolution(display_id)
+    return __RESOLUTION_CACHE__[display_id]
+
+
+def query_screen_resolution(display_id=0):
+    """ Ask tvservice for the current resolution of the specified display.
     """
+    if CONFIG.RENDERER == "SIM":
+        return list(CONFIG.SIM_RESOLUTION)
+
     results = subprocess.run(["tvservice", "-s", "-v", str(display_id)], capture_output=True)
     resolution = re.search("(\d{2,}x\d{2,})", results.stdout.decode('utf-8'))
 
@@ -195,49 +976,197 @@ def screen_resolution(display_id=0):
     return [int(x) for x in resolution[0].split("x")]
 
 
-def png_dimensions(fname):
-    """ Returns a pair of integers that are the width and height of the image.
-        This only works for PNG images.
+def invalidate_screen_resolution():
+    """ Forget all cached resolutions and redraw the hud so it is positioned
+        for the new display mode. A hidden hud is laid out again when it is
+        shown.
     """
-    global __DIMENSION_CACHE__
-    if fname in __DIMENSION_CACHE__:
-        return __DIMENSION_CACHE__[fname]
+    __RESOLUTION_CACHE__.clear()
+    if __IS_VISIBLE__:
+        request_redraw(sample=False)
+
+
+def display_monitor_setup():
+    """ Start watching for display changes so the resolution cache can be
+        invalidated.
+    """
+    __LOOP__.create_task(display_monitor())
+
+
+async def display_monitor():
+    """ `tvservice -M` prints a line for every hotplug and mode change event.
+        Invalidate the resolution cache on every one of them. If it can not
+        be started (or exits) fall back to polling the cached displays every
+        RESOLUTION_POLL_INTERVAL seconds.
+    """
+    if CONFIG.RENDERER == "SIM":
+        return
 
     try:
-        with open(fname, 'rb') as fhandle:
-            head = fhandle.read(24)
-            if len(head) != 24:
-                raise TypeError("Invalid PNG file provided: %s" % fname)
-            if imghdr.what(fname) == 'png':
-                check = struct.unpack('>i', head[4:8])[0]
-                if check != 0x0d0a1a0a:
-                    raise TypeError("Invalid PNG file provided: %s" % fname)
-                width, height = struct.unpack('>ii', head[16:24])
-                __DIMENSION_CACHE__[fname] = (width, height)
-                return __DIMENSION_CACHE__[fname]
-            else:
-                raise TypeError("Invalid PNG file provided: %s" % fname)
-    except FileNotFoundError as e:
-        print(e)
+        monitor = await asyncio.create_subprocess_exec("tvservice", "-M",
+            stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+    except OSError as e:
+        print("WARNING: could not start display monitor (%s). Polling for display changes instead." % e)
+        monitor = None
+
+    if monitor is not None:
+        async for line in monitor.stdout:
+            line = line.decode('utf-8').strip()
+            if line and not line.startswith("Starting"):
+                invalidate_screen_resolution()
+        await monitor.wait()
+        print("WARNING: display monitor exited. Polling for display changes instead.")
+
+    if CONFIG.RESOLUTION_POLL_INTERVAL <= 0:
+        return
+
+    while True:
+        await asyncio.sleep(CONFIG.RESOLUTION_POLL_INTERVAL)
+        for display_id, resolution in list(__RESOLUTION_CACHE__.items()):
+            try:
+                current = await __LOOP__.run_in_executor(None, query_screen_resolution, display_id)
+            except ChildProcessError as e:
+                print(e)
+                continue
+
+            if current != resolution:
+                invalidate_screen_resolution()
+                break
 
 
 def set_visibility(is_visible):
-    """ Set the visibility of the hud
+    """ Set the visibility of the hud. Ends a flash that is still running.
+    """
+    global __IS_VISIBLE__, __VISIBILITY_SAVE__, __FLASH_TIMER__
+    if __FLASH_TIMER__ is not None:
+        __FLASH_TIMER__.cancel()
+        __FLASH_TIMER__ = None
+    __IS_VISIBLE__ = is_visible
+    # nothing about the battery changed, the last reading will do
+    request_redraw(sample=False)
+
+    # in SAVED mode the visibility is persisted, but not on every toggle
+    if CONFIG.POWER_SWITCH_BEHAVIOR == "SAVED" and __VISIBILITY_SAVE__ is None:
+        __VISIBILITY_SAVE__ = __LOOP__.call_later(CONFIG.VISIBILITY_SAVE_DELAY, save_visibility)
+
+
+def request_redraw(delay=None, sample=True):
+    """ Ask for the hud to be redrawn with the latest battery state. Requests
+        that arrive within REDRAW_COALESCE_WINDOW seconds (or `delay`) of each
+        other are merged into a single fuel gauge read and render. With
+        sample=False the last fuel gauge reading is used instead, unless one
+        of the merged requests needs a new one.
+    """
+    global __REDRAW_PENDING__, __REDRAW_SAMPLE__
+    __REDRAW_STATS__["requested"] += 1
+    __REDRAW_SAMPLE__ = __REDRAW_SAMPLE__ or sample
+
+    if __REDRAW_PENDING__ is not None:
+        __REDRAW_STATS__["merged"] += 1
+        return
+
+    __REDRAW_PENDING__ = __LOOP__.call_later(CONFIG.REDRAW_COALESCE_WINDOW if delay is None else delay,
+        __flush_redraw)
+
+
+@metrics.timed("flush_redraw")
+def __flush_redraw():
+    """ helper for request_redraw. Read the fuel gauge once, run the battery
+        checks and render the hud, unless it would look exactly the same as
+        what is already on screen.
+    """
+    global __REDRAW_PENDING__, __REDRAW_SAMPLE__, __LAST_HUD_STATE__
+    __REDRAW_PENDING__ = None
+
+    gauge = None if __REDRAW_SAMPLE__ else last_reading()
+    __REDRAW_SAMPLE__ = False
+    if gauge is None:
+        try:
+            gauge = read_fuel_gauge()
+            record_telemetry(gauge)
+            check_battery_state()
+        except ValueError as e:
+            print(e)
+            # draw what we knew before, if anything
+            gauge = last_reading()
+        schedule_telemetry_sample()
+    elif __STATUS_SHM__ is not None:
+        # readers of the status segment also want to know about the visibility
+        publish_status(gauge, __TELEMETRY__.latest().timestamp)
+
+    state = None if gauge is None else hud_state(gauge)
+    if state is None or state == __LAST_HUD_STATE__:
+        __REDRAW_STATS__["skipped"] += 1
+    else:
+        draw_hud(battery=gauge.state_of_charge, is_charging=(not gauge.is_discharging))
+        __LAST_HUD_STATE__ = state
+        __REDRAW_STATS__["rendered"] += 1
+
+    if __STARTUP_TIMES__ and __STARTUP_TIMES__[-1][0] != "live hud":
+        startup_phase("live hud")
+        startup_report()
+
+
+def hud_state(gauge):
+    """ Everything that determines what the hud looks like. Two equal states
+        render identically.
     """
-    CONFIG["IS_VISIBLE"] = is_visible
-    draw_hud(battery=get_state_of_charge(), is_charging=(not is_discharging()))
+    if not __IS_VISIBLE__:
+        return (False,)
 
+    return (
+        True,
+        gauge.state_of_charge,
+        not gauge.is_discharging,
+        tuple((placement.display, tuple(resolution)) for placement, resolution in hud_screens())
+    )
 
+
+def hud_placements():
+    """ The layout.Placements from HUD_DISPLAYS
+    """
+    global __HUD_PLACEMENTS__
+    if __HUD_PLACEMENTS__ is None:
+        __HUD_PLACEMENTS__ = layout.parse_placements(CONFIG.HUD_DISPLAYS, CONFIG.DISPLAY_ID)
+    return __HUD_PLACEMENTS__
+
+
+def hud_screens():
+    """ (placement, resolution) of every display the hud is drawn on. A
+        display other than the first that can not be queried (e.g. HDMI
+        unplugged) is skipped until the next display change.
+    """
+    screens = []
+    for index, placement in enumerate(hud_placements()):
+        try:
+            resolution = screen_resolution(placement.display)
+        except ChildProcessError as e:
+            if index == 0:
+                raise
+            print("WARNING: not drawing the hud on display %d: %s" % (placement.display, e))
+            __RESOLUTION_CACHE__[placement.display] = None
+            continue
+        if resolution is not None:
+            screens.append((placement, resolution))
+    return screens
+
+
+@metrics.timed("draw_hud")
 def draw_hud(**kwargs):
-    """ Make all pngview calls to draw the status overlay
+    """ Draw the status overlay. The hud is declared as a whole and the
+        renderer only updates the sprites that differ from what is on screen,
+        so e.g. 57% -> 56% replaces a single digit and an unchanged hud does
+        nothing. With HUD_RENDERING "FRAME" the hud is one pre-composited
+        image (see hud_frame).
 
         battery - integer with remaining battery charge
         is_charging - boolean with whether or not the device is charging
+        composited - draw a composited frame regardless of HUD_RENDERING
     """
 
-    if not CONFIG["IS_VISIBLE"]:
-        for v in __PNGVIEW_PROCESSES__.values():
-            v.kill()
+    if not __IS_VISIBLE__:
+        renderer().draw_group("hud", {})
+        renderer().commit()
         return
 
     if 'battery' not in kwargs:
@@ -245,136 +1174,232 @@ def draw_hud(**kwargs):
     if 'is_charging' not in kwargs:
         kwargs['is_charging'] = False
 
-    H_PADDING = 2
-    V_PADDING = 2
-
     try:
-        screen = screen_resolution()
+        screens = hud_screens()
     except ChildProcessError as e:
         print(e)
         on_exit(0, 0)
 
-    h_cursor = screen[0]
+    battery = max(0, min(100, int(kwargs['battery'])))
+    composited = CONFIG.HUD_RENDERING == "FRAME" or bool(kwargs.get('composited'))
 
-    try:
-        # draw backdrop
-        backdrop_image_path = CONFIG["IMAGE_PATH"] + "backdrop.png"
-        backdrop_image_dimensions = png_dimensions(backdrop_image_path)
-        backdrop_pos = (screen[0] - backdrop_image_dimensions[0], 0)
-
-        pngview(
-            "backdrop",
-            backdrop_image_path,
-            d=CONFIG["DISPLAY_ID"],
-            l=CONFIG["LAYER_BACKDROP"],
-            x=backdrop_pos[0],
-            y=backdrop_pos[1]
-        )
+    if composited:
+        # layout cache hits do not go through hud_frame, keep the frame of
+        # the state on screen at the front of its LRU
+        hud_frame(battery, kwargs['is_charging'])
 
-        # draw battery in upper right corner
-        battery_image_path = charge_to_img_path(kwargs['battery'], kwargs['is_charging'])
-        battery_image_dimensions = png_dimensions(battery_image_path)
+    # one lookup per display once a state has been seen, and a single commit
+    sprites = {}
+    for placement, resolution in screens:
+        key = (placement, tuple(resolution), battery, bool(kwargs['is_charging']), composited)
+        sprites.update(__HUD_LAYOUTS__.get(key, lambda: place_hud(*key)))
 
-        h_cursor = h_cursor - battery_image_dimensions[0] - H_PADDING
-        battery_pos = (h_cursor, V_PADDING)
+    renderer().draw_group("hud", sprites)
+    renderer().commit()
 
-        pngview(
-            "battery",
-            battery_image_path,
-            d=CONFIG["DISPLAY_ID"],
-            l=CONFIG["LAYER_BATTERY"],
-            x=battery_pos[0],
-            y=battery_pos[1]
-        )
 
-        # draw charge number
-        percent_path = CONFIG["IMAGE_PATH"] + "percent.png"
-        percent_dimensions = png_dimensions(percent_path)
+def place_hud(placement, resolution, battery, is_charging, composited):
+    """ The hud sprites for one display, {draw_id: scene.Node}. Draw ids are
+        suffixed with the display so every display has its own sprites.
+    """
+    if composited:
+        frame = hud_frame(battery, is_charging)
+        items = [("hud", frame, CONFIG.LAYER_DEFAULT, 0, 0)]
+    else:
+        items = [(draw_id, sprite_image(name), layer, x, y)
+            for draw_id, name, layer, x, y in hud_layout(battery, is_charging)]
 
-        h_cursor = h_cursor - percent_dimensions[0] - H_PADDING
-        percent_pos = (h_cursor, V_PADDING)
+    left, top, width, height = layout.bounds([(x, y, image.width, image.height) for _, image, _, x, y in items])
+    factor = placement.scale
+    x0, y0 = layout.place(placement, resolution, int(round(width * factor)), int(round(height * factor)))
 
-        pngview("percent", percent_path, d=CONFIG["DISPLAY_ID"], l=CONFIG["LAYER_NUMBER"], x=percent_pos[0], y=percent_pos[1])
+    return {
+        "%s@%d" % (draw_id, placement.display): scene.Node(
+            scaled_image(image, factor), placement.display, layer,
+            x0 + int(round((x - left) * factor)), y0 + int(round((y - top) * factor)))
+        for draw_id, image, layer, x, y in items
+    }
 
-        digit_idx = 0
-        intnum = kwargs['battery']
-        while True:
-            digit = int(intnum % 10)
-            intnum = int(intnum / 10)
-
-            digit_image_path = CONFIG["IMAGE_PATH"] + "num" + str(digit) + ".png"
-            digit_dimensions = png_dimensions(digit_image_path)
-
-            h_cursor = h_cursor - digit_dimensions[0]
-            digit_pos = (h_cursor, V_PADDING)
-
-            pngview(
-                "digit" + str(digit_idx),
-                digit_image_path,
-                d=CONFIG["DISPLAY_ID"],
-                l=CONFIG["LAYER_NUMBER"],
-                x=digit_pos[0],
-                y=digit_pos[1]
-            )
-            digit_idx = digit_idx + 1
 
-            if intnum == 0:
-                break
+def scaled_image(image, factor):
+    """ image scaled by factor (nearest neighbour), kept until the config
+        changes or, for a hud frame, until the frame is evicted
+    """
+    if factor == 1:
+        return image
+    key = "%s@%gx" % (image.key, factor)
+    scaled = __SCALED_IMAGES__.get(key)
+    if scaled is None:
+        width, height, rgba = pngcodec.scale(image.rgba, image.width, image.height, factor)
+        scaled = __SCALED_IMAGES__[key] = Image(key, width, height, rgba)
+    return scaled
+
+
+def hud_layout(battery, is_charging):
+    """ Lay out the hud sprites in hud coordinates, right aligned to x = 0.
+        Returns a list of (draw_id, sprite, layer, x, y) tuples where x is
+        the offset of the left edge of the sprite from the right edge of the
+        hud (see place_hud for placing it on a screen). Digits are numbered
+        from the right, so the ones digit keeps its draw_id when the number
+        of digits changes.
+    """
+    H_PADDING = 2
+    V_PADDING = 2
 
-        # remove unnecessary digits if applicable
-        digit_id = "digit" + str(digit_idx)
-        while digit_id in __PNGVIEW_PROCESSES__:
-            __PNGVIEW_PROCESSES__[digit_id].kill()
-            digit_idx = digit_idx + 1
-            digit_id = "digit" + str(digit_idx)
+    layout = []
+    h_cursor = 0
 
-    except TypeError as e:
-        print(e)
-        on_exit(0, 0)
+    # backdrop
+    backdrop_width, _ = __ATLAS__.size("backdrop.png")
+    layout.append(("hud-backdrop", "backdrop.png", CONFIG.LAYER_BACKDROP, -backdrop_width, 0))
 
+    # battery in upper right corner
+    battery_sprite = charge_to_sprite(battery, is_charging)
+    battery_width, _ = __ATLAS__.size(battery_sprite)
 
-def draw_notification(fname, draw_id, display_time):
-    """ Draws the specified picture in the center of the screen and 
+    h_cursor = h_cursor - battery_width - H_PADDING
+    layout.append(("hud-battery", battery_sprite, CONFIG.LAYER_BATTERY, h_cursor, V_PADDING))
+
+    # charge number
+    percent_width, _ = __ATLAS__.size("percent.png")
+
+    h_cursor = h_cursor - percent_width - H_PADDING
+    layout.append(("hud-percent", "percent.png", CONFIG.LAYER_NUMBER, h_cursor, V_PADDING))
+
+    intnum = battery
+    place = 0
+    while True:
+        digit = int(intnum % 10)
+        intnum = int(intnum / 10)
+
+        digit_sprite = "num" + str(digit) + ".png"
+        digit_width, _ = __ATLAS__.size(digit_sprite)
+
+        h_cursor = h_cursor - digit_width
+        layout.append(("hud-digit%d" % place, digit_sprite, CONFIG.LAYER_NUMBER, h_cursor, V_PADDING))
+        place += 1
+
+        if intnum == 0:
+            break
+
+    return layout
+
+
+def hud_frame(battery, is_charging):
+    """ Return the composited hud Image for the given state. Frames are
+        composited the first time a state is needed and then kept in an LRU
+        cache of at most HUD_CACHE_SIZE frames.
     """
-    try:
-        image_path = CONFIG["IMAGE_PATH"] + fname
-
-        pid = pngview(
-            draw_id,
-            image_path,
-            dont_save_pid=True,
-            d=CONFIG["DISPLAY_ID"],
-            l=CONFIG["LAYER_NOTIFICATION"]
-        )
+    battery = max(0, min(100, int(battery)))
+    key = (battery, bool(is_charging))
 
-        if draw_id in __NOTIFICATION_PROCESSES__:
-            __NOTIFICATION_PROCESSES__[draw_id].kill()
-        __NOTIFICATION_PROCESSES__[draw_id] = pid
+    frame = __HUD_FRAME_CACHE__.get(key)
+    if frame is not None:
+        __HUD_FRAME_CACHE__.move_to_end(key)
+        return frame
 
-        helper = threading.Thread(target=__hide_notification, args=(draw_id, display_time), daemon=True)
-        helper.start()
-    except TypeError as e:
-        print(e)
-        on_exit(0, 0)
+    frame = composite_hud(battery, is_charging)
+    __HUD_FRAME_CACHE__[key] = frame
+
+    while len(__HUD_FRAME_CACHE__) > max(1, CONFIG.HUD_CACHE_SIZE):
+        _, evicted = __HUD_FRAME_CACHE__.popitem(last=False)
+        # and the copies of it scaled for a display
+        prefix = evicted.key + "@"
+        scaled = [__SCALED_IMAGES__.pop(key) for key in list(__SCALED_IMAGES__) if key.startswith(prefix)]
+        if __RENDERER__ is not None:
+            for image in [evicted] + scaled:
+                __RENDERER__.unload(image)
+
+    return frame
+
+
+def composite_hud(battery, is_charging):
+    """ Composite all the hud sprites for a state into one RGBA Image
+    """
+    layout = sorted(hud_layout(battery, is_charging), key=lambda sprite: sprite[2])
 
+    sprites = [(__ATLAS__.sprites[name], x, y) for _, name, _, x, y in layout]
+    width = max(-x for _, x, _ in sprites)
+    height = max(y + sprite.height for sprite, _, y in sprites)
 
-def __hide_notification(draw_id, display_time):
-    """ Remove the notification at draw_id after the time specified by
-        display_time has passed.
+    rgba = bytearray(width * height * 4)
+    for sprite, x, y in sprites:
+        pngcodec.blit(rgba, width, height, __ATLAS__.pixels(sprite.name), sprite.width, sprite.height, width + x, y)
+
+    name = "hud-%d%s" % (battery, "-charging" if is_charging else "")
+    return Image(name, width, height, bytes(rgba))
+
+
+def sprite_image(name):
+    """ An atlas sprite as an Image the renderers can draw
+    """
+    width, height = __ATLAS__.size(name)
+    return Image("sprite-" + name[:-len(".png")], width, height, __ATLAS__.pixels(name))
+
+
+def draw_notification(fname, draw_id, display_time):
+    """ Draws the specified picture (a sprite name or an Image) in the center
+        of the screen and hides it again after display_time seconds.
     """
-    time.sleep(display_time)
-    if draw_id in __NOTIFICATION_PROCESSES__:
-        __NOTIFICATION_PROCESSES__[draw_id].kill()
+    renderer().draw(
+        draw_id,
+        fname if isinstance(fname, Image) else sprite_image(fname),
+        display=CONFIG.DISPLAY_ID,
+        layer=CONFIG.LAYER_NOTIFICATION
+    )
+    renderer().commit()
+
+    # re-showing a notification restarts its timer
+    if draw_id in __NOTIFICATION_TIMERS__:
+        __NOTIFICATION_TIMERS__[draw_id].cancel()
+    __NOTIFICATION_TIMERS__[draw_id] = __LOOP__.call_later(display_time, __hide_notification, draw_id)
+
+
+def __hide_notification(draw_id):
+    """ Remove the notification at draw_id. Scheduled by draw_notification
+        to run once the notification's display time has passed.
+    """
+    __NOTIFICATION_TIMERS__.pop(draw_id, None)
+    sprite = renderer().sprites.get(draw_id)
+    renderer().remove(draw_id)
+    renderer().commit()
+
+    # images loaded from files for the control socket are not shown again
+    if sprite is not None and isinstance(sprite[0], Image) and sprite[0].key.startswith("file-"):
+        renderer().unload(sprite[0])
 
 
 # -----------------------------------------------------------------------------
 # Sound functions
 # -----------------------------------------------------------------------------
-def play_sound(fname):
-    """ Play a sound.
+SOUNDS = {
+    "low_battery": "low_battery.mp3",
+    "shutdown": "shutdown.mp3",
+}
+
+
+def audio_setup():
+    """ Start the audio backend and decode all the sounds in the background.
+    """
+    global __AUDIO__
+    if CONFIG.AUDIO_BACKEND == "SIM":
+        import simulation
+        __AUDIO__ = simulation.SimulatedAudio()
+    else:
+        __AUDIO__ = audio.open_player(CONFIG.AUDIO_BACKEND, CONFIG.AUDIO_DEVICE)
+
+    # decoding runs ffmpeg/mpg123, keep it off the event loop. Sounds
+    # requested before they are decoded are skipped.
+    __LOOP__.run_in_executor(None, __AUDIO__.preload,
+        {name: os.path.join(CONFIG.SOUND_PATH, fname) for name, fname in SOUNDS.items()}, CONFIG.AUDIO_VOLUME_DB)
+
+
+@metrics.timed("play_sound")
+def play_sound(name, priority=0):
+    """ Queue a sound from SOUNDS. Never blocks.
     """
-    subprocess.run(["omxplayer", "--no-keys", "-o", "alsa", "--vol", "-1000", os.path.join(CONFIG["SOUND_PATH"], fname)],
-        stdout=subprocess.DEVNULL)
+    if __AUDIO__ is not None:
+        __AUDIO__.play(name, priority)
 
 
 # -----------------------------------------------------------------------------
@@ -388,44 +1413,183 @@ def fuel_gauge_command(func):
         "bash",
         "-c",
         "'.",
-        CONFIG["FUEL_GAUGE_SCRIPT_PATH"] + "bq27441_lib.sh",
-        str(CONFIG["FUEL_GAUGE_I2C_BUS_ID"]),
-        str(CONFIG["FUEL_GAUGE_I2C_DEVICE_ID"]),
+        CONFIG.FUEL_GAUGE_SCRIPT_PATH + "bq27441_lib.sh",
+        str(CONFIG.FUEL_GAUGE_I2C_BUS_ID),
+        str(CONFIG.FUEL_GAUGE_I2C_DEVICE_ID),
         ";",
         func,
         "'"
     ])
 
 
+def fuel_gauge():
+    """ Return the fuel gauge driver, opening the i2c bus on first use. The
+        bus file descriptor stays open for the lifetime of the daemon.
+    """
+    global __FUEL_GAUGE__
+    if __FUEL_GAUGE__ is None:
+        if CONFIG.FUEL_GAUGE_BACKEND == "SIM":
+            import simulation
+            __FUEL_GAUGE__ = simulation.simulated_fuel_gauge(address=CONFIG.FUEL_GAUGE_I2C_DEVICE_ID)
+        else:
+            __FUEL_GAUGE__ = bq27441.open_fuel_gauge(CONFIG.FUEL_GAUGE_I2C_BUS_ID, CONFIG.FUEL_GAUGE_I2C_DEVICE_ID)
+    return __FUEL_GAUGE__
+
+
+@metrics.timed("read_fuel_gauge")
+def read_fuel_gauge():
+    """ Read all the runtime fuel gauge registers in one go and return a
+        bq27441.FuelGaugeSnapshot.
+    """
+    global __FUEL_GAUGE__
+    if CONFIG.FUEL_GAUGE_BACKEND == "SCRIPT":
+        return __script_snapshot()
+
+    try:
+        return fuel_gauge().snapshot()
+    except OSError as e:
+        # drop the handle so that the next read re-opens the bus
+        if __FUEL_GAUGE__ is not None:
+            __FUEL_GAUGE__.close()
+            __FUEL_GAUGE__ = None
+        raise ValueError("fuel gauge read failed: %s" % e)
+
+
+@metrics.timed("get_state_of_charge")
 def get_state_of_charge():
-    """ Call the bq27441 library to get the state of charge. This will
-        return a string containing a base ten integer value between 0
-        and 100 representing a percentage of max battery charge capacity.
+    """ Get the state of charge from the fuel gauge. This will return an
+        integer value between 0 and 100 representing a percentage of max
+        battery charge capacity.
+    """
+    return read_fuel_gauge().state_of_charge
+
+
+@metrics.timed("is_discharging")
+def is_discharging():
+    """ Get whether or not the device is discharging battery. This will be
+        True if the battery power is being used or False if the wall power
+        is plugged in.
     """
-    result = subprocess.run(fuel_gauge_command("get_battery_percentage"), capture_output=True, shell=True)
+    return read_fuel_gauge().is_discharging
+
+
+def __script_snapshot():
+    """ Call the bq27441 library once to read all the runtime registers.
+    """
+    result = subprocess.run(fuel_gauge_command("snapshot json"), capture_output=True, shell=True)
     try:
-        soc = int(result.stdout.decode('utf-8'))
-    except ValueError as e:
+        return bq27441.FuelGaugeSnapshot(**json.loads(result.stdout.decode('utf-8')))
+    except (ValueError, TypeError) as e:
         print(result)
-        raise ValueError(e)
-    return soc
+        raise ValueError("fuel gauge script failed: %s" % e)
 
 
-def is_discharging():
-    """ Call the bq27441 library to get whether or not the device is discharging
-        battery. This will be True if the battery power is being used or False
-        if the wall power is plugged in.
+def record_telemetry(gauge):
+    """ Add a fuel gauge snapshot to the telemetry history and the on-disk
+        battery log, and publish it to the shared memory status segment
     """
-    result = subprocess.run(fuel_gauge_command("is_discharging"), capture_output=True, shell=True)
-    return result.stdout.decode('utf-8').strip() == "True"
+    if __TELEMETRY__ is None:
+        return
+
+    sample = __TELEMETRY__.append(time.time(), gauge)
+    if __BATTERY_LOG__ is not None:
+        try:
+            __BATTERY_LOG__.append(sample)
+        except OSError as e:
+            print("WARNING: could not write battery log: %s" % e)
 
+    if __STATUS_SHM__ is not None:
+        publish_status(gauge, sample.timestamp)
 
-def charge_to_img_path(charge, is_charging = False):
-    """ Given a percentage of remaining battery life, return the corresponding
-        image file.
+
+def publish_status(gauge, timestamp):
+    """ Write a fuel gauge reading to the shared memory status segment
+    """
+    time_to_empty, time_to_full = battery_estimate()
+    __STATUS_SHM__.publish(gauge, timestamp, not gauge.is_discharging, __IS_VISIBLE__,
+        time_to_empty, time_to_full)
+
+
+def last_reading():
+    """ The newest telemetry sample as a bq27441.FuelGaugeSnapshot, or None
+    """
+    sample = __TELEMETRY__.latest() if __TELEMETRY__ is not None else None
+    if sample is None:
+        return None
+    return bq27441.FuelGaugeSnapshot(**{field: getattr(sample, field) for field in bq27441.FuelGaugeSnapshot._fields})
+
+
+def telemetry_interval():
+    """ Seconds from the latest fuel gauge reading to the next background
+        sample, see TELEMETRY_SAMPLE_INTERVAL
     """
-    battery_image_path = CONFIG["IMAGE_PATH"] + "battery"
+    sample = __TELEMETRY__.latest() if __TELEMETRY__ is not None else None
+    if sample is None:
+        return CONFIG.TELEMETRY_SAMPLE_INTERVAL
+    idle = max(CONFIG.TELEMETRY_IDLE_INTERVAL, CONFIG.TELEMETRY_SAMPLE_INTERVAL)
+    if not sample.flags & bq27441.FLAG_DSG:
+        return idle
+
+    # the policy is only as quick as its samples near the thresholds
+    margin = CONFIG.TELEMETRY_FAST_MARGIN
+    time_left = __POLICY__.time_left if __POLICY__ is not None else None
+    if (__POLICY__ is not None and __POLICY__.state != policy.NORMAL) or \
+            sample.state_of_charge <= CONFIG.LOW_BATTERY_THRESHOLD + margin or \
+            (time_left is not None and time_left <= (CONFIG.LOW_BATTERY_MINUTES + margin) * 60):
+        return min(CONFIG.TELEMETRY_FAST_INTERVAL, CONFIG.TELEMETRY_SAMPLE_INTERVAL)
+
+    # idle if the charge has not moved since before the stable window
+    since = sample.timestamp - CONFIG.TELEMETRY_STABLE_WINDOW
+    for index in range(len(__TELEMETRY__) - 2, -1, -1):
+        previous = __TELEMETRY__[index]
+        if previous.state_of_charge != sample.state_of_charge:
+            break
+        if previous.timestamp <= since:
+            return idle
+    return CONFIG.TELEMETRY_SAMPLE_INTERVAL
+
+
+def schedule_telemetry_sample():
+    """ (Re)start the background sample timer. Every fuel gauge read, also the
+        ones for GPOUT interrupts, pushes the next background sample back, so
+        the daemon only wakes up when there has been no reading for
+        telemetry_interval() seconds.
+    """
+    global __TELEMETRY_TIMER__
+    if __TELEMETRY_TIMER__ is not None:
+        __TELEMETRY_TIMER__.cancel()
+        __TELEMETRY_TIMER__ = None
+    if CONFIG.TELEMETRY_SAMPLE_INTERVAL > 0 and __LOOP__ is not None:
+        __TELEMETRY_TIMER__ = __LOOP__.call_later(telemetry_interval(), __sample_telemetry)
+
+
+def __sample_telemetry():
+    """ helper for schedule_telemetry_sample. Sample the fuel gauge so there is
+        battery history between GPOUT interrupts.
+    """
+    global __TELEMETRY_TIMER__
+    __TELEMETRY_TIMER__ = None
+    try:
+        record_telemetry(read_fuel_gauge())
+        check_battery_state()
+    except ValueError as e:
+        print(e)
+    schedule_telemetry_sample()
 
+
+def battery_estimate():
+    """ Returns (time_to_empty, time_to_full) in seconds estimated from the
+        telemetry history. Either one may be None, see telemetry.estimate.
+    """
+    if __TELEMETRY__ is None:
+        return None, None
+    return telemetry.estimate(__TELEMETRY__, CONFIG.TELEMETRY_TREND_WINDOW)
+
+
+def charge_to_sprite(charge, is_charging = False):
+    """ Given a percentage of remaining battery life, return the name of the
+        corresponding battery sprite.
+    """
     if charge > 95:
         charge_suffix = "100" 
     elif charge > 90:
@@ -443,69 +1607,188 @@ def charge_to_img_path(charge, is_charging = False):
     charge_suffix += "p"
 
     charging_suffix = "charging" if is_charging else ""
-    battery_image_path = battery_image_path + charge_suffix + charging_suffix + ".png"
-    return battery_image_path
+    return "battery" + charge_suffix + charging_suffix + ".png"
+
+
+# -----------------------------------------------------------------------------
+# Assets
+# -----------------------------------------------------------------------------
+NOTIFICATION_SPRITES = ["low_battery_warning.png", "critical_battery.png", "snapshot_notification.png"]
+
+
+def required_sprites():
+    """ Every sprite the hud and the notifications can ask for
+    """
+    sprites = set(NOTIFICATION_SPRITES)
+    sprites.update(["backdrop.png", "percent.png"])
+    sprites.update("num%d.png" % digit for digit in range(10))
+    sprites.update(charge_to_sprite(charge, charging) for charge in range(101) for charging in (False, True))
+    return sprites
+
+
+def assets_setup():
+    """ Load and validate all the sprites into the atlas. Exits with a report
+        of every missing or broken sprite instead of failing mid draw later.
+    """
+    global __ATLAS__
+    import atlas
+    try:
+        __ATLAS__ = atlas.build(CONFIG.IMAGE_PATH, required_sprites())
+    except atlas.AssetError as e:
+        print(e.report())
+        sys.exit(1)
 
 
 # -----------------------------------------------------------------------------
 # GPIO interrupt handling
 # -----------------------------------------------------------------------------
+def backend_setup():
+    """ Load the GPIO and audio backends selected in the config. RPi.GPIO is
+        only imported here so the daemon can be loaded off device.
+    """
+    global GPIO
+    if CONFIG.GPIO_BACKEND == "SIM":
+        import simulation
+        GPIO = simulation.SimulatedGPIO()
+    else:
+        import RPi.GPIO
+        GPIO = RPi.GPIO
+
+    audio_setup()
+
+
 def gpio_setup():
     """ Setup for all GPIO pins
     """
     GPIO.setmode(GPIO.BOARD)
-    GPIO.setup(CONFIG["BATTERY_GPOUT_PIN"], GPIO.IN)
-    GPIO.setup(CONFIG["BATTERY_POWER_PIN"], GPIO.IN)
+    GPIO.setup(CONFIG.BATTERY_GPOUT_PIN, GPIO.IN)
+    GPIO.setup(CONFIG.BATTERY_POWER_PIN, GPIO.IN)
 
-    GPIO.add_event_detect(CONFIG["BATTERY_GPOUT_PIN"], GPIO.FALLING, callback=handle_battery_charge_state_change)
-    GPIO.add_event_detect(CONFIG["BATTERY_POWER_PIN"], GPIO.BOTH, callback=handle_power_button_press)
+    GPIO.add_event_detect(CONFIG.BATTERY_GPOUT_PIN, GPIO.FALLING, callback=gpio_event)
+    GPIO.add_event_detect(CONFIG.BATTERY_POWER_PIN, GPIO.BOTH, callback=gpio_event)
 
 
-def handle_battery_charge_state_change(channel):
-    """ Update the status overlay with new battery life percentage
-        information.
+def gpio_event(channel):
+    """ RPi.GPIO edge callback. This runs on an RPi.GPIO thread, so it must
+        not touch any state. It only hands the edge over to the event loop.
     """
-    global __PREVIOUS_STATE_OF_CHARGE__
+    __LOOP__.call_soon_threadsafe(__EVENTS__.put_nowait, (channel, time.monotonic()))
 
-    charge = get_state_of_charge()
-    is_not_charging = is_discharging()
-    draw_hud(battery=charge, is_charging=(not is_not_charging))
 
-    if is_not_charging and charge <= CONFIG["LOW_BATTERY_THRESHOLD"] and __PREVIOUS_STATE_OF_CHARGE__ > CONFIG["LOW_BATTERY_THRESHOLD"]:
-        draw_notification("low_battery_warning.png", "low_battery", CONFIG["LOW_BATTERY_NOTIFICATION_DURATION"])
-        play_sound("low_battery.mp3")
+async def dispatch_events():
+    """ Handle GPIO edges, one at a time, on the event loop.
+    """
+    while True:
+        channel, _ = await __EVENTS__.get()
+        try:
+            if channel == CONFIG.BATTERY_GPOUT_PIN:
+                handle_battery_charge_state_change(channel)
+            elif channel == CONFIG.BATTERY_POWER_PIN:
+                handle_power_button_press(channel)
+        except Exception:
+            traceback.print_exc()
 
-    if is_not_charging and charge <= CONFIG["CRITICAL_BATTERY_THRESHOLD"] and __PREVIOUS_STATE_OF_CHARGE__ > CONFIG["CRITICAL_BATTERY_THRESHOLD"]:
-        __SHUTDOWN_LOCK__.release()
 
-    __PREVIOUS_STATE_OF_CHARGE__ = charge
+def handle_battery_charge_state_change(channel):
+    """ Update the status overlay with new battery life percentage
+        information. The fuel gauge is read when the (coalesced) redraw
+        runs, see request_redraw.
+    """
+    request_redraw()
 
 
+def policy_settings():
+    """ BatteryPolicy settings from the config
+    """
+    return dict(
+        low_minutes=CONFIG.LOW_BATTERY_MINUTES,
+        critical_minutes=CONFIG.CRITICAL_BATTERY_MINUTES,
+        low_percent=CONFIG.LOW_BATTERY_THRESHOLD,
+        critical_percent=CONFIG.CRITICAL_BATTERY_THRESHOLD,
+        hysteresis_minutes=CONFIG.BATTERY_WARNING_HYSTERESIS,
+        smoothing=CONFIG.CURRENT_SMOOTHING_WINDOW,
+        safety_margin=CONFIG.SHUTDOWN_SAFETY_MARGIN,
+        window=CONFIG.TELEMETRY_TREND_WINDOW
+    )
+
+
+def check_battery_state():
+    """ Run the battery policy on the newest telemetry sample. Warns about
+        low battery and schedules the shutdown once the battery is critical,
+        or cancels it when the charger is plugged in.
+    """
+    global __SHUTDOWN_TIMER__
+    if __POLICY__ is None or __TELEMETRY__ is None:
+        return
+
+    for action in __POLICY__.update(__TELEMETRY__):
+        if action.kind == "low":
+            draw_notification("low_battery_warning.png", "low_battery", CONFIG.LOW_BATTERY_NOTIFICATION_DURATION)
+            play_sound("low_battery", audio.PRIORITY_LOW_BATTERY)
+        elif action.kind == "critical":
+            draw_notification("critical_battery.png", "crit_battery", CONFIG.CRITICAL_BATTERY_NOTIFICATION_DURATION)
+        elif action.kind == "shutdown":
+            if __SHUTDOWN_TIMER__ is not None:
+                __SHUTDOWN_TIMER__.cancel()
+            delay = max(0, action.value - time.time())
+            print("Battery critical, shutting down in %d seconds" % delay)
+            __SHUTDOWN_TIMER__ = __LOOP__.call_later(delay, stop, "shutdown")
+        elif action.kind == "cancel" and __SHUTDOWN_TIMER__ is not None:
+            __SHUTDOWN_TIMER__.cancel()
+            __SHUTDOWN_TIMER__ = None
+            print("Charger connected, shutdown cancelled")
+
+
+@metrics.timed("handle_power_button_press")
 def handle_power_button_press(channel):
     """ Handle event where user presses down the power button.
-        Momentary press should toggle status overlay visibility while a press
-        longer than 2 seconds should open status overlay menu and capture
+        Momentary press toggles status overlay visibility (or closes the
+        menu), a press of half a second takes a screenshot and a press longer
+        than MENU_HOLD_DURATION opens the status menu, which captures
         controller input. Presses longer than 6.6 seconds will turn off the
         device in hardware.
+
+        The button is debounced by waiting for the line to settle; edges that
+        arrive while waiting restart the wait instead of stacking up.
+    """
+    global __POWER_BUTTON_DEBOUNCE__
+    if __POWER_BUTTON_DEBOUNCE__ is not None:
+        __POWER_BUTTON_DEBOUNCE__.cancel()
+    __POWER_BUTTON_DEBOUNCE__ = __LOOP__.call_later(0.075, __power_button_settled)
+
+
+@metrics.timed("power_button_settled")
+def __power_button_settled():
+    """ helper for handle_power_button_press. Runs once the power button
+        line has been stable for the debounce time.
     """
-    global __LAST_POWER_BUTTON_PRESSED_TIME__
-    time.sleep(0.075) # debounce
+    global __LAST_POWER_BUTTON_PRESSED_TIME__, __POWER_BUTTON_DEBOUNCE__
+    __POWER_BUTTON_DEBOUNCE__ = None
 
-    if GPIO.input(CONFIG["BATTERY_POWER_PIN"]):
+    if GPIO.input(CONFIG.BATTERY_POWER_PIN):
         # input is high, button was released
+        if __LAST_POWER_BUTTON_PRESSED_TIME__ is None:
+            # press and release were both inside one debounce window
+            return
+
         release_time = datetime.datetime.now()
-        if release_time - __LAST_POWER_BUTTON_PRESSED_TIME__ < datetime.timedelta(0, 0, 0, 500):
+        press_time = __LAST_POWER_BUTTON_PRESSED_TIME__
+        __LAST_POWER_BUTTON_PRESSED_TIME__ = None
+
+        if release_time - press_time < datetime.timedelta(0, 0, 0, 500):
             # short press has happened
-            if CONFIG["POWER_SWITCH_BEHAVIOR"] == "FLASH" or CONFIG["POWER_SWITCH_BEHAVIOR"] == "FLASH_INITIAL_ON":
+            if __MENU__ is not None:
+                close_menu()
+            elif CONFIG.POWER_SWITCH_BEHAVIOR == "FLASH" or CONFIG.POWER_SWITCH_BEHAVIOR == "FLASH_INITIAL_ON":
                 flash_behavior()
             else:
                 toggle_behavior()
+        elif release_time - press_time >= datetime.timedelta(seconds=CONFIG.MENU_HOLD_DURATION):
+            # held long enough for the menu
+            toggle_menu()
         else:
             # long press has happened
-            screenshot_call = "raspi2png -c 9 -p " + CONFIG["SCREENSHOT_PATH"] + "/snapshot-" + \
-                datetime.datetime.now().strftime("%m%d%Y-%H%M%S") + ".png"
-            subprocess.Popen(screenshot_call, shell=True)
-            draw_notification("snapshot_notification.png", "snapshot", 3)
+            take_screenshot()
     else:
         # input was low, button was pressed
         __LAST_POWER_BUTTON_PRESSED_TIME__ = datetime.datetime.now()
@@ -514,90 +1797,1060 @@ def handle_power_button_press(channel):
 def toggle_behavior():
     """ Toggle the hud visibility on short press of power button
     """
-    set_visibility(not CONFIG["IS_VISIBLE"])
+    set_visibility(not __IS_VISIBLE__)
 
 
-def flash_behavior():
+def flash_behavior(duration=None):
     """ Make the hud visible for a short time on short press of power button
     """
-    if CONFIG["IS_VISIBLE"]:
+    global __FLASH_TIMER__
+    if __IS_VISIBLE__:
         return
 
     set_visibility(True)
-    helper = threading.Thread(target=__flash_helper, args=(CONFIG["POWER_SWITCH_FLASH_DURATION"],), daemon=True)
-    helper.start()
+    if duration is None:
+        duration = CONFIG.POWER_SWITCH_FLASH_DURATION
+    __FLASH_TIMER__ = __LOOP__.call_later(duration, __end_flash)
 
 
-def __flash_helper(wakeup_time):
-    """ helper for flash behavior. Need to wakeup at specified time and hide hud
+def __end_flash():
+    """ helper for flash_behavior
     """
-    time.sleep(wakeup_time)
+    global __FLASH_TIMER__
+    __FLASH_TIMER__ = None
     set_visibility(False)
 
 
+# -----------------------------------------------------------------------------
+# Menu & controller input
+# -----------------------------------------------------------------------------
+MENU_COLORS = {
+    # style: (background, text)
+    "title": ((0x30, 0x30, 0x30, 0xE8), (0xFF, 0xFF, 0xFF, 0xFF)),
+    "item": ((0x00, 0x00, 0x00, 0xC8), (0xC0, 0xC0, 0xC0, 0xFF)),
+    "selected": ((0xE0, 0xE0, 0xE0, 0xF0), (0x00, 0x00, 0x00, 0xFF)),
+}
+
+
+def backlight_device():
+    """ The display backlight (BACKLIGHT_PATH), or None if there is none
+    """
+    global __BACKLIGHT__
+    if __BACKLIGHT__ is None:
+        __BACKLIGHT__ = False
+        path = CONFIG.BACKLIGHT_PATH or backlight.find()
+        if path:
+            try:
+                __BACKLIGHT__ = backlight.Backlight(path)
+            except (OSError, ValueError) as e:
+                print("WARNING: no brightness setting, could not read backlight %s: %s" % (path, e))
+    return __BACKLIGHT__ or None
+
+
+def menu_items():
+    """ The items of the status menu, showing the current settings
+    """
+    minutes = lambda value: "%g MIN" % value
+    items = []
+    if backlight_device() is not None:
+        try:
+            items.append(menu.Setting("BRIGHTNESS", "BRIGHTNESS", range(10, 101, 10), backlight_device().get(),
+                lambda value: "%d%%" % value))
+        except (OSError, ValueError) as e:
+            print("WARNING: could not read the brightness: %s" % e)
+
+    items += [
+        menu.Setting("IS_VISIBLE", "BATTERY HUD", [True, False], __IS_VISIBLE__, lambda value: "ON" if value else "OFF"),
+        menu.Setting("HUD_RENDERING", "HUD MODE", CONFIG_CHOICES["HUD_RENDERING"], CONFIG.HUD_RENDERING),
+        menu.Setting("LOW_BATTERY_MINUTES", "LOW WARNING", range(0, 61, 5), CONFIG.LOW_BATTERY_MINUTES, minutes),
+        menu.Setting("CRITICAL_BATTERY_MINUTES", "CRITICAL", range(0, 16), CONFIG.CRITICAL_BATTERY_MINUTES, minutes),
+        menu.Action("screenshot", "SCREENSHOT"),
+        menu.Action("shutdown", "SHUT DOWN"),
+        menu.Action("close", "CLOSE"),
+    ]
+    return items
+
+
+def menu_title():
+    gauge = last_reading()
+    if gauge is None:
+        return "STATUS"
+    return "BATTERY %d%%%s" % (gauge.state_of_charge, "" if gauge.is_discharging else " CHARGING")
+
+
+def toggle_menu():
+    if __MENU__ is None:
+        open_menu()
+    else:
+        close_menu()
+
+
+def open_menu():
+    """ Show the status menu and start reading the controller
+    """
+    global __MENU__
+    if __MENU__ is not None:
+        return
+
+    __MENU__ = menu.Menu(menu_title(), menu_items())
+    __MENU_CHANGES__.clear()
+    input_setup()
+    restart_menu_timer()
+    draw_menu()
+
+
+def close_menu(wait=False):
+    """ Hide the menu, let go of the controller and save the settings that
+        were changed in the menu
+    """
+    global __MENU__, __MENU_TIMER__
+    if __MENU__ is None:
+        return
+    __MENU__ = None
+    if __MENU_TIMER__ is not None:
+        __MENU_TIMER__.cancel()
+        __MENU_TIMER__ = None
+    input_close()
+
+    renderer().draw_group("menu", {})
+    renderer().commit(wait)
+    for image in __MENU_IMAGES__.values():
+        renderer().unload(image)
+    __MENU_IMAGES__.clear()
+
+    settings = {key: value for key, value in __MENU_CHANGES__.items() if getattr(CONFIG, key) != value}
+    __MENU_CHANGES__.clear()
+    if settings:
+        save_menu_settings(settings)
+
+
+def save_menu_settings(settings):
+    """ Write settings to the config file and apply them
+    """
+    if not write_config_file(CONFIG.CONFIG_FILE_PATH, settings):
+        return
+    try:
+        reload_config()
+    except ConfigError as e:
+        print("WARNING: menu settings not applied. %s" % e)
+
+
+def restart_menu_timer():
+    global __MENU_TIMER__
+    if __MENU_TIMER__ is not None:
+        __MENU_TIMER__.cancel()
+    __MENU_TIMER__ = __LOOP__.call_later(CONFIG.MENU_TIMEOUT, close_menu)
+
+
+@metrics.timed("menu_input")
+def menu_input(action, timestamp=None):
+    """ Apply a menu action (see gamepad.ACTIONS). timestamp is the
+        time.monotonic() time of the controller event the action came from;
+        the menu is then redrawn right away and the latency until it is on
+        screen is recorded.
+    """
+    if __MENU__ is None:
+        return
+    restart_menu_timer()
+
+    result = __MENU__.handle(action)
+    if result is None:
+        return
+
+    kind, item = result
+    wait = timestamp is not None
+    if kind == menu.CHANGED:
+        apply_menu_setting(item)
+    elif kind == menu.ACTIVATED:
+        run_menu_action(item.key)
+    elif kind == menu.CLOSED:
+        close_menu(wait)
+
+    if __MENU__ is not None:
+        draw_menu(wait)
+    if timestamp is not None:
+        latency = time.monotonic() - timestamp
+        metrics.INPUT_LATENCY.observe(latency, stage="display")
+        __INPUT_LATENCIES__.append(latency)
+
+
+def apply_menu_setting(setting):
+    """ Brightness and hud visibility apply right away, config settings are
+        saved when the menu closes
+    """
+    if setting.key == "BRIGHTNESS":
+        try:
+            backlight_device().set(setting.value)
+        except OSError as e:
+            print("WARNING: could not set the brightness: %s" % e)
+    elif setting.key == "IS_VISIBLE":
+        set_visibility(setting.value)
+    else:
+        __MENU_CHANGES__[setting.key] = setting.value
+
+
+def run_menu_action(key):
+    if key == "screenshot":
+        # make sure the menu is off the screen before capturing it
+        close_menu(wait=True)
+        take_screenshot()
+    elif key == "shutdown":
+        close_menu()
+        stop("shutdown")
+    elif key == "close":
+        close_menu()
+
+
+@metrics.timed("draw_menu")
+def draw_menu(wait=False):
+    """ Draw the open menu in the center of DISPLAY_ID. Every row is its own
+        sprite, so moving the selection replaces two sprites and changing a
+        value one.
+    """
+    scale = CONFIG.MENU_SCALE
+    padding = 3 * scale
+    row_height = font.HEIGHT * scale + 2 * padding
+    width = font.text_size("M" * __MENU__.columns(), scale)[0] + 2 * padding
+
+    rows = [(__MENU__.title, "", "title")]
+    rows += [(label, value, "selected" if selected else "item") for label, value, selected in __MENU__.rows()]
+
+    try:
+        resolution = screen_resolution(CONFIG.DISPLAY_ID)
+    except ChildProcessError as e:
+        print(e)
+        return
+    x, y = layout.place(layout.Placement(CONFIG.DISPLAY_ID, "center", (0, 0), 1), resolution,
+        width, row_height * len(rows))
+
+    renderer().draw_group("menu", {
+        "menu-row%d" % index: scene.Node(menu_row_image(row, width, row_height), CONFIG.DISPLAY_ID,
+            CONFIG.LAYER_MENU, x, y + index * row_height)
+        for index, row in enumerate(rows)
+    })
+    renderer().commit(wait)
+
+
+def menu_row_image(row, width, height):
+    """ One row of the menu as an Image, the label on the left and the value
+        on the right. Rows are rendered once while the menu is open.
+    """
+    key = (row, width, height)
+    image = __MENU_IMAGES__.get(key)
+    if image is not None:
+        return image
+
+    label, value, style = row
+    background, color = MENU_COLORS[style]
+    scale = CONFIG.MENU_SCALE
+    padding = (height - font.HEIGHT * scale) // 2
+
+    rgba = bytearray(bytes(background) * (width * height))
+    font.draw(rgba, width, height, label, padding, padding, color, scale)
+    font.draw(rgba, width, height, value, width - padding - font.text_size(value, scale)[0], padding, color, scale)
+
+    image = __MENU_IMAGES__[key] = Image("menu-%d" % len(__MENU_IMAGES__), width, height, bytes(rgba))
+    return image
+
+
+def input_setup():
+    """ Open the controller (INPUT_DEVICE) and read it on the event loop.
+        With MENU_GRAB_INPUT the controller is grabbed, so the game does not
+        act on the menu navigation. Without a controller the menu can still
+        be driven with overlayctl.py.
+    """
+    global __INPUT_DEVICE__, __INPUT_CONTROLS__
+    device = None
+    try:
+        if CONFIG.INPUT_BACKEND == "SIM":
+            import simulation
+            device = simulation.SimulatedGamepad()
+        else:
+            path = CONFIG.INPUT_DEVICE or next((path for path, _ in gamepad.find_gamepads()), None)
+            if path is None:
+                raise OSError("no gamepad found")
+            device = gamepad.Device(path)
+
+        axes = {}
+        for axis in gamepad.DIRECTIONS:
+            try:
+                axes[axis] = device.absinfo(axis)[1:3]
+            except OSError:
+                pass # the device does not have this stick
+        if CONFIG.MENU_GRAB_INPUT:
+            device.grab()
+    except OSError as e:
+        print("WARNING: no controller input for the menu: %s" % e)
+        if device is not None:
+            device.close()
+        return
+
+    __INPUT_DEVICE__ = device
+    __INPUT_CONTROLS__ = gamepad.Controls(CONFIG.MENU_BUTTONS, axes)
+    __LOOP__.add_reader(device.fileno(), __input_event)
+
+
+def __input_event():
+    """ helper for input_setup. Turn the pending controller events into menu
+        actions.
+    """
+    try:
+        events = __INPUT_DEVICE__.read()
+    except OSError as e:
+        print("WARNING: lost the controller: %s" % e)
+        input_close()
+        return
+
+    now = time.monotonic()
+    for event in events:
+        action = __INPUT_CONTROLS__.feed(event)
+        if action is None:
+            continue
+        metrics.INPUT_LATENCY.observe(now - event[0], stage="read")
+        menu_input(action, event[0])
+        if __INPUT_DEVICE__ is None:
+            return # the menu was closed
+
+
+def input_close():
+    """ Stop reading the controller. Closing it also releases the grab.
+    """
+    global __INPUT_DEVICE__, __INPUT_CONTROLS__
+    if __INPUT_DEVICE__ is None:
+        return
+    __LOOP__.remove_reader(__INPUT_DEVICE__.fileno())
+    __INPUT_DEVICE__.close()
+    __INPUT_DEVICE__ = __INPUT_CONTROLS__ = None
+
+
+# -----------------------------------------------------------------------------
+# Screenshots
+# -----------------------------------------------------------------------------
+def screenshot_writer():
+    """ Return the background worker that encodes and writes screenshots
+    """
+    global __SCREENSHOT_WRITER__
+    if __SCREENSHOT_WRITER__ is None:
+        import screenshot
+        __SCREENSHOT_WRITER__ = screenshot.ScreenshotWriter(CONFIG.SCREENSHOT_BACKLOG)
+    return __SCREENSHOT_WRITER__
+
+
+def capture_screen():
+    """ Returns (width, height, rgb) of the screen
+    """
+    import screenshot
+    if CONFIG.RENDERER == "SIM":
+        width, height = CONFIG.SIM_RESOLUTION
+        return width, height, bytes(width * height * 3)
+    return screenshot.capture(CONFIG.DISPLAY_ID)
+
+
+def take_screenshot():
+    """ Capture the screen into memory and queue it for encoding, then show
+        the snapshot notification right away. With SCREENSHOT_BURST > 1 the
+        other frames are captured every SCREENSHOT_BURST_INTERVAL seconds and
+        the notification is shown after the last one, so it is not in any
+        of them.
+    """
+    if __SCREENSHOT_BURST__ is not None:
+        # still capturing the last burst
+        return
+    __capture_frame(0, datetime.datetime.now().strftime("%m%d%Y-%H%M%S"))
+
+
+def __capture_frame(frame, stamp):
+    """ helper for take_screenshot. Capture and queue one frame of a burst.
+    """
+    global __SCREENSHOT_BURST__
+    import screenshot
+    __SCREENSHOT_BURST__ = None
+
+    name = "snapshot-" + stamp
+    if CONFIG.SCREENSHOT_BURST > 1:
+        name += "-%d" % (frame + 1)
+    path = os.path.join(os.path.expanduser(CONFIG.SCREENSHOT_PATH), name)
+
+    try:
+        width, height, rgb = capture_screen()
+    except OSError as e:
+        print("WARNING: in process screen capture failed (%s), using raspi2png" % e)
+        raspi2png_screenshot(path + ".png")
+        return
+
+    if not screenshot_writer().submit(path + screenshot.FORMATS[CONFIG.SCREENSHOT_FORMAT], width, height, rgb,
+            CONFIG.SCREENSHOT_FORMAT, CONFIG.SCREENSHOT_COMPRESSION):
+        print("WARNING: %d screenshots are still being written, dropping %s" % (
+            screenshot_writer().pending(), name))
+    elif frame + 1 < CONFIG.SCREENSHOT_BURST:
+        __SCREENSHOT_BURST__ = __LOOP__.call_later(CONFIG.SCREENSHOT_BURST_INTERVAL, __capture_frame, frame + 1, stamp)
+        return
+
+    draw_notification("snapshot_notification.png", "snapshot", 3)
+
+
+def raspi2png_screenshot(path):
+    """ Fallback for when DispmanX can not be used in process
+    """
+    screenshot_call = "raspi2png -c %d -p %s" % (CONFIG.SCREENSHOT_COMPRESSION, path)
+    try:
+        child_supervisor().spawn("raspi2png", screenshot_call, timeout=CONFIG.SCREENSHOT_TIMEOUT, shell=True)
+    except supervisor.ChildLimitError as e:
+        print("WARNING: %s" % e)
+        return
+    draw_notification("snapshot_notification.png", "snapshot", 3)
+
+
+# -----------------------------------------------------------------------------
+# Control socket
+# -----------------------------------------------------------------------------
+
+
+async def control_setup():
+    """ Listen on CONTROL_SOCKET_PATH. See overlayctl.py for the protocol.
+    """
+    global __CONTROL_SERVER__
+    path = CONFIG.CONTROL_SOCKET_PATH
+    if not path:
+        return
+
+    try:
+        os.unlink(path)
+    except FileNotFoundError:
+        pass
+
+    try:
+        __CONTROL_SERVER__ = await asyncio.start_unix_server(control_client, path)
+        os.chmod(path, 0o660)
+    except OSError as e:
+        print("WARNING: could not open control socket %s: %s" % (path, e))
+
+
+async def control_client(reader, writer):
+    """ Serve one control connection. Each line is a JSON command, or a JSON
+        list of commands that are run together; the reply is one JSON line
+        with a result (or a list of results) per command.
+    """
+    try:
+        while True:
+            line = await reader.readline()
+            if not line:
+                break
+
+            try:
+                message = json.loads(line)
+            except (ValueError, RecursionError) as e:
+                response = {"ok": False, "error": "invalid JSON: %s" % e}
+            else:
+                if isinstance(message, list):
+                    response = [control_command(command) for command in message]
+                else:
+                    response = control_command(message)
+
+            writer.write(json.dumps(response).encode("utf-8") + b"\n")
+            await writer.drain()
+    except (ConnectionError, ValueError):
+        pass
+    finally:
+        writer.close()
+
+
+def control_command(command):
+    """ Run a single control command, returning its result as a dict
+    """
+    try:
+        if not isinstance(command, dict) or command.get("cmd") not in CONTROL_COMMANDS:
+            raise ValueError("unknown command: %s" % json.dumps(command))
+        result = CONTROL_COMMANDS[command["cmd"]](command)
+        result["ok"] = True
+        return result
+    except (ValueError, TypeError, KeyError, OSError) as e:
+        return {"ok": False, "error": str(e)}
+    except Exception as e:
+        # a bug in a command must not take the connection down
+        traceback.print_exc()
+        return {"ok": False, "error": "%s: %s" % (type(e).__name__, e)}
+
+
+def control_duration(command, default):
+    """ The "duration" of a command in seconds. Raises ValueError unless it
+        is a finite number that is not negative.
+    """
+    duration = float(command.get("duration", default))
+    if not math.isfinite(duration) or duration < 0:
+        raise ValueError("duration must be a number of seconds, got %s" % json.dumps(command.get("duration")))
+    return duration
+
+
+def control_set_visibility(command):
+    set_visibility(bool(command["visible"]))
+    return {}
+
+
+def control_flash(command):
+    flash_behavior(control_duration(command, CONFIG.POWER_SWITCH_FLASH_DURATION))
+    return {}
+
+
+def control_notify(command):
+    """ Show a notification. Either "image" names a sprite from the atlas or
+        "path" is a png file, which is decoded once right here.
+    """
+    global __CONTROL_IMAGES__
+    duration = control_duration(command, 3)
+    draw_id = "notify-%s" % command.get("id", "custom")
+
+    if "path" in command:
+        width, height, rgba = pngcodec.read(os.path.expanduser(command["path"]))
+        __CONTROL_IMAGES__ += 1
+        image = Image("file-%d" % __CONTROL_IMAGES__, width, height, bytes(rgba))
+    elif command.get("image") in __ATLAS__:
+        image = sprite_image(command["image"])
+    else:
+        raise ValueError("notify needs a \"path\" or the \"image\" name of a sprite")
+
+    draw_notification(image, draw_id, duration)
+    return {"id": draw_id}
+
+
+def control_query(command):
+    state = {
+        "visible": __IS_VISIBLE__,
+        "notifications": sorted(__NOTIFICATION_TIMERS__.keys()),
+        "renderer": type(renderer()).__name__,
+        "redraws": dict(__REDRAW_STATS__),
+        "children": child_supervisor().table(),
+        "telemetry_interval": telemetry_interval(),
+        "wakeups_per_minute": round(metrics.WAKEUPS.rate(), 1),
+        "menu": {
+            "open": __MENU__ is not None,
+            "controller": None if __INPUT_DEVICE__ is None else __INPUT_DEVICE__.path,
+            "input_latency": input_latency_summary(),
+        },
+        "battery_policy": {
+            "state": __POLICY__.state,
+            "time_left": __POLICY__.time_left,
+            "shutdown_at": __POLICY__.shutdown_at,
+        },
+    }
+
+    sample = __TELEMETRY__.latest() if __TELEMETRY__ is not None else None
+    if sample is not None:
+        time_to_empty, time_to_full = battery_estimate()
+        state.update(
+            state_of_charge=sample.state_of_charge,
+            charging=not (sample.flags & bq27441.FLAG_DSG),
+            voltage=sample.voltage,
+            average_current=sample.average_current,
+            sampled_at=sample.timestamp,
+            time_to_empty=time_to_empty,
+            time_to_full=time_to_full
+        )
+    return state
+
+
+def control_menu(command):
+    """ Open, close or toggle the menu, or navigate it like the controller
+        does (see gamepad.ACTIONS)
+    """
+    action = command.get("action", "toggle")
+    if action == "open":
+        open_menu()
+    elif action == "close":
+        close_menu()
+    elif action == "toggle":
+        toggle_menu()
+    elif action in gamepad.ACTIONS:
+        menu_input(action)
+    else:
+        raise ValueError("unknown menu action: %s" % action)
+    return {"open": __MENU__ is not None}
+
+
+def input_latency_summary():
+    """ Median and worst time in ms from a controller event to the menu
+        being on screen, over the last inputs
+    """
+    if not __INPUT_LATENCIES__:
+        return None
+    latencies = sorted(__INPUT_LATENCIES__)
+    return {
+        "samples": len(latencies),
+        "median_ms": round(latencies[len(latencies) // 2] * 1000, 2),
+        "max_ms": round(latencies[-1] * 1000, 2),
+    }
+
+
+def control_reload_config(command):
+    return reload_config()
+
+
+def control_screenshot(command):
+    take_screenshot()
+    return {}
+
+
+def control_metrics(command):
+    return {"text": metrics.REGISTRY.render()}
+
+
+CONTROL_COMMANDS = {
+    "set_visibility": control_set_visibility,
+    "flash": control_flash,
+    "notify": control_notify,
+    "query": control_query,
+    "menu": control_menu,
+    "reload_config": control_reload_config,
+    "screenshot": control_screenshot,
+    "metrics": control_metrics,
+}
+
+
+# -----------------------------------------------------------------------------
+# Metrics & profiling
+# -----------------------------------------------------------------------------
+def metrics_setup():
+    """ Register the daemon's metrics and start writing them to METRICS_PATH.
+        Function latencies are recorded by the metrics.timed decorators.
+    """
+    registry = metrics.REGISTRY
+    metrics.count_spawns(registry.counter("status_overlay_processes_spawned_total",
+        "Child processes started, by program"))
+    metrics.register_process_metrics(registry, children=child_count)
+    registry.gauge("status_overlay_supervised_processes", "Live helper processes, by program",
+        lambda: {(("program", k),): v for k, v in child_supervisor().counts().items()})
+    registry.counter("status_overlay_processes_reaped_total", "Helper processes that exited and were reaped",
+        lambda: child_supervisor().reaped)
+    registry.counter("status_overlay_processes_timed_out_total", "Helper processes terminated for running too long",
+        lambda: child_supervisor().timed_out)
+    registry.counter("status_overlay_redraws_total", "Redraw requests, by what happened to them",
+        lambda: {(("result", k),): v for k, v in __REDRAW_STATS__.items()})
+    registry.counter("status_overlay_screenshots_total", "Screenshots, by what happened to them",
+        lambda: {} if __SCREENSHOT_WRITER__ is None else {
+            (("result", "written"),): __SCREENSHOT_WRITER__.written,
+            (("result", "dropped"),): __SCREENSHOT_WRITER__.dropped,
+        })
+    registry.counter("status_overlay_sprite_changes_total", "Sprites changed on screen, by kind of change",
+        lambda: {} if __RENDERER__ is None else {(("op", k),): v for k, v in __RENDERER__.changes.items()})
+    registry.gauge("status_overlay_menu_open", "Whether the menu is open (and the controller read)",
+        lambda: int(__MENU__ is not None))
+    registry.gauge("status_overlay_hud_frames_cached", "Composited hud frames in memory",
+        lambda: len(__HUD_FRAME_CACHE__))
+    registry.gauge("status_overlay_battery_state_of_charge", "Last sampled state of charge (%)",
+        lambda: {} if __TELEMETRY__.latest() is None else __TELEMETRY__.latest().state_of_charge)
+
+    metrics_writer_setup()
+
+
+def metrics_writer_setup():
+    """ Start writing METRICS_PATH, if it is set and not written already
+    """
+    global __METRICS_WRITER__
+    if CONFIG.METRICS_PATH and __METRICS_WRITER__ is None:
+        __METRICS_WRITER__ = __LOOP__.create_task(metrics_writer())
+
+
+async def metrics_writer():
+    """ Rewrite METRICS_PATH every METRICS_INTERVAL seconds, but not while the
+        daemon is idle (nothing redrawn, no new battery sample and the menu
+        closed), so the metrics do not cause work of their own. Rendering
+        reads /proc, so it runs off the event loop.
+    """
+    global __METRICS_WRITER__
+    activity = None
+    while CONFIG.METRICS_PATH:
+        if metrics_activity() != activity:
+            activity = metrics_activity()
+            try:
+                await __LOOP__.run_in_executor(None, metrics.REGISTRY.dump, CONFIG.METRICS_PATH)
+            except OSError as e:
+                print("WARNING: could not write metrics: %s" % e)
+        await asyncio.sleep(CONFIG.METRICS_INTERVAL)
+    __METRICS_WRITER__ = None
+
+
+def metrics_activity():
+    """ Changes whenever the daemon did something since the last call
+    """
+    sample = __TELEMETRY__.latest() if __TELEMETRY__ is not None else None
+    return (__REDRAW_STATS__["requested"], sample and sample.timestamp, __MENU__ is not None)
+
+
+def child_count():
+    """ Live child processes: the supervised helpers and the compositor
+    """
+    count = len(child_supervisor().children)
+    if isinstance(__RENDERER__, CompositorRenderer) and __RENDERER__.process.poll() is None:
+        count += 1
+    return count
+
+
+def toggle_profile():
+    """ SIGUSR1 handler. Start profiling the event loop thread for
+        PROFILE_DURATION seconds, or finish early if a profile is running.
+    """
+    global __PROFILER__, __PROFILE_TIMER__
+    if __PROFILER__ is not None and __PROFILER__.running:
+        finish_profile()
+        return
+
+    __PROFILER__ = metrics.Profiler(CONFIG.PROFILE_PATH)
+    __PROFILER__.start()
+    __PROFILE_TIMER__ = __LOOP__.call_later(CONFIG.PROFILE_DURATION, finish_profile)
+    print("Profiling for %g seconds (send SIGUSR1 again to stop early)" % CONFIG.PROFILE_DURATION)
+
+
+def finish_profile():
+    """ Stop the running profile and write it out
+    """
+    global __PROFILE_TIMER__
+    if __PROFILE_TIMER__ is not None:
+        __PROFILE_TIMER__.cancel()
+        __PROFILE_TIMER__ = None
+    if __PROFILER__ is None or not __PROFILER__.running:
+        return
+
+    try:
+        path, summary = __PROFILER__.stop()
+    except OSError as e:
+        print("WARNING: could not write profile: %s" % e)
+        return
+    print("Profile written to %s" % path)
+    print(summary)
+
+
+# -----------------------------------------------------------------------------
+# Startup
+# -----------------------------------------------------------------------------
+STARTUP_CACHE_VERSION = 2
+
+
+def startup_phase(name):
+    """ Mark the end of a startup phase for startup_report
+    """
+    __STARTUP_TIMES__.append((name, time.monotonic()))
+
+
+def process_start_time():
+    """ time.monotonic() at which this process was started (this includes the
+        interpreter startup and imports), or None if it is not known
+    """
+    try:
+        with open("/proc/self/stat", "r") as fhandle:
+            # the command name may contain spaces, fields after it are fixed
+            start_ticks = int(fhandle.read().rsplit(")", 1)[1].split()[19])
+        with open("/proc/uptime", "r") as fhandle:
+            uptime = float(fhandle.read().split()[0])
+    except (OSError, ValueError, IndexError):
+        return None
+    return time.monotonic() - (uptime - start_ticks / os.sysconf("SC_CLK_TCK"))
+
+
+def startup_report():
+    """ Print the time spent in each startup phase if STARTUP_TIMING is set
+    """
+    if not CONFIG.STARTUP_TIMING:
+        return
+
+    start = process_start_time()
+    previous = start if start is not None else __STARTUP_TIMES__[0][1]
+    print("Startup timing (ms):")
+    for name, end in __STARTUP_TIMES__:
+        total = "" if start is None else "%8.1f" % ((end - start) * 1000)
+        print("  %-16s %8.1f %s" % (name, (end - previous) * 1000, total))
+        previous = end
+
+    try:
+        with open("/proc/uptime", "r") as fhandle:
+            print("  live hud %.1f s after boot" % float(fhandle.read().split()[0]))
+    except (OSError, ValueError):
+        pass
+
+
+def startup_cache_signature():
+    """ Everything besides the hud state that the saved hud frame depends on
+    """
+    try:
+        newest = max(entry.stat().st_mtime_ns for entry in os.scandir(CONFIG.IMAGE_PATH))
+    except (OSError, ValueError):
+        newest = 0
+    return [STARTUP_CACHE_VERSION, CONFIG.IMAGE_PATH, newest, CONFIG.DISPLAY_ID, CONFIG.LAYER_DEFAULT]
+
+
+def save_startup_cache():
+    """ Save the hud frame on screen and the display resolution so the next
+        start can show them before anything else is ready.
+    """
+    if not CONFIG.STARTUP_CACHE_PATH or __RENDERER__ is None or __LAST_HUD_STATE__ is None:
+        return
+    if len(__LAST_HUD_STATE__) < 4:
+        return
+
+    # a cache hit unless the hud is drawn as separate sprites
+    soc, charging = __LAST_HUD_STATE__[1:3]
+    if __ATLAS__ is None and (soc, charging) not in __HUD_FRAME_CACHE__:
+        return
+    frame = hud_frame(soc, charging)
+    header = {
+        "signature": startup_cache_signature(),
+        "state": list(__LAST_HUD_STATE__),
+        "key": frame.key,
+        "width": frame.width,
+        "height": frame.height,
+    }
+    path = os.path.expanduser(CONFIG.STARTUP_CACHE_PATH)
+    try:
+        with open(path + ".tmp", "wb") as fhandle:
+            fhandle.write(json.dumps(header).encode("utf-8") + b"\n")
+            fhandle.write(frame.rgba)
+        os.replace(path + ".tmp", path)
+    except OSError as e:
+        print("WARNING: could not save startup cache: %s" % e)
+
+
+def show_cached_hud():
+    """ Draw the hud saved by the last run, if it is still valid. Returns
+        True if it was drawn.
+    """
+    global __LAST_HUD_STATE__
+    if not CONFIG.STARTUP_CACHE_PATH or not __IS_VISIBLE__:
+        return False
+
+    try:
+        with open(os.path.expanduser(CONFIG.STARTUP_CACHE_PATH), "rb") as fhandle:
+            header = json.loads(fhandle.readline())
+            rgba = fhandle.read()
+        _, soc, charging, screens = header["state"]
+        screens = tuple((display_id, tuple(resolution)) for display_id, resolution in screens)
+        frame = Image(header["key"], header["width"], header["height"], rgba)
+    except (OSError, ValueError, KeyError, TypeError):
+        return False
+
+    if header["signature"] != startup_cache_signature() or len(rgba) != frame.width * frame.height * 4:
+        return False
+
+    # the live fuel gauge read replaces this frame if the state changed
+    __HUD_FRAME_CACHE__[(soc, charging)] = frame
+    for display_id, resolution in screens:
+        __RESOLUTION_CACHE__[display_id] = list(resolution)
+    # the sprites are not loaded yet, so the first live redraw has to switch
+    # to them even if the state did not change
+    if CONFIG.HUD_RENDERING == "FRAME":
+        __LAST_HUD_STATE__ = (True, soc, charging, screens)
+    draw_hud(battery=soc, is_charging=charging, composited=True)
+    return True
+
+
+async def verify_screen_resolution():
+    """ The resolutions from the startup cache are only a guess, check them
+        without blocking the event loop.
+    """
+    for display_id, cached in list(__RESOLUTION_CACHE__.items()):
+        try:
+            current = await __LOOP__.run_in_executor(None, query_screen_resolution, display_id)
+        except (ChildProcessError, OSError) as e:
+            print("WARNING: could not verify screen resolution: %s" % e)
+            continue
+        if current != cached:
+            invalidate_screen_resolution()
+            return
+
+
 # -----------------------------------------------------------------------------
 # System utilities
 # -----------------------------------------------------------------------------
 def system_setup():
     """ Add signal handlers for user keyboard interrupt and systemd termination
-        interrupt.
+        interrupt, and SIGUSR1 for profiling. These are delivered through the
+        event loop.
     """
-    global __ORIGINAL_SIGINT__
-    __ORIGINAL_SIGINT__ = signal.getsignal(signal.SIGINT)
-    signal.signal(signal.SIGINT, on_exit)
+    __LOOP__.add_signal_handler(signal.SIGINT, stop, "exit")
+    __LOOP__.add_signal_handler(signal.SIGTERM, stop, "exit")
+    __LOOP__.add_signal_handler(signal.SIGUSR1, toggle_profile)
 
-    signal.signal(signal.SIGTERM, on_exit)
 
+def stop(reason):
+    """ Wake up main() to either exit the daemon ("exit") or shut the device
+        down ("shutdown").
+    """
+    if not __STOP__.done():
+        __STOP__.set_result(reason)
 
-def shutdown():
+
+async def shutdown():
     """ Shut the device down.
     """
-    draw_notification("critical_battery.png", "crit_battery", CONFIG["CRITICAL_BATTERY_NOTIFICATION_DURATION"])
+    draw_notification("critical_battery.png", "crit_battery", CONFIG.CRITICAL_BATTERY_NOTIFICATION_DURATION)
     print("Initiating shutdown in 5 seconds...")
-    play_sound("shutdown.mp3")
-    time.sleep(5)
+    play_sound("shutdown", audio.PRIORITY_SHUTDOWN)
+    await asyncio.gather(
+        __LOOP__.run_in_executor(None, __AUDIO__.wait, CONFIG.SHUTDOWN_SOUND_TIMEOUT),
+        asyncio.sleep(5)
+    )
     on_exit(0, 0, False)
-    subprocess.run("sudo shutdown -h now", shell=True)
+    if CONFIG.SHUTDOWN_COMMAND:
+        subprocess.run(CONFIG.SHUTDOWN_COMMAND, shell=True)
 
 
 def on_exit(signum, frame, perform_exit=True):
     """ Do all the cleaup needed on program exit. It is important that this
         is run every time!
     """
-    # restore the original signal handler as otherwise evil things will happen
-    # in raw_input when CTRL+C is pressed, and our signal handler is not re-entrant
-    signal.signal(signal.SIGINT, __ORIGINAL_SIGINT__)
+    # restore the default signal handlers
+    if __LOOP__ is not None:
+        __LOOP__.remove_signal_handler(signal.SIGINT)
+        __LOOP__.remove_signal_handler(signal.SIGTERM)
+        __LOOP__.remove_signal_handler(signal.SIGUSR1)
 
-    # release all the RPi.GPIO pins
-    GPIO.cleanup()
+    # give the controller back to the game and save the menu settings
+    close_menu()
+
+    # a scheduled low battery shutdown must not fire while exiting
+    if __SHUTDOWN_TIMER__ is not None:
+        __SHUTDOWN_TIMER__.cancel()
+    if __TELEMETRY_TIMER__ is not None:
+        __TELEMETRY_TIMER__.cancel()
 
-    # kill all pngview processes
-    for v in __PNGVIEW_PROCESSES__.values():
-        v.kill()
+    # keep a profile that was still running
+    finish_profile()
 
-    # write to config file (only want to update is_visible)
-    write_config_file(CONFIG["CONFIG_FILE_PATH"], ["IS_VISIBLE"])
+    # release all the RPi.GPIO pins
+    if GPIO is not None:
+        GPIO.cleanup()
+
+    # close the i2c bus
+    if __FUEL_GAUGE__ is not None:
+        __FUEL_GAUGE__.close()
+
+    # write out any buffered battery history
+    if __BATTERY_LOG__ is not None:
+        __BATTERY_LOG__.close()
+
+    # stop watching the config file
+    if __CONFIG_WATCH__ is not None:
+        __LOOP__.remove_reader(__CONFIG_WATCH__.fileno())
+        __CONFIG_WATCH__.close()
+
+    # stop accepting control connections
+    if __CONTROL_SERVER__ is not None:
+        __CONTROL_SERVER__.close()
+        try:
+            os.unlink(CONFIG.CONTROL_SOCKET_PATH)
+        except OSError:
+            pass
+
+    # stale metrics would look like a healthy daemon
+    if CONFIG.METRICS_PATH:
+        try:
+            os.unlink(CONFIG.METRICS_PATH)
+        except OSError:
+            pass
+
+    # tell readers of the status segment that the daemon is gone
+    if __STATUS_SHM__ is not None:
+        __STATUS_SHM__.close()
+
+    # remember what the hud looked like for a fast next start
+    save_startup_cache()
+
+    # stop the audio worker
+    if __AUDIO__ is not None:
+        __AUDIO__.close()
+
+    # remove all sprites and stop the renderer
+    if __RENDERER__ is not None:
+        __RENDERER__.close()
+
+    # finish writing screenshots that have already been taken
+    if __SCREENSHOT_BURST__ is not None:
+        __SCREENSHOT_BURST__.cancel()
+    if __SCREENSHOT_WRITER__ is not None:
+        __SCREENSHOT_WRITER__.close(timeout=10)
+
+    # kill and reap any helper processes that are still running
+    if __SUPERVISOR__ is not None:
+        __SUPERVISOR__.close()
+
+    # write out the hud visibility if it has not been saved yet
+    save_visibility()
 
     if perform_exit:
         sys.exit(0)
 
 
-if __name__ == '__main__':
+async def main():
+    """ Run the daemon. All state is owned by this event loop; GPIO edges,
+        timers and signals are all delivered to it as events.
+
+        Startup is ordered for a fast first hud: the hud saved by the last
+        run is drawn first, everything else is set up after that and the
+        live fuel gauge state replaces it once it has been read.
+    """
+    global __LOOP__, __EVENTS__, __STOP__, __TELEMETRY__, __POLICY__, __BATTERY_LOG__, __STATUS_SHM__
+    global __IS_VISIBLE__, __SAVED_VISIBILITY__, __CONFIG_SIGNATURE__
+    __LOOP__ = asyncio.get_running_loop()
+    __IS_VISIBLE__ = __SAVED_VISIBILITY__ = CONFIG.IS_VISIBLE
+    __CONFIG_SIGNATURE__ = config_file_signature(CONFIG.CONFIG_FILE_PATH)
+    __EVENTS__ = asyncio.Queue()
+    __STOP__ = __LOOP__.create_future()
+    __TELEMETRY__ = telemetry.TelemetryBuffer(CONFIG.TELEMETRY_HISTORY_SIZE)
+    __POLICY__ = policy.BatteryPolicy(**policy_settings())
     system_setup()
-    CONFIG = read_config_file(CONFIG["CONFIG_FILE_PATH"])
+    child_supervisor()
+    startup_phase("python & config")
 
-    # convert all relative paths to absolute paths
-    CONFIG["IMAGE_PATH"] = os.path.join(__SCRIPT_PATH__, CONFIG["IMAGE_PATH"])
-    CONFIG["LIB_PATH"] = os.path.join(__SCRIPT_PATH__, CONFIG["LIB_PATH"])
-    CONFIG["FUEL_GAUGE_SCRIPT_PATH"] = os.path.join(__SCRIPT_PATH__, CONFIG["FUEL_GAUGE_SCRIPT_PATH"])
+    if CONFIG.POWER_SWITCH_BEHAVIOR == "FLASH_INITIAL_ON":
+        flash_behavior()
+
+    if show_cached_hud():
+        startup_phase("cached hud")
+        __LOOP__.create_task(verify_screen_resolution())
 
+    assets_setup()
+    startup_phase("assets")
+    backend_setup()
     gpio_setup()
-    draw_hud(battery=get_state_of_charge(), is_charging=(not is_discharging()))
+    startup_phase("gpio & audio")
+
+    if CONFIG.BATTERY_LOG_PATH:
+        import battery_log
+        try:
+            __BATTERY_LOG__ = battery_log.BatteryLog(
+                CONFIG.BATTERY_LOG_PATH,
+                max_bytes=CONFIG.BATTERY_LOG_MAX_BYTES,
+                max_files=CONFIG.BATTERY_LOG_FILES,
+                flush_interval=CONFIG.BATTERY_LOG_FLUSH_INTERVAL
+            )
+        except OSError as e:
+            print("WARNING: could not open battery log: %s" % e)
+    if CONFIG.STATUS_SHM_PATH:
+        import status_shm
+        try:
+            __STATUS_SHM__ = status_shm.StatusWriter(CONFIG.STATUS_SHM_PATH)
+        except OSError as e:
+            print("WARNING: could not create status segment: %s" % e)
+
+    display_monitor_setup()
+    await control_setup()
+    config_watch_setup()
+    metrics_setup()
+    __LOOP__.create_task(dispatch_events())
+    startup_phase("services")
+
+    # no need to wait for more requests to coalesce with
+    request_redraw(0)
+
+    if await __STOP__ == "shutdown":
+        await shutdown()
+    else:
+        on_exit(0, 0, False)
 
-    if CONFIG["POWER_SWITCH_BEHAVIOR"] == "FLASH_INITIAL_ON":
-        flash_behavior()
 
-    # acquire this twice because we want the Lock to start out blocking this thread
-    __SHUTDOWN_LOCK__.acquire()
-    __SHUTDOWN_LOCK__.acquire()
-    shutdown()
+if __name__ == '__main__':
+    try:
+        CONFIG = load_config(CONFIG.CONFIG_FILE_PATH)
+    except ConfigError as e:
+        print(e)
+        sys.exit(1)
+
+    asyncio.run(main())
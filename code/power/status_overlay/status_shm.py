@@ -0,0 +1,250 @@
+#!/usr/bin/env python3
+""" Shared memory battery status published by the status overlay daemon.
+
+    The daemon keeps the latest fuel gauge snapshot in a small file under
+    /dev/shm (STATUS_SHM_PATH, "/dev/shm/status_overlay_status" by default)
+    so that other programs can read it without touching the I2C bus. Readers
+    mmap the file once; every read after that is plain memory access.
+
+    Layout (little endian, 64 bytes, stable for a given version):
+
+        offset  type     field
+         0      char[4]  magic "SOST"
+         4      u16      version (1)
+         6      u16      size of the segment in bytes (64)
+         8      u32      sequence, odd while the daemon is writing
+        12      u32      CRC-32 (zlib) of bytes 16 to 47
+        16      f64      timestamp of the sample (seconds since the epoch)
+        24      u16      state of charge (%)
+        26      u16      voltage (mV)
+        28      i16      average current (mA, negative while discharging)
+        30      u16      temperature (0.1 K)
+        32      u16      remaining capacity (mAh)
+        34      u16      full charge capacity (mAh)
+        36      u16      fuel gauge flags register
+        38      u16      status bits: 0 charging, 1 hud visible, 2 daemon running
+        40      i32      estimated seconds to empty, -1 if unknown
+        44      i32      estimated seconds to full, -1 if unknown
+        48      u8[16]   reserved
+
+    or, in C:
+
+        struct status_overlay_status {
+            char     magic[4];
+            uint16_t version;
+            uint16_t size;
+            uint32_t sequence;
+            uint32_t checksum;
+            double   timestamp;
+            uint16_t state_of_charge;
+            uint16_t voltage;
+            int16_t  average_current;
+            uint16_t temperature;
+            uint16_t remaining_capacity;
+            uint16_t full_charge_capacity;
+            uint16_t flags;
+            uint16_t status;
+            int32_t  time_to_empty;
+            int32_t  time_to_full;
+            uint8_t  reserved1[16];
+        };
+
+    Updates are published with a seqlock: the writer increments the sequence
+    before and after updating the payload. A reader copies the payload
+    between two reads of the sequence and retries if the sequence was odd or
+    changed in between. The writer is python and can not issue memory
+    barriers, so on a weakly ordered CPU (the ARM cores of a Raspberry Pi)
+    its stores may become visible to another core in a different order and
+    the sequence alone does not prove that a copy is consistent. Readers
+    therefore also check the checksum against the payload they copied and
+    retry if it does not match. A C reader should read the sequence with
+    __atomic_load_n(&s->sequence, __ATOMIC_ACQUIRE), copy the payload and the
+    checksum, issue __atomic_thread_fence(__ATOMIC_ACQUIRE) before reading
+    the sequence again, and then verify the checksum.
+
+    Usage (print the current status):
+
+        python3 status_shm.py [PATH]
+"""
+
+import collections
+import mmap
+import os
+import struct
+import sys
+import time
+import zlib
+
+
+MAGIC = b"SOST"
+VERSION = 1
+SIZE = 64
+DEFAULT_PATH = "/dev/shm/status_overlay_status"
+
+HEADER = struct.Struct("<4sHH")
+SEQUENCE = struct.Struct("<I")
+SEQUENCE_OFFSET = 8
+CHECKSUM = struct.Struct("<I")
+CHECKSUM_OFFSET = 12
+PAYLOAD = struct.Struct("<dHHhHHHHHii")
+PAYLOAD_OFFSET = 16
+
+STATUS_CHARGING = 0x0001
+STATUS_VISIBLE = 0x0002
+STATUS_RUNNING = 0x0004
+
+Status = collections.namedtuple("Status", [
+    "timestamp",
+    "state_of_charge",
+    "voltage",
+    "average_current",
+    "temperature",
+    "remaining_capacity",
+    "full_charge_capacity",
+    "flags",
+    "status",
+    "time_to_empty",    # seconds, None if unknown
+    "time_to_full",     # seconds, None if unknown
+])
+
+
+def _seconds(value):
+    return -1 if value is None else max(-1, min(0x7FFFFFFF, int(value)))
+
+
+class StatusWriter(object):
+    """ Owned by the daemon. Creates (or reuses) the segment and publishes
+        snapshots into it.
+    """
+
+    def __init__(self, path=DEFAULT_PATH):
+        self.path = path
+        fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            if os.fstat(fd).st_size != SIZE:
+                os.ftruncate(fd, SIZE)
+            self.map = mmap.mmap(fd, SIZE)
+        finally:
+            os.close(fd)
+
+        magic, version, size = HEADER.unpack_from(self.map, 0)
+        if (magic, version, size) != (MAGIC, VERSION, SIZE):
+            self.map[:] = bytes(SIZE)
+            HEADER.pack_into(self.map, 0, MAGIC, VERSION, SIZE)
+
+        # carry on from the last sequence so readers notice the restart, and
+        # recover from a writer that died half way through an update
+        self.sequence = SEQUENCE.unpack_from(self.map, SEQUENCE_OFFSET)[0]
+        if self.sequence & 1:
+            self.sequence += 1
+            SEQUENCE.pack_into(self.map, SEQUENCE_OFFSET, self.sequence)
+
+    def publish(self, snapshot, timestamp, charging, visible, time_to_empty=None, time_to_full=None, running=True):
+        """ Write a bq27441.FuelGaugeSnapshot (or anything with the same
+            fields) into the segment.
+        """
+        status = (STATUS_CHARGING if charging else 0) | (STATUS_VISIBLE if visible else 0) | \
+            (STATUS_RUNNING if running else 0)
+        payload = PAYLOAD.pack(
+            timestamp,
+            max(0, min(0xFFFF, snapshot.state_of_charge)),
+            snapshot.voltage,
+            snapshot.average_current,
+            snapshot.temperature,
+            snapshot.remaining_capacity,
+            snapshot.full_charge_capacity,
+            snapshot.flags,
+            status,
+            _seconds(time_to_empty),
+            _seconds(time_to_full)
+        )
+
+        self.sequence = (self.sequence + 1) & 0xFFFFFFFF
+        SEQUENCE.pack_into(self.map, SEQUENCE_OFFSET, self.sequence)
+        self.map[CHECKSUM_OFFSET:PAYLOAD_OFFSET + PAYLOAD.size] = CHECKSUM.pack(zlib.crc32(payload)) + payload
+        self.sequence = (self.sequence + 1) & 0xFFFFFFFF
+        SEQUENCE.pack_into(self.map, SEQUENCE_OFFSET, self.sequence)
+
+    def close(self):
+        """ Clear the running bit and unmap. The last status stays readable.
+        """
+        if self.map is None:
+            return
+        try:
+            status = read(self.map)
+        except TimeoutError:
+            status = None
+        if status is not None:
+            self.publish(status, status.timestamp, status.status & STATUS_CHARGING,
+                status.status & STATUS_VISIBLE, status.time_to_empty, status.time_to_full, running=False)
+        self.map.close()
+        self.map = None
+
+
+def read(buf, retries=1000):
+    """ Seqlock read of a Status from a mapped segment (or any buffer).
+        Returns None if no snapshot has been published yet.
+    """
+    for _ in range(retries):
+        before = SEQUENCE.unpack_from(buf, SEQUENCE_OFFSET)[0]
+        if before & 1:
+            continue
+        data = bytes(buf[CHECKSUM_OFFSET:PAYLOAD_OFFSET + PAYLOAD.size])
+        if SEQUENCE.unpack_from(buf, SEQUENCE_OFFSET)[0] == before:
+            if before == 0:
+                return None
+            if CHECKSUM.unpack_from(data, 0)[0] != zlib.crc32(data[CHECKSUM.size:]):
+                # torn copy, see the module docstring
+                continue
+            values = list(PAYLOAD.unpack_from(data, CHECKSUM.size))
+            values[-2] = None if values[-2] < 0 else values[-2]
+            values[-1] = None if values[-1] < 0 else values[-1]
+            return Status(*values)
+    raise TimeoutError("status segment kept changing while reading it")
+
+
+class StatusReader(object):
+    """ Maps the segment read only. read() does not make any system calls.
+    """
+
+    def __init__(self, path=DEFAULT_PATH):
+        with open(path, "rb") as fhandle:
+            self.map = mmap.mmap(fhandle.fileno(), SIZE, access=mmap.ACCESS_READ)
+
+        magic, version, size = HEADER.unpack_from(self.map, 0)
+        if magic != MAGIC or version != VERSION or size != SIZE:
+            self.map.close()
+            raise ValueError("%s is not a status overlay status segment (or has an unsupported version)" % path)
+
+    def read(self):
+        return read(self.map)
+
+    def sequence(self):
+        """ Changes every time the daemon publishes. Cheap to poll.
+        """
+        return SEQUENCE.unpack_from(self.map, SEQUENCE_OFFSET)[0]
+
+    def close(self):
+        self.map.close()
+
+
+if __name__ == '__main__':
+    reader = StatusReader(sys.argv[1] if len(sys.argv) > 1 else DEFAULT_PATH)
+    status = reader.read()
+    if status is None:
+        print("no status published yet")
+        sys.exit(1)
+
+    print("state of charge:  %d%%" % status.state_of_charge)
+    print("charging:         %s" % bool(status.status & STATUS_CHARGING))
+    print("hud visible:      %s" % bool(status.status & STATUS_VISIBLE))
+    print("daemon running:   %s" % bool(status.status & STATUS_RUNNING))
+    print("voltage:          %.3f V" % (status.voltage / 1000.0))
+    print("average current:  %d mA" % status.average_current)
+    print("temperature:      %.1f C" % (status.temperature / 10.0 - 273.15))
+    print("capacity:         %d / %d mAh" % (status.remaining_capacity, status.full_charge_capacity))
+    if status.time_to_empty is not None:
+        print("time to empty:    %d min" % (status.time_to_empty // 60))
+    if status.time_to_full is not None:
+        print("time to full:     %d min" % (status.time_to_full // 60))
+    print("updated:          %.0f s ago" % (time.time() - status.timestamp))
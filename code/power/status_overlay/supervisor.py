@@ -0,0 +1,166 @@
+#!/usr/bin/env python3
+""" Supervisor for the helper processes the status overlay starts (pngview,
+    raspi2png, ...).
+
+    Every child started with Supervisor.spawn() stays in the child table
+    until it has exited and been reaped, including children nobody keeps a
+    handle to. Exits are picked up by the event loop through a pidfd per
+    child (Linux 5.3+) or through SIGCHLD on older kernels, so killed
+    processes do not linger as zombies. The number of live children is
+    bounded and children that outlive their timeout are terminated.
+"""
+
+import os
+import signal
+import subprocess
+import time
+
+
+class ChildLimitError(ChildProcessError):
+    """ Raised by spawn() when max_children processes are already alive
+    """
+
+
+class Child(object):
+
+    def __init__(self, name, process):
+        self.name = name
+        self.process = process
+        self.started = time.monotonic()
+        self.timer = None   # timeout, then kill after the grace period
+        self.pidfd = None
+        self.killed = False # no longer counts against max_children
+
+
+def pidfd_supported():
+    if not hasattr(os, "pidfd_open"):
+        return False
+    try:
+        os.close(os.pidfd_open(os.getpid()))
+    except OSError:
+        return False
+    return True
+
+
+class Supervisor(object):
+    """ Owns the child processes of the daemon. Must only be used from the
+        thread running `loop`.
+    """
+
+    def __init__(self, loop, max_children=16, kill_grace=2):
+        self.loop = loop
+        self.max_children = max_children
+        self.kill_grace = kill_grace
+        self.children = {}  # pid -> Child
+        self.reaped = 0
+        self.timed_out = 0
+        self.use_pidfd = pidfd_supported()
+        if not self.use_pidfd:
+            loop.add_signal_handler(signal.SIGCHLD, self.reap)
+
+    def spawn(self, name, args, timeout=None, replaces=None, **kwargs):
+        """ Start `args` with subprocess.Popen(args, **kwargs) and return the
+            Popen. The child is terminated if it is still running after
+            `timeout` seconds (None for no limit). `replaces` is a child (its
+            Popen) that is killed once this one has started, it does not count
+            against max_children.
+        """
+        if self.running(replaces) >= self.max_children:
+            # exits can still be queued in the event loop
+            self.reap()
+            if self.running(replaces) >= self.max_children:
+                raise ChildLimitError("%d child processes are already running, not starting %s" % (
+                    self.running(replaces), name))
+
+        child = Child(name, subprocess.Popen(args, **kwargs))
+        self.children[child.process.pid] = child
+
+        if timeout is not None:
+            child.timer = self.loop.call_later(timeout, self._timed_out, child)
+        if self.use_pidfd:
+            # also works if the child has already exited: it is a zombie until reaped
+            child.pidfd = os.pidfd_open(child.process.pid)
+            self.loop.add_reader(child.pidfd, self._exited, child)
+        return child.process
+
+    def kill(self, process):
+        """ Kill a child without waiting for it. It is reaped once its exit
+            reaches the event loop and no longer counts against max_children
+            in the meantime.
+        """
+        child = self.children.get(process.pid)
+        if child is not None:
+            child.killed = True
+        process.kill()
+
+    def running(self, exclude=None):
+        """ Number of children that count against max_children
+        """
+        return sum(1 for child in self.children.values()
+            if not child.killed and child.process is not exclude)
+
+    def reap(self):
+        """ Reap every child that has exited
+        """
+        for child in list(self.children.values()):
+            if child.process.poll() is not None:
+                self._forget(child)
+
+    def table(self):
+        """ The live children, oldest first, for diagnostics
+        """
+        now = time.monotonic()
+        return [{
+            "pid": pid,
+            "name": child.name,
+            "command": child.process.args if isinstance(child.process.args, str) else
+                " ".join(str(arg) for arg in child.process.args),
+            "age": round(now - child.started, 3),
+            "timeout": child.timer is not None,
+        } for pid, child in sorted(self.children.items(), key=lambda item: item[1].started)]
+
+    def counts(self):
+        """ Returns {name: number of live children}
+        """
+        counts = {}
+        for child in list(self.children.values()):
+            counts[child.name] = counts.get(child.name, 0) + 1
+        return counts
+
+    def close(self, timeout=2):
+        """ Kill all children and wait for them
+        """
+        for child in list(self.children.values()):
+            child.process.kill()
+        deadline = time.monotonic() + timeout
+        for child in list(self.children.values()):
+            try:
+                child.process.wait(max(0, deadline - time.monotonic()))
+            except subprocess.TimeoutExpired:
+                print("WARNING: %s (pid %d) did not exit" % (child.name, child.process.pid))
+            self._forget(child)
+        if not self.use_pidfd:
+            self.loop.remove_signal_handler(signal.SIGCHLD)
+
+    def _exited(self, child):
+        if child.process.poll() is not None:
+            self._forget(child)
+
+    def _timed_out(self, child):
+        self.timed_out += 1
+        print("WARNING: %s (pid %d) timed out, terminating it" % (child.name, child.process.pid))
+        child.process.terminate()
+        child.timer = self.loop.call_later(self.kill_grace, child.process.kill)
+
+    def _forget(self, child):
+        if self.children.pop(child.process.pid, None) is None:
+            return
+        if child.process.returncode is not None:
+            self.reaped += 1
+        if child.timer is not None:
+            child.timer.cancel()
+            child.timer = None
+        if child.pidfd is not None:
+            self.loop.remove_reader(child.pidfd)
+            os.close(child.pidfd)
+            child.pidfd = None
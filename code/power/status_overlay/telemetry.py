@@ -0,0 +1,141 @@
+#!/usr/bin/env python3
+""" Battery telemetry history.
+
+    Samples are kept in a fixed size ring buffer backed by `array` columns so
+    that memory use stays constant no matter how long the daemon runs. The
+    history is used to estimate time to empty / time to full.
+"""
+
+import array
+import collections
+
+
+Sample = collections.namedtuple("Sample", [
+    "timestamp",            # seconds (time.time())
+    "state_of_charge",      # percent
+    "voltage",              # millivolts
+    "average_current",      # milliamps, negative while discharging
+    "temperature",          # 0.1 Kelvin
+    "remaining_capacity",   # mAh
+    "full_charge_capacity", # mAh
+    "flags",                # raw fuel gauge flags register
+])
+
+# array typecode for every Sample field, in order
+COLUMN_TYPES = "dBHhHHHH"
+
+
+class TelemetryBuffer(object):
+    """ Fixed capacity ring buffer of Samples. Once full, the oldest sample is
+        overwritten.
+    """
+
+    def __init__(self, capacity):
+        if capacity < 2:
+            raise ValueError("telemetry buffer needs room for at least 2 samples")
+        self.capacity = capacity
+        self.columns = [array.array(t, [0] * capacity) for t in COLUMN_TYPES]
+        self.head = 0   # index the next sample is written to
+        self.count = 0
+
+    def __len__(self):
+        return self.count
+
+    def append(self, timestamp, snapshot):
+        """ Store a sample from a bq27441.FuelGaugeSnapshot (or anything with
+            the same fields). Returns the stored Sample.
+        """
+        return self.append_sample(Sample(
+            timestamp,
+            max(0, min(255, snapshot.state_of_charge)),
+            snapshot.voltage,
+            snapshot.average_current,
+            snapshot.temperature,
+            snapshot.remaining_capacity,
+            snapshot.full_charge_capacity,
+            snapshot.flags
+        ))
+
+    def append_sample(self, sample):
+        for column, value in zip(self.columns, sample):
+            column[self.head] = value
+        self.head = (self.head + 1) % self.capacity
+        self.count = min(self.count + 1, self.capacity)
+        return sample
+
+    def clear(self):
+        self.head = 0
+        self.count = 0
+
+    def __getitem__(self, index):
+        """ Index 0 is the oldest sample, -1 the newest.
+        """
+        if index < 0:
+            index += self.count
+        if index < 0 or index >= self.count:
+            raise IndexError("telemetry index out of range")
+        pos = (self.head - self.count + index) % self.capacity
+        return Sample(*[column[pos] for column in self.columns])
+
+    def latest(self):
+        return self[-1] if self.count else None
+
+    def samples(self, since=None):
+        """ Iterate over the samples from oldest to newest, optionally only
+            those taken at or after the timestamp `since`.
+        """
+        for index in range(self.count):
+            sample = self[index]
+            if since is None or sample.timestamp >= since:
+                yield sample
+
+
+def soc_slope(samples):
+    """ Least squares slope of state of charge over time, in percent per
+        second. Returns None if there is not enough data.
+    """
+    samples = list(samples)
+    if len(samples) < 2:
+        return None
+
+    n = float(len(samples))
+    t0 = samples[0].timestamp
+    mean_t = sum(s.timestamp - t0 for s in samples) / n
+    mean_soc = sum(s.state_of_charge for s in samples) / n
+
+    var_t = sum((s.timestamp - t0 - mean_t) ** 2 for s in samples)
+    if var_t == 0:
+        return None
+
+    cov = sum((s.timestamp - t0 - mean_t) * (s.state_of_charge - mean_soc) for s in samples)
+    return cov / var_t
+
+
+def estimate(buffer, window, now=None):
+    """ Estimate the time to empty and time to full in seconds from the
+        telemetry history. Returns (time_to_empty, time_to_full); either is
+        None when it does not apply (e.g. time to empty while charging) or can
+        not be estimated.
+
+        The fuel gauge's average current and remaining capacity are preferred.
+        If the gauge does not report them, the trend of the state of charge
+        over the last `window` seconds is used instead.
+    """
+    latest = buffer.latest()
+    if latest is None:
+        return None, None
+
+    current = latest.average_current
+    if current != 0 and latest.full_charge_capacity > 0:
+        if current < 0:
+            return latest.remaining_capacity * 3600.0 / -current, None
+        missing = max(0, latest.full_charge_capacity - latest.remaining_capacity)
+        return None, missing * 3600.0 / current
+
+    now = latest.timestamp if now is None else now
+    slope = soc_slope(buffer.samples(since=now - window))
+    if slope is None or slope == 0:
+        return None, None
+    if slope < 0:
+        return latest.state_of_charge / -slope, None
+    return None, max(0, 100 - latest.state_of_charge) / slope
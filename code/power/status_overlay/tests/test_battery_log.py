@@ -0,0 +1,84 @@
+import os
+
+import pytest
+
+import battery_log
+import telemetry
+
+
+def sample(timestamp, soc=50, flags=battery_log.FLAG_DSG):
+    return telemetry.Sample(float(timestamp), soc, 3700, -420, 2981, 1300, 2600, flags)
+
+
+def test_records_are_fixed_size_little_endian(tmp_path):
+    log = battery_log.BatteryLog(str(tmp_path), flush_records=1)
+    log.append(sample(1000.5, soc=42))
+    log.close()
+
+    with open(os.path.join(str(tmp_path), battery_log.LOG_NAME), "rb") as fhandle:
+        data = fhandle.read()
+    assert battery_log.RECORD.size == 24
+    assert data[:8] == b"SOLG\x01\x00\x18\x00"
+    assert len(data) == 8 + 24
+    assert battery_log.RECORD.unpack(data[8:]) == tuple(sample(1000.5, soc=42))
+
+
+def test_round_trip(tmp_path):
+    samples = [sample(t, soc=100 - t) for t in range(10)]
+    log = battery_log.BatteryLog(str(tmp_path))
+    for item in samples:
+        log.append(item)
+    log.close()
+
+    assert list(battery_log.read_logs(str(tmp_path))) == samples
+
+
+def test_samples_are_batched(tmp_path):
+    log = battery_log.BatteryLog(str(tmp_path), flush_records=4)
+    for t in range(3):
+        log.append(sample(t))
+    assert list(battery_log.read_logs(str(tmp_path))) == []
+
+    log.append(sample(3))
+    assert len(list(battery_log.read_logs(str(tmp_path)))) == 4
+    log.close()
+
+
+def test_rotation_keeps_max_files(tmp_path):
+    size = battery_log.HEADER.size + 3 * battery_log.RECORD.size
+    log = battery_log.BatteryLog(str(tmp_path), max_bytes=size, max_files=3, flush_records=1)
+    for t in range(12):
+        log.append(sample(t))
+    log.close()
+
+    files = battery_log.log_files(str(tmp_path))
+    assert [os.path.basename(path) for path in files] == ["battery.log.2", "battery.log.1", "battery.log"]
+    assert all(os.path.getsize(path) <= size for path in files)
+    # the oldest samples were dropped, the rest are still in order
+    assert [s.timestamp for s in battery_log.read_logs(str(tmp_path))] == [float(t) for t in range(3, 12)]
+
+
+def test_reopened_log_appends(tmp_path):
+    for t in range(2):
+        log = battery_log.BatteryLog(str(tmp_path))
+        log.append(sample(t))
+        log.close()
+
+    assert [s.timestamp for s in battery_log.read_logs(str(tmp_path))] == [0.0, 1.0]
+
+
+def test_foreign_file_is_rejected(tmp_path):
+    with open(os.path.join(str(tmp_path), battery_log.LOG_NAME), "wb") as fhandle:
+        fhandle.write(b"not a battery log")
+
+    with pytest.raises(ValueError):
+        list(battery_log.read_logs(str(tmp_path)))
+
+
+def test_discharge_sessions():
+    charging = 0
+    samples = [sample(0), sample(60), sample(120, flags=charging), sample(180), sample(240),
+        sample(2000), sample(2060), sample(2120)]
+
+    sessions = list(battery_log.discharge_sessions(samples, max_gap=600))
+    assert [[s.timestamp for s in session] for session in sessions] == [[0, 60], [180, 240], [2000, 2060, 2120]]
@@ -0,0 +1,87 @@
+import json
+import os
+
+import pytest
+
+import status_overlay
+from status_overlay import ConfigError, convert_setting, load_config, parse_config
+
+
+def test_defaults_are_valid():
+    assert parse_config({}) == status_overlay.Config(**status_overlay.DEFAULTS)
+    for key, value in status_overlay.DEFAULTS.items():
+        assert convert_setting(key, value) == value
+
+
+@pytest.mark.parametrize("key, value, expected", [
+    ("HUD_CACHE_SIZE", 4.0, 4),
+    ("REDRAW_COALESCE_WINDOW", 1, 1.0),
+    ("POWER_SWITCH_FLASH_DURATION", 2.5, 2.5),
+    ("RENDERER", "SIM", "SIM"),
+    ("SIM_RESOLUTION", [1280, 720], (1280, 720)),
+])
+def test_values_are_converted(key, value, expected):
+    converted = convert_setting(key, value)
+    assert converted == expected
+    assert type(converted) is type(expected)
+
+
+@pytest.mark.parametrize("key, value", [
+    ("HUD_CACHE_SIZE", "4"),
+    ("HUD_CACHE_SIZE", 1.5),
+    ("HUD_CACHE_SIZE", True),
+    ("HUD_CACHE_SIZE", 0),
+    ("HUD_CACHE_SIZE", float("nan")),
+    ("HUD_CACHE_SIZE", float("inf")),
+    ("POWER_SWITCH_FLASH_DURATION", float("nan")),
+    ("POWER_SWITCH_FLASH_DURATION", -1),
+    ("REDRAW_COALESCE_WINDOW", 2),
+    ("LOW_BATTERY_THRESHOLD", 101),
+    ("RENDERER", "OPENGL"),
+    ("SIM_RESOLUTION", [1280]),
+    ("SIM_RESOLUTION", ["1280", "720"]),
+])
+def test_invalid_values_are_rejected(key, value):
+    with pytest.raises(ValueError):
+        convert_setting(key, value)
+
+
+def test_every_problem_is_reported():
+    with pytest.raises(ConfigError) as e:
+        parse_config({"HUD_CACHE_SIZE": 0, "RENDERER": "OPENGL", "NOT_A_SETTING": 1})
+
+    message = str(e.value)
+    assert "HUD_CACHE_SIZE" in message and "RENDERER" in message
+    assert "NOT_A_SETTING" not in message
+
+
+def test_config_is_immutable():
+    with pytest.raises(AttributeError):
+        parse_config({}).RENDERER = "SIM"
+
+
+def test_load_config(tmp_path):
+    path = os.path.join(str(tmp_path), "config")
+    with open(path, "w") as fhandle:
+        json.dump({"POWER_SWITCH_BEHAVIOR": "INITIAL_OFF", "IMAGE_PATH": "custom/"}, fhandle)
+
+    config = load_config(path)
+    assert config.IS_VISIBLE is False
+    assert config.IMAGE_PATH == os.path.join(status_overlay.__SCRIPT_PATH__, "custom/")
+
+
+def test_load_config_rejects_bad_json(tmp_path):
+    path = os.path.join(str(tmp_path), "config")
+    with open(path, "w") as fhandle:
+        fhandle.write("{not json")
+
+    with pytest.raises(ConfigError):
+        load_config(path)
+
+
+def test_missing_config_file_is_written_with_defaults(tmp_path):
+    path = os.path.join(str(tmp_path), "config")
+
+    assert load_config(path).RENDERER == status_overlay.DEFAULTS["RENDERER"]
+    with open(path) as fhandle:
+        assert json.load(fhandle)["RENDERER"] == status_overlay.DEFAULTS["RENDERER"]
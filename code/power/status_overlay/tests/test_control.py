@@ -0,0 +1,104 @@
+import asyncio
+import json
+
+import pytest
+
+import status_overlay
+
+
+class FakeTimer(object):
+
+    def __init__(self):
+        self.cancelled = False
+
+    def cancel(self):
+        self.cancelled = True
+
+
+class FakeLoop(object):
+    """ Records the timers instead of running them
+    """
+
+    def __init__(self):
+        self.timers = []
+
+    def call_later(self, delay, callback, *args):
+        self.timers.append((delay, callback))
+        return FakeTimer()
+
+
+class FakeWriter(object):
+
+    def __init__(self):
+        self.data = b""
+
+    def write(self, data):
+        self.data += data
+
+    async def drain(self):
+        pass
+
+    def close(self):
+        pass
+
+
+@pytest.fixture
+def loop(monkeypatch):
+    loop = FakeLoop()
+    monkeypatch.setattr(status_overlay, "__LOOP__", loop)
+    monkeypatch.setattr(status_overlay, "request_redraw", lambda *args, **kwargs: None)
+    return loop
+
+
+@pytest.mark.parametrize("duration", [float("nan"), float("inf"), float("-inf"), -1, "soon", None])
+def test_bad_durations_are_rejected(loop, monkeypatch, duration):
+    shown = []
+    monkeypatch.setattr(status_overlay, "flash_behavior", shown.append)
+    monkeypatch.setattr(status_overlay, "draw_notification", lambda *args: shown.append(args))
+
+    for cmd in ("flash", "notify"):
+        result = status_overlay.control_command({"cmd": cmd, "duration": duration, "image": "snapshot"})
+        assert result["ok"] is False
+        assert "duration" in result["error"] or "float" in result["error"]
+    assert shown == []
+
+
+def test_zero_duration_flash_ends_right_away(loop):
+    assert status_overlay.control_command({"cmd": "set_visibility", "visible": False})["ok"]
+    assert status_overlay.control_command({"cmd": "flash", "duration": 0})["ok"]
+
+    flashes = [callback for delay, callback in loop.timers if delay == 0]
+    assert len(flashes) == 1
+    assert status_overlay.__FLASH_TIMER__ is not None
+
+    flashes[0]()
+    assert status_overlay.__FLASH_TIMER__ is None
+
+
+def test_failing_command_is_reported(monkeypatch):
+    def broken(command):
+        return 1 // 0
+    monkeypatch.setitem(status_overlay.CONTROL_COMMANDS, "query", broken)
+
+    result = status_overlay.control_command({"cmd": "query"})
+    assert result == {"ok": False, "error": "ZeroDivisionError: integer division or modulo by zero"}
+
+
+def test_unknown_command():
+    assert status_overlay.control_command({"cmd": "explode"})["ok"] is False
+    assert status_overlay.control_command([1, 2])["ok"] is False
+
+
+def test_deeply_nested_json_keeps_the_connection(monkeypatch):
+    monkeypatch.setitem(status_overlay.CONTROL_COMMANDS, "ping", lambda command: {"pong": True})
+    reader = asyncio.StreamReader()
+    reader.feed_data(b"[" * 50000 + b"\n")
+    reader.feed_data(b'[{"cmd": "ping"}, {"cmd": "ping"}]\n')
+    reader.feed_eof()
+    writer = FakeWriter()
+
+    asyncio.run(status_overlay.control_client(reader, writer))
+
+    replies = [json.loads(line) for line in writer.data.splitlines()]
+    assert replies[0]["ok"] is False and "invalid JSON" in replies[0]["error"]
+    assert replies[1] == [{"pong": True, "ok": True}, {"pong": True, "ok": True}]
@@ -0,0 +1,148 @@
+import io
+import json
+
+import pytest
+
+import dispmanx
+import overlay_compositor
+
+
+class FakeDispmanx(object):
+    """ Records the DispmanX calls the compositor makes
+    """
+
+    def __init__(self):
+        self.calls = []
+        self.handles = 0
+
+    def _handle(self, kind):
+        self.handles += 1
+        return "%s%d" % (kind, self.handles)
+
+    def display_open(self, display_id):
+        return self._handle("display")
+
+    def display_size(self, handle):
+        return 640, 480
+
+    def display_close(self, handle):
+        self.calls.append(("display_close", handle))
+
+    def resource_create(self, width, height, rgba):
+        resource = self._handle("resource")
+        self.calls.append(("resource_create", resource))
+        return resource
+
+    def resource_delete(self, resource):
+        self.calls.append(("resource_delete", resource))
+
+    def update_start(self):
+        update = self._handle("update")
+        self.calls.append(("update_start", update))
+        return update
+
+    def update_submit_sync(self, update):
+        self.calls.append(("update_submit", update))
+
+    def element_add(self, update, display, layer, resource, x, y, width, height):
+        element = self._handle("element")
+        self.calls.append(("element_add", element, resource))
+        return element
+
+    def element_remove(self, update, element):
+        self.calls.append(("element_remove", element))
+
+    def element_change_source(self, update, element, resource):
+        self.calls.append(("element_change_source", element, resource))
+
+    def element_change(self, update, element, layer, x, y, width, height):
+        self.calls.append(("element_change", element))
+
+
+@pytest.fixture
+def fake(monkeypatch):
+    fake = FakeDispmanx()
+    for name in dir(fake):
+        if not name.startswith("_") and name != "calls" and name != "handles":
+            monkeypatch.setattr(dispmanx, name, getattr(fake, name))
+    return fake
+
+
+def commands(*items):
+    stream = b""
+    for command in items:
+        payload = command.pop("payload", None)
+        stream += json.dumps(command).encode("utf-8") + b"\n"
+        if payload is not None:
+            stream += payload
+    return stream
+
+
+def load(key, width=2, height=2):
+    return {"op": "load", "key": key, "width": width, "height": height, "size": width * height * 4,
+        "payload": bytes(width * height * 4)}
+
+
+def serve(*items):
+    stdout = io.BytesIO()
+    overlay_compositor.serve(io.BytesIO(commands(*items)), stdout)
+    return stdout.getvalue().decode("utf-8").splitlines()
+
+
+def test_commit_is_acknowledged(fake):
+    replies = serve(load("a"), {"op": "set", "id": "x", "key": "a"}, {"op": "commit", "ack": True},
+        {"op": "commit"}, {"op": "commit", "ack": True})
+
+    assert replies == ["ready", "ok 1", "ok 3"]
+
+
+def test_failed_change_is_reported_and_the_rest_applied(fake):
+    replies = serve(load("a"), {"op": "set", "id": "x", "key": "missing"},
+        {"op": "set", "id": "y", "key": "a"}, {"op": "commit", "ack": True})
+
+    assert replies[1].startswith("err 1 set x:")
+    assert [call[0] for call in fake.calls].count("element_add") == 1
+
+
+def test_bad_raw_load_does_not_desync_the_stream(fake):
+    bad = load("a")
+    bad["width"] = 3
+    replies = serve(bad, load("b"), {"op": "set", "id": "x", "key": "b"}, {"op": "commit", "ack": True})
+
+    assert replies == ["ready", "ok 1"]
+
+
+def test_changes_are_one_update(fake):
+    compositor = overlay_compositor.Compositor()
+    compositor.load("a", 2, 2, bytes(16))
+    compositor.load("b", 2, 2, bytes(16))
+    compositor.set("x", "a")
+    compositor.set("y", "b")
+    assert compositor.commit() == []
+    # nothing changed, so no update at all
+    assert compositor.commit() == []
+
+    calls = [call[0] for call in fake.calls]
+    assert calls == ["resource_create", "resource_create", "update_start", "element_add", "element_add",
+        "update_submit"]
+
+
+def test_unload_on_screen_waits_for_the_commit(fake):
+    serve(load("a"), load("b"), {"op": "set", "id": "x", "key": "a"}, {"op": "set", "id": "y", "key": "b"},
+        {"op": "commit"},
+        {"op": "set", "id": "y", "key": "a", "x": 5}, {"op": "unload", "key": "b"},
+        {"op": "commit"}, {"op": "quit"})
+
+    calls = [call[0] for call in fake.calls]
+    second = calls[calls.index("update_submit") + 1:]
+    # the move and the release of b are applied together, and b is only
+    # deleted once nothing shows it any more
+    assert second[:4] == ["update_start", "element_change_source", "element_change", "update_submit"]
+    assert second[4] == "resource_delete"
+
+
+def test_reloaded_image_swaps_the_source(fake):
+    serve(load("a"), {"op": "set", "id": "x", "key": "a"}, {"op": "commit"},
+        load("a"), {"op": "set", "id": "x", "key": "a"}, {"op": "commit"}, {"op": "quit"})
+
+    assert ("element_change_source", "element4", "resource5") in fake.calls
@@ -0,0 +1,65 @@
+import glob
+import os
+import struct
+import zlib
+
+import pytest
+
+import pngcodec
+
+
+IMAGES = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "images")
+
+
+def gradient(width, height):
+    return bytearray((x * 40 + c * 7 + y * 3) & 0xFF
+        for y in range(height) for x in range(width) for c in range(4))
+
+
+def test_round_trip():
+    rgba = gradient(5, 3)
+    assert pngcodec.decode(pngcodec.encode(5, 3, rgba)) == (5, 3, rgba)
+
+
+def test_rgb_gets_opaque_alpha():
+    rgb = bytes(range(2 * 2 * 3))
+    width, height, rgba = pngcodec.decode(pngcodec.encode(2, 2, rgb, channels=3))
+
+    assert (width, height) == (2, 2)
+    assert rgba[3::4] == b"\xff" * 4
+    assert bytes(rgba[0::4]) == rgb[0::3]
+
+
+def test_filters_are_undone():
+    # one scanline per filter type: none, sub, up, average, paeth
+    width, bpp = 3, 4
+    rows = [bytes(range(i * 12, i * 12 + 12)) for i in range(5)]
+    raw = b"".join(bytes((ftype,)) + row for ftype, row in enumerate(rows))
+    header = struct.pack(">IIBBBBB", width, len(rows), 8, pngcodec.COLOR_RGBA, 0, 0, 0)
+    data = pngcodec.PNG_SIGNATURE + pngcodec._chunk(b"IHDR", header) + \
+        pngcodec._chunk(b"IDAT", zlib.compress(raw)) + pngcodec._chunk(b"IEND", b"")
+
+    _, _, pixels = pngcodec.decode(data)
+    stride = width * bpp
+    assert pixels[:stride] == rows[0]
+    sub = pixels[stride:2 * stride]
+    assert sub[:bpp] == rows[1][:bpp] and sub[bpp] == (rows[1][bpp] + sub[0]) & 0xFF
+    up = pixels[2 * stride:3 * stride]
+    assert up[0] == (rows[2][0] + sub[0]) & 0xFF
+    average = pixels[3 * stride:4 * stride]
+    assert average[0] == (rows[3][0] + up[0] // 2) & 0xFF
+    paeth = pixels[4 * stride:5 * stride]
+    assert paeth[0] == (rows[4][0] + average[0]) & 0xFF
+
+
+@pytest.mark.parametrize("fname", sorted(glob.glob(os.path.join(IMAGES, "*.png"))))
+def test_shipped_images_decode(fname):
+    width, height, rgba = pngcodec.read(fname)
+    assert len(rgba) == width * height * 4
+
+
+@pytest.mark.parametrize("data", [b"", b"not a png at all, not even close........",
+    pngcodec.encode(2, 2, bytes(16))[:-20]])
+def test_invalid_files_raise(data):
+    with pytest.raises(pngcodec.PNGError):
+        pngcodec.decode(data)
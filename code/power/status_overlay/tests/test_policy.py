@@ -0,0 +1,100 @@
+import pytest
+
+import battery_log
+import policy
+import telemetry
+
+
+def sample(timestamp, soc, remaining, current=-600, flags=policy.FLAG_DSG):
+    # at 600 mA, 10 mAh last a minute
+    return telemetry.Sample(float(timestamp), soc, 3700, current, 2981, remaining, 2600, flags)
+
+
+def run(battery_policy, samples):
+    """ Returns [(timestamp, action kind, action value)] for a replay
+    """
+    return [(item.timestamp, action.kind, action.value)
+        for item, actions in policy.replay(samples, battery_policy) for action in actions]
+
+
+def make_policy(**settings):
+    settings.setdefault("smoothing", 0)
+    return policy.BatteryPolicy(**settings)
+
+
+def test_low_warning_is_given_once_with_hysteresis():
+    # the estimate wobbles around 20 minutes left
+    minutes = [25, 19, 21, 19.5, 22, 18]
+    samples = [sample(t * 60, 50, int(m * 10)) for t, m in enumerate(minutes)]
+
+    actions = run(make_policy(), samples)
+    assert [(t, kind) for t, kind, _ in actions] == [(60.0, "low")]
+    assert actions[0][2] == pytest.approx(19 * 60)
+
+
+def test_low_warning_is_armed_again_after_recovering():
+    minutes = [19, 24, 19]
+    samples = [sample(t * 60, 50, m * 10) for t, m in enumerate(minutes)]
+
+    assert [kind for _, kind, _ in run(make_policy(), samples)] == ["low", "low"]
+
+
+def test_shutdown_is_deferred_until_the_safety_margin():
+    battery_policy = make_policy(safety_margin=120)
+    actions = run(battery_policy, [sample(1000, 30, 40)])
+
+    # four minutes left, so shut down in two
+    assert actions == [(1000.0, "critical", pytest.approx(240)), (1000.0, "shutdown", pytest.approx(1120))]
+
+
+def test_shutdown_only_moves_earlier():
+    battery_policy = make_policy(safety_margin=120)
+    samples = [sample(0, 30, 40), sample(30, 30, 45), sample(60, 30, 20)]
+
+    shutdowns = [(t, value) for t, kind, value in run(battery_policy, samples) if kind == "shutdown"]
+    assert shutdowns == [(0.0, pytest.approx(120)), (60.0, pytest.approx(60))]
+
+
+def test_percent_backstop_does_not_trust_the_estimate():
+    # the gauge claims hours left, but the battery is at the critical percent
+    battery_policy = make_policy(critical_percent=5, safety_margin=120)
+    actions = run(battery_policy, [sample(500, 5, 2000)])
+
+    assert [kind for _, kind, _ in actions] == ["critical", "shutdown"]
+    assert actions[-1][2] == pytest.approx(620)
+
+
+def test_low_percent_warns_without_an_estimate():
+    # no current reading and a single sample, so no estimate at all
+    actions = run(make_policy(low_percent=10), [sample(0, 9, 500, current=0)])
+    assert actions == [(0.0, "low", None)]
+
+
+def test_charger_cancels_the_shutdown():
+    samples = [sample(0, 30, 40), sample(10, 30, 40, current=500, flags=0), sample(20, 30, 40)]
+    kinds = [kind for _, kind, _ in run(make_policy(), samples)]
+
+    assert kinds == ["critical", "shutdown", "cancel", "critical", "shutdown"]
+
+
+def test_replay_of_a_recorded_log(tmp_path):
+    # a recorded discharge at a steady 600 mA from 30 minutes left to empty,
+    # with the charger plugged in for a while before
+    log = battery_log.BatteryLog(str(tmp_path))
+    for t in range(5):
+        log.append(sample(t * 60, 40, 300, current=400, flags=0))
+    for t in range(31):
+        log.append(sample(600 + t * 60, 60 - t, 300 - t * 10))
+    log.close()
+
+    sessions = list(battery_log.discharge_sessions(battery_log.read_logs(str(tmp_path))))
+    assert len(sessions) == 1
+
+    actions = run(make_policy(), sessions[0])
+    assert [(t, kind) for t, kind, _ in actions] == [
+        (600.0 + 10 * 60, "low"),       # 20 minutes left
+        (600.0 + 25 * 60, "critical"),  # 5 minutes left
+        (600.0 + 25 * 60, "shutdown"),
+    ]
+    # done two minutes before the log ran out
+    assert actions[-1][2] == pytest.approx(600 + 28 * 60)
@@ -0,0 +1,78 @@
+import collections
+
+import scene
+from scene import Node
+
+
+Image = collections.namedtuple("Image", ["key", "rgba"])
+
+
+def node(image="a.png", display=0, layer=1, x=0, y=0):
+    return Node(image, display, layer, x, y)
+
+
+def test_diff():
+    old = {"gone": node(), "same": node(), "moved": node(x=0), "swapped": node("a.png")}
+    new = {"same": node(), "moved": node(x=5), "swapped": node("b.png"), "new": node()}
+
+    assert scene.diff(old, new) == [
+        (scene.REMOVE, "gone", node()),
+        (scene.MOVE, "moved", node(x=5)),
+        (scene.REPLACE, "swapped", node("b.png")),
+        (scene.ADD, "new", node()),
+    ]
+
+
+def test_images_are_compared_by_key():
+    old = {"hud": node(Image("battery-50", b"old pixels"))}
+
+    assert scene.diff(old, {"hud": node(Image("battery-50", b"new pixels"))}) == []
+    assert [op for op, _, _ in scene.diff(old, {"hud": node(Image("battery-60", b""))})] == [scene.REPLACE]
+
+
+def test_unchanged_flush_is_empty():
+    graph = scene.Scene()
+    graph.set("a", node())
+    assert graph.flush() == [(scene.ADD, "a", node())]
+
+    graph.set("a", node())
+    assert graph.flush() == []
+    assert graph.nodes == {"a": node()}
+
+
+def test_group_drops_its_old_sprites():
+    graph = scene.Scene()
+    graph.set("notification", node("n.png"))
+    graph.set_group("hud", {"battery": node("b.png"), "wifi": node("w.png")})
+    graph.flush()
+
+    graph.set_group("hud", {"battery": node("b.png", x=3)})
+    assert graph.flush() == [(scene.REMOVE, "wifi", node("w.png")), (scene.MOVE, "battery", node("b.png", x=3))]
+    assert set(graph.nodes) == {"notification", "battery"}
+
+
+def test_remove():
+    graph = scene.Scene()
+    graph.set("a", node())
+    graph.flush()
+
+    graph.remove("a")
+    graph.remove("never there")
+    assert graph.flush() == [(scene.REMOVE, "a", node())]
+
+
+def test_undo_retries_on_the_next_flush():
+    graph = scene.Scene()
+    graph.set("a", node("a.png"))
+    graph.flush()
+
+    shown = graph.nodes
+    graph.set("a", node("b.png"))
+    graph.set("new", node())
+    assert len(graph.flush()) == 2
+
+    # neither change made it to the screen
+    graph.undo("a", shown)
+    graph.undo("new", shown)
+    assert graph.nodes == {"a": node("a.png")}
+    assert graph.flush() == [(scene.REPLACE, "a", node("b.png")), (scene.ADD, "new", node())]
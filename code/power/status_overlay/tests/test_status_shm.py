@@ -0,0 +1,83 @@
+import collections
+import os
+
+import pytest
+
+import status_shm
+
+
+Snapshot = collections.namedtuple("Snapshot", ["state_of_charge", "voltage", "average_current", "temperature",
+    "remaining_capacity", "full_charge_capacity", "flags"])
+
+SNAPSHOT = Snapshot(64, 3801, -310, 2981, 1660, 2600, 0x0001)
+
+
+@pytest.fixture
+def path(tmp_path):
+    return os.path.join(str(tmp_path), "status")
+
+
+def test_nothing_published_yet(path):
+    writer = status_shm.StatusWriter(path)
+    reader = status_shm.StatusReader(path)
+
+    assert os.path.getsize(path) == status_shm.SIZE
+    assert reader.read() is None
+    reader.close()
+    writer.close()
+
+
+def test_publish_and_read(path):
+    writer = status_shm.StatusWriter(path)
+    reader = status_shm.StatusReader(path)
+    writer.publish(SNAPSHOT, 1234.5, charging=False, visible=True, time_to_empty=5400)
+
+    assert reader.read() == status_shm.Status(1234.5, 64, 3801, -310, 2981, 1660, 2600, 0x0001,
+        status_shm.STATUS_VISIBLE | status_shm.STATUS_RUNNING, 5400, None)
+    assert reader.sequence() == 2
+
+    writer.close()
+    status = reader.read()
+    assert not status.status & status_shm.STATUS_RUNNING
+    assert status.state_of_charge == 64
+    reader.close()
+
+
+def test_odd_sequence_is_retried(path):
+    writer = status_shm.StatusWriter(path)
+    writer.publish(SNAPSHOT, 1.0, charging=False, visible=False)
+    status_shm.SEQUENCE.pack_into(writer.map, status_shm.SEQUENCE_OFFSET, 3)
+
+    with pytest.raises(TimeoutError):
+        status_shm.read(writer.map, retries=10)
+
+
+def test_torn_payload_is_retried(path):
+    writer = status_shm.StatusWriter(path)
+    writer.publish(SNAPSHOT, 1.0, charging=False, visible=False)
+    writer.map[status_shm.PAYLOAD_OFFSET + 8] ^= 0xFF
+
+    with pytest.raises(TimeoutError):
+        status_shm.read(writer.map, retries=10)
+
+
+def test_restarted_writer_keeps_the_sequence_even(path):
+    writer = status_shm.StatusWriter(path)
+    writer.publish(SNAPSHOT, 1.0, charging=True, visible=False)
+    # a writer that died half way through an update
+    status_shm.SEQUENCE.pack_into(writer.map, status_shm.SEQUENCE_OFFSET, 3)
+    writer.map.close()
+    writer.map = None
+
+    writer = status_shm.StatusWriter(path)
+    assert writer.sequence == 4
+    assert status_shm.read(writer.map).status & status_shm.STATUS_CHARGING
+    writer.close()
+
+
+def test_foreign_file_is_rejected(path):
+    with open(path, "wb") as fhandle:
+        fhandle.write(bytes(status_shm.SIZE))
+
+    with pytest.raises(ValueError):
+        status_shm.StatusReader(path)
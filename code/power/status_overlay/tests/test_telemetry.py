@@ -0,0 +1,63 @@
+import pytest
+
+import telemetry
+
+
+def sample(timestamp, soc, current=0, remaining=0, full=0, flags=0):
+    return telemetry.Sample(timestamp, soc, 3700, current, 2981, remaining, full, flags)
+
+
+def buffer_of(samples, capacity=16):
+    buffer = telemetry.TelemetryBuffer(capacity)
+    for item in samples:
+        buffer.append_sample(item)
+    return buffer
+
+
+def test_ring_buffer_keeps_the_newest():
+    buffer = buffer_of([sample(t, 100 - t) for t in range(5)], capacity=3)
+
+    assert len(buffer) == 3
+    assert [s.timestamp for s in buffer.samples()] == [2, 3, 4]
+    assert buffer[0].state_of_charge == 98
+    assert buffer.latest() == buffer[-1] == sample(4, 96)
+    with pytest.raises(IndexError):
+        buffer[3]
+
+
+def test_samples_since():
+    buffer = buffer_of([sample(t * 10, 50) for t in range(6)])
+    assert [s.timestamp for s in buffer.samples(since=30)] == [30, 40, 50]
+
+
+def test_estimate_from_current():
+    # 1000 mAh left at 500 mA is two hours
+    buffer = buffer_of([sample(0, 40, current=-500, remaining=1000, full=2500)])
+    assert telemetry.estimate(buffer, 600) == (7200.0, None)
+
+    # 1500 mAh missing at 750 mA is two hours to full
+    buffer = buffer_of([sample(0, 40, current=750, remaining=1000, full=2500)])
+    assert telemetry.estimate(buffer, 600) == (None, 7200.0)
+
+
+def test_estimate_from_slope_without_current():
+    # one percent per minute
+    buffer = buffer_of([sample(t * 60, 50 - t) for t in range(6)])
+    time_to_empty, time_to_full = telemetry.estimate(buffer, 600)
+
+    assert time_to_empty == pytest.approx(45 * 60)
+    assert time_to_full is None
+
+
+def test_estimate_only_uses_the_window():
+    # charging long ago, discharging for the last five minutes
+    samples = [sample(t * 60, 20 + t) for t in range(10)] + [sample(600 + t * 60, 29 - t) for t in range(6)]
+    time_to_empty, _ = telemetry.estimate(buffer_of(samples, capacity=32), 300)
+
+    assert time_to_empty == pytest.approx(24 * 60)
+
+
+def test_estimate_needs_a_trend():
+    assert telemetry.estimate(telemetry.TelemetryBuffer(4), 600) == (None, None)
+    assert telemetry.estimate(buffer_of([sample(0, 50)]), 600) == (None, None)
+    assert telemetry.estimate(buffer_of([sample(0, 50), sample(60, 50)]), 600) == (None, None)